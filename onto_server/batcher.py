@@ -0,0 +1,147 @@
+# batcher.py
+# Cross-request micro-batching of model inference. With several backends
+# planning at once, each select_plan would run its own tiny forward pass; the
+# batcher instead gathers the arm matrices of concurrent requests for up to
+# ONTO_BATCH_WINDOW_MS (or ONTO_BATCH_MAX matrices), runs one padded forward
+# pass and hands every waiter its rows back.
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class _Pending:
+    __slots__ = ("model", "method", "mats", "submitted", "done", "result", "error")
+
+    def __init__(self, model, method, mats):
+        self.model = model
+        self.method = method
+        self.mats = mats
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    predict(model, plans) -> model.predict(plans) with the forward pass shared
+    across concurrent callers. Featurization stays on the caller's thread; only
+    a network with forward_many(mats) (NumpyOntoRegression's) is batched, other
+    models are called directly.
+    """
+
+    def __init__(self, window_ms=1.0, max_batch=64, history=10000):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._cond = threading.Condition()
+        self._pending = []
+        self._batch_sizes = collections.Counter()
+        self._requests_per_batch = collections.Counter()
+        self._delays = collections.deque(maxlen=history)
+        self._forward_seconds = 0.0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name="onto-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, model, plans):
+        forward = self.forward_for(model)
+        if forward is None:
+            return model.predict(plans)
+        return model.predict(plans, forward=forward)
+
+    def forward_for(self, model):
+        """
+        forward(mats) -> deltas through the batcher for model (every member's,
+        forward_members, for an ensemble), None if it cannot batch.
+        """
+        net = getattr(model, "model", None)
+        if not hasattr(net, "forward_many"):
+            return None
+        method = "forward_members" if getattr(net, "members", 1) > 1 else "forward_many"
+        return lambda mats: self._submit(net, mats, method)
+
+    def _submit(self, net, mats, method="forward_many"):
+        p = _Pending(net, method, mats)
+        with self._cond:
+            self._pending.append(p)
+            self._cond.notify()
+        p.done.wait()
+        if p.error is not None:
+            raise p.error
+        return p.result
+
+    def _take(self):
+        # block for the first request, then gather until the window closes or
+        # the batch is full; a request's arms always stay in one batch
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0].submitted + self.window
+            while sum(len(p.mats) for p in self._pending) < self.max_batch:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0].mats) <= self.max_batch):
+                p = self._pending.pop(0)
+                batch.append(p)
+                size += len(p.mats)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            start = time.perf_counter()
+            # a model swap can leave requests for two models in one window
+            by_model = collections.OrderedDict()
+            for p in batch:
+                by_model.setdefault((id(p.model), p.method), []).append(p)
+            for group in by_model.values():
+                try:
+                    forward = getattr(group[0].model, group[0].method)
+                    delta = forward([m for p in group for m in p.mats])
+                    offset = 0
+                    for p in group:
+                        p.result = delta[offset:offset + len(p.mats)]
+                        offset += len(p.mats)
+                except Exception as e:
+                    for p in group:
+                        p.error = e
+            took = time.perf_counter() - start
+            with self._cond:
+                self._batches += 1
+                self._forward_seconds += took
+                self._batch_sizes[sum(len(p.mats) for p in batch)] += 1
+                self._requests_per_batch[len(batch)] += 1
+                self._delays.extend(start - p.submitted for p in batch)
+            for p in batch:
+                p.done.set()
+
+    def stats(self):
+        """Batch size (matrices and requests) distributions and queueing delay in ms."""
+        with self._cond:
+            delays = np.array(self._delays) * 1000.0
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": self._batches,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "requests_per_batch": dict(sorted(self._requests_per_batch.items())),
+                "queue_ms_p50": round(float(np.percentile(delays, 50)), 3) if len(delays) else None,
+                "queue_ms_p95": round(float(np.percentile(delays, 95)), 3) if len(delays) else None,
+                "queue_ms_max": round(float(delays.max()), 3) if len(delays) else None,
+                "forward_ms_mean": round(self._forward_seconds / self._batches * 1000.0, 3)
+                if self._batches else None,
+            }
+
+
+def from_env():
+    """A MicroBatcher when ONTO_BATCH_WINDOW_MS > 0 (ONTO_BATCH_MAX caps it), else None."""
+    window_ms = float(os.getenv("ONTO_BATCH_WINDOW_MS", "0"))
+    if window_ms <= 0:
+        return None
+    return MicroBatcher(window_ms=window_ms, max_batch=int(os.getenv("ONTO_BATCH_MAX", "64")))
@@ -0,0 +1,666 @@
+# bench.py
+# Micro-benchmarks for the Onto server hot paths. Run from onto_server/, e.g.
+#   python3 bench.py featurize --limit 2000
+import argparse
+import json
+import os
+import time
+
+
+def _timed(fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best, res
+
+
+def _experience_plans(limit):
+    import storage
+    rows = storage.experience()[:limit]
+    plans = []
+    for plan_str, _reward in rows:
+        obj = json.loads(plan_str)
+        if "Plan" not in obj:
+            obj = {"Plan": obj, "metadata": obj.get("metadata", {})}
+        plans.append(obj)
+    return plans
+
+
+def bench_featurize(args):
+    import featurize_pool
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to featurize.")
+        return
+    tasks = [(dict(p.get("metadata", {}) or {}), p) for p in plans]
+
+    max_workers = args.max_workers or (os.cpu_count() or 1)
+    counts = sorted({1} | {w for w in (2, 4, 8, 16, 32) if w <= max_workers} | {max_workers})
+
+    print(f"featurizing {len(tasks)} plans, cpu_count={os.cpu_count()}")
+    base = None
+    for w in counts:
+        took, _ = _timed(lambda: featurize_pool.build_feature_matrices(
+            tasks, args.num_arms, workers=w), repeat=args.repeat)
+        base = took if base is None else base
+        print(f"workers={w:<3d} {took:8.3f}s  speedup={base / took:5.2f}x")
+
+
+def _synthetic_items(n, dim, num_arms, n_templates, noise, seed=0):
+    import numpy as np
+    from sampler import Item
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_templates, dim)).astype(np.float32)
+    tpl = rng.integers(0, n_templates, size=n)
+    vecs = centers[tpl] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    arms = rng.integers(0, num_arms, size=n)
+    rewards = rng.lognormal(0.0, 1.0, size=n)
+    return [Item(meta={"template_id": f"t{tpl[i]}"}, reward=float(rewards[i]), arm=int(arms[i]),
+                 v_sql=vecs[i], v_all=vecs[i], template=f"t{tpl[i]}", raw=(str(i), float(rewards[i])))
+            for i in range(n)]
+
+
+def bench_sampler(args):
+    import sampler
+
+    items = _synthetic_items(args.n, args.dim, args.num_arms, args.templates, args.noise)
+    print(f"selecting {args.budget} of {len(items)} items, dim={args.dim}, "
+          f"templates={args.templates}")
+
+    kw = dict(num_arms=args.num_arms, budget=args.budget, per_template_cap=args.cap,
+              arm_min_coverage=args.arm_min, template_getter=lambda it: it.meta["template_id"])
+
+    took, _ = _timed(lambda: sampler._sketch_items(items, args.sketch_dim))
+    print(f"sketch (dim={args.sketch_dim}) {took:8.3f}s")
+    took, picked = _timed(lambda: sampler.select_from_items(
+        items, sketch_dim=args.sketch_dim, sketch_min_items=args.sketch_min, **kw))
+    print(f"select (sketch)     {took:8.3f}s  -> {len(picked)} items")
+    if args.exact:
+        took, picked = _timed(lambda: sampler.select_from_items(items, sketch_dim=0, **kw))
+        print(f"select (exact)      {took:8.3f}s  -> {len(picked)} items")
+
+
+def bench_sampler_stream(args):
+    import tracemalloc
+    import sampler
+
+    print(f"streaming {args.n} items in batches of {args.batch}, budget={args.budget}")
+    s = sampler.StreamingSampler(num_arms=args.num_arms, budget=args.budget,
+                                 per_template_cap=args.cap, arm_min_coverage=args.arm_min,
+                                 template_getter=lambda it: it.meta["template_id"],
+                                 sketch_dim=args.sketch_dim)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for b in range(0, args.n, args.batch):
+        n = min(args.batch, args.n - b)
+        s.add_items(_synthetic_items(n, args.dim, args.num_arms, args.templates,
+                                     args.noise, seed=b))
+    picked = s.result()
+    took = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"stream select        {took:8.3f}s  -> {len(picked)} items, "
+          f"retained={len(s.items)}, peak={peak / 2**20:.1f} MiB")
+
+
+def _query_files(root):
+    import glob
+    return sorted(glob.glob(os.path.join(root, "**", "*.sql"), recursive=True))
+
+
+def bench_sql_analysis(args):
+    from sqlglot_parse import parse_sqlglot, enrich_sql_semantics, analyze_sql
+
+    sqls = []
+    for f in _query_files(args.queries)[:args.limit]:
+        with open(f) as fh:
+            q = fh.read()
+        try:
+            analyze_sql(q)
+        except Exception:
+            continue
+        sqls.append(q)
+    print(f"analyzing {len(sqls)} queries from {args.queries}")
+
+    def _two_pass():
+        for q in sqls:
+            parse_sqlglot(q)
+            enrich_sql_semantics(q)
+
+    def _one_pass():
+        for q in sqls:
+            analyze_sql(q)
+
+    old, _ = _timed(_two_pass, repeat=args.repeat)
+    new, _ = _timed(_one_pass, repeat=args.repeat)
+    print(f"parse_sqlglot + enrich_sql_semantics {old:8.3f}s")
+    print(f"analyze_sql                          {new:8.3f}s  speedup={old / new:5.2f}x")
+
+    import tempfile
+    from sql_analysis_cache import SQLAnalysisCache
+    with tempfile.TemporaryDirectory() as d:
+        db = os.path.join(d, "cache.db")
+        cold = SQLAnalysisCache(db_path=db)
+        took, _ = _timed(lambda: [cold.analyze(q) for q in sqls])
+        print(f"SQLAnalysisCache (empty)             {took:8.3f}s  speedup={old / took:5.2f}x")
+        warm = SQLAnalysisCache(db_path=db)
+        took, _ = _timed(lambda: [warm.analyze(q) for q in sqls])
+        print(f"SQLAnalysisCache (persisted)         {took:8.3f}s  speedup={old / took:5.2f}x")
+        print("metrics:", warm.metrics())
+
+
+def bench_infer(args):
+    import copy
+    import numpy as np
+    import numpy_infer
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to predict on.")
+        return
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans]
+
+    start = time.perf_counter()
+    fast = numpy_infer.NumpyOntoRegression().load(args.model)
+    print(f"numpy load  {time.perf_counter() - start:8.3f}s")
+    start = time.perf_counter()
+    import model
+    slow = model.OntoRegression().load(args.model)
+    print(f"torch load  {time.perf_counter() - start:8.3f}s (including import torch)")
+
+    worst = 0.0
+    for r in reqs:
+        a, b = slow.predict(copy.deepcopy(r)), fast.predict(copy.deepcopy(r))
+        worst = max(worst, float(np.max(np.abs(a - b) / np.maximum(1.0, np.abs(a)))))
+    print(f"{len(reqs)} requests x {args.num_arms} arms, max error {worst:.2e}")
+    for name, m in (("torch", slow), ("numpy", fast)):
+        took, _ = _timed(lambda: [m.predict(copy.deepcopy(r)) for r in reqs], repeat=args.repeat)
+        print(f"{name} predict {took / len(reqs) * 1000:8.3f}ms/request")
+
+
+def bench_torch_runtime(args):
+    import copy
+    import model
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to predict on.")
+        return
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans]
+
+    os.environ["ONTO_TORCH_THREADS"] = str(args.threads)
+    # as the server does before loading a torch model
+    model.pin_torch_threads()
+    for runtime in model.RUNTIMES:
+        os.environ["ONTO_TORCH_RUNTIME"] = runtime
+        m = model.OntoRegression().load(args.model)
+        took, _ = _timed(lambda: [m.predict(copy.deepcopy(r)) for r in reqs], repeat=args.repeat)
+        print(f"{runtime:<9} {took / len(reqs) * 1000:8.3f}ms/request  drift={m.drift}")
+
+
+def bench_batching(args):
+    import copy
+    import threading
+    import batcher
+    import numpy_infer
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to predict on.")
+        return
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans]
+    reg = numpy_infer.NumpyOntoRegression().load(args.model)
+    # featurize up front: this measures the forward passes the batcher shares
+    feats = [reg.featurize(copy.deepcopy(r)) for r in reqs]
+
+    def _clients(predict):
+        def _client(c):
+            for i in range(c, len(feats), args.clients):
+                mats, arm_ids = feats[i]
+                delta = predict(mats)
+                reg.rewards(delta[range(len(mats)), arm_ids])
+        threads = [threading.Thread(target=_client, args=(c,)) for c in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    took, _ = _timed(lambda: _clients(reg.model.forward_many), repeat=args.repeat)
+    print(f"{args.clients} clients, unbatched       {len(feats) / took:8.1f} requests/s")
+    for window in args.windows:
+        b = batcher.MicroBatcher(window_ms=window, max_batch=args.max_batch)
+        took, _ = _timed(lambda: _clients(lambda mats: b._submit(reg.model, mats)), repeat=args.repeat)
+        print(f"{args.clients} clients, window={window:<5}ms {len(feats) / took:8.1f} requests/s  {b.stats()}")
+
+
+def bench_cascade(args):
+    import copy
+    import numpy as np
+    import numpy_infer
+    import surrogate
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to predict on.")
+        return
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans]
+    reg = numpy_infer.NumpyOntoRegression().load(args.model)
+    if reg.surrogate is None:
+        print(f"{args.model} has no onto_surrogate; retrain it to distill one.")
+        return
+    print("surrogate fit:", reg.surrogate.report)
+
+    took, full = _timed(lambda: [reg.predict(copy.deepcopy(r)) for r in reqs], repeat=args.repeat)
+    best = [int(np.argmin(f)) for f in full]
+    print(f"cnn only      {took / len(reqs) * 1000:8.3f}ms/request")
+    for m in args.margins:
+        cascade = surrogate.Cascade(min_margin=m, audit=0.0)
+        took, out = _timed(lambda: [cascade.predict(reg, copy.deepcopy(r)) for r in reqs], repeat=args.repeat)
+        agree = np.mean([int(np.argmin(o)) == b for o, b in zip(out, best)])
+        stats = cascade.stats()
+        print(f"margin={m:<5} {took / len(reqs) * 1000:8.3f}ms/request  "
+              f"hit_rate={stats['hit_rate']:.2f}  agreement with cnn={agree:.3f}")
+
+
+def bench_backend(args):
+    import copy
+    import tempfile
+    import numpy as np
+    import storage
+    import model
+    import numpy_infer
+
+    rows = storage.experience()[:args.limit]
+    if len(rows) < 10:
+        print("Not enough experience in onto.db to train on.")
+        return
+    plans, rewards = [], []
+    for plan_str, reward in rows:
+        obj = json.loads(plan_str)
+        if "Plan" not in obj:
+            obj = {"Plan": obj, "metadata": obj.get("metadata", {})}
+        plans.append(obj)
+        rewards.append(float(reward))
+    split = int(len(plans) * 0.8)
+    truth = np.array(rewards[split:])
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans[split:]]
+
+    for backend in args.backends:
+        os.environ["ONTO_BACKEND"] = backend
+        reg = model.OntoRegression()
+        train_took, _ = _timed(lambda: reg.fit(copy.deepcopy(plans[:split]), rewards[:split], seed=0))
+        with tempfile.TemporaryDirectory() as d:
+            reg.save(d)
+            fast = numpy_infer.NumpyOntoRegression().load(d)
+        took, _ = _timed(lambda: [fast.predict(copy.deepcopy(r)) for r in reqs], repeat=args.repeat)
+        pred = np.array([fast.predict([copy.deepcopy(r[0])])[0] for r in reqs])
+        mae = float(np.mean(np.abs(pred - truth)))
+        print(f"{backend:<4} train {train_took:7.2f}s  plan {took / len(reqs) * 1000:7.3f}ms/request "
+              f"({args.num_arms} arms)  held-out MAE={mae:.4f}")
+
+
+def bench_knn(args):
+    import numpy as np
+    from knn_memory import KNNMemory, _normalize
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.templates, args.dim)).astype(np.float32)
+    tpl = rng.integers(0, args.templates, size=args.n)
+    g = centers[tpl] + 0.3 * rng.standard_normal((args.n, args.dim)).astype(np.float32)
+    y = rng.random(args.n).astype(np.float32)
+    arms = rng.integers(0, args.num_arms, size=args.n)
+    q_tpl = rng.integers(0, args.templates, size=args.queries)
+    queries = [(centers[t] + 0.3 * rng.standard_normal((args.num_arms, args.dim))).astype(np.float32)
+               for t in q_tpl]
+    arm_ids = list(range(args.num_arms))
+    pred = np.full(args.num_arms, 0.5)
+
+    flat = None
+    for name, nlist in (("flat", 1), ("ivf", None)):
+        os.environ["ONTO_KNN_IVF_MIN"] = "1"
+        took, mem = _timed(lambda: KNNMemory(g, y, arms, args.num_arms, nlist=nlist, nprobe=args.nprobe))
+        flat = flat or mem
+        search, _ = _timed(lambda: [mem.blend(q, arm_ids, pred) for q in queries], repeat=args.repeat)
+        hits = 0
+        for q in queries[:100]:
+            qn = _normalize(q)
+            for a in arm_ids:
+                want = set(np.round(flat.search(qn[a], a)[0], 5))
+                hits += len(want & set(np.round(mem.search(qn[a], a)[0], 5))) / max(1, len(want))
+        recall = hits / (min(100, len(queries)) * args.num_arms)
+        print(f"{name:<4} lists={len(mem.centroids):<4d} build {took:6.2f}s  "
+              f"{search / len(queries) * 1000:7.3f}ms per {args.num_arms}-arm request  recall@{mem.k}={recall:.3f}")
+
+
+def bench_ensemble(args):
+    import tempfile
+    import torch
+    import numpy_infer
+    from net_cnn_delta import CNNMatrixDelta
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to featurize.")
+        return
+    reg = numpy_infer.NumpyOntoRegression()
+    reqs = [reg.featurize([dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+                           for a in range(args.num_arms)])[0] for p in plans]
+    in_channels = reqs[0][0].shape[1]
+
+    def _numpy_net(members, seed):
+        torch.manual_seed(seed)
+        net = CNNMatrixDelta(in_channels, args.num_arms, ensemble=members).eval()
+        with tempfile.TemporaryDirectory() as d:
+            numpy_infer.export_npz(net.state_dict(), os.path.join(d, "net.npz"), args.num_arms)
+            return numpy_infer.load_network(os.path.join(d, "net.npz"))
+
+    single = _numpy_net(1, 0)
+    base, _ = _timed(lambda: [single.forward_many(m) for m in reqs], repeat=args.repeat)
+    print(f"single head         {base / len(reqs) * 1000:8.3f}ms/request")
+    for m in args.members:
+        nets = [_numpy_net(1, s) for s in range(m)]
+        took, _ = _timed(lambda: [[n.forward_many(x) for n in nets] for x in reqs], repeat=args.repeat)
+        print(f"{m} separate models   {took / len(reqs) * 1000:8.3f}ms/request  x{took / base:5.2f}")
+        ens = _numpy_net(m, 0)
+        took, _ = _timed(lambda: [ens.forward_members(x) for x in reqs], repeat=args.repeat)
+        print(f"{m}-head ensemble     {took / len(reqs) * 1000:8.3f}ms/request  x{took / base:5.2f}")
+
+
+def bench_prune(args):
+    import copy
+    import tempfile
+    import numpy as np
+    import storage
+    import featurize
+    import model
+    import numpy_infer
+
+    rows = storage.experience()[:args.limit]
+    if len(rows) < 10:
+        print("Not enough experience in onto.db to train on.")
+        return
+    plans, rewards = [], []
+    for plan_str, reward in rows:
+        obj = json.loads(plan_str)
+        if "Plan" not in obj:
+            obj = {"Plan": obj, "metadata": obj.get("metadata", {})}
+        plans.append(obj)
+        rewards.append(float(reward))
+    split = int(len(plans) * 0.8)
+    test = [[dict(p, metadata=dict(p.get("metadata", {}) or {}))] for p in plans[split:]]
+    truth = np.array(rewards[split:])
+
+    for setting in args.settings:
+        os.environ["ONTO_ATTR_PRUNE"] = setting
+        prune = featurize.attr_prune()
+        widths = [featurize.build_model_input(copy.deepcopy(p.get("metadata", {})), args.num_arms, p,
+                                              model.default_feature_mode(), prune).shape[0]
+                  for p in plans[split:]]
+        reg = model.OntoRegression()
+        reg.fit(copy.deepcopy(plans[:split]), rewards[:split], seed=0)
+        with tempfile.TemporaryDirectory() as d:
+            reg.save(d)
+            fast = numpy_infer.NumpyOntoRegression().load(d)
+        took, pred = _timed(lambda: [fast.predict(copy.deepcopy(r))[0] for r in test], repeat=args.repeat)
+        mae = float(np.mean(np.abs(np.array(pred) - truth)))
+        print(f"{setting:<5} columns mean={np.mean(widths):6.1f} max={max(widths):4d}  "
+              f"{took / len(test) * 1000:7.3f}ms/plan  held-out MAE={mae:.4f}")
+
+
+def bench_load(args):
+    import copy
+    import tempfile
+    import numpy as np
+    import model
+    import model_artifact
+    import numpy_infer
+
+    plans = _experience_plans(args.limit)
+    reqs = [[dict(p, metadata=dict(p.get("metadata", {}) or {}), arm_config={"index": a})
+             for a in range(args.num_arms)] for p in plans]
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy, single = os.path.join(tmp, "legacy"), os.path.join(tmp, "single")
+        reg = model.OntoRegression().load(args.model)
+        reg.save(legacy, legacy=True)
+        os.remove(model_artifact.artifact_path(legacy))
+        reg.save(single)
+        print(f"{model_artifact.FILE_NAME} {os.path.getsize(model_artifact.artifact_path(single)) / 1024:8.1f}KiB")
+        for name, d in (("joblib + npz", legacy), ("artifact", single)):
+            took, reg = _timed(lambda: numpy_infer.NumpyOntoRegression().load(d), repeat=args.repeat)
+            print(f"{name:<13} load {took * 1000:8.3f}ms")
+        os.environ["ONTO_ARTIFACT_VERIFY"] = "0"
+        took, _ = _timed(lambda: numpy_infer.NumpyOntoRegression().load(single), repeat=args.repeat)
+        print(f"{'no crc32':<13} load {took * 1000:8.3f}ms")
+        old, new = numpy_infer.NumpyOntoRegression().load(legacy), numpy_infer.NumpyOntoRegression().load(single)
+        worst = 0.0
+        for r in reqs:
+            a, b = old.predict(copy.deepcopy(r)), new.predict(copy.deepcopy(r))
+            worst = max(worst, float(np.max(np.abs(a - b) / np.maximum(1.0, np.abs(a)))))
+        print(f"{len(reqs)} requests x {args.num_arms} arms, max error {worst:.2e}")
+
+
+def bench_memo(args):
+    import copy
+    import random
+    import numpy as np
+    import numpy_infer
+    import prediction_cache
+    import surrogate
+
+    plans = _experience_plans(args.limit)
+    if not plans:
+        print("No experience in onto.db to predict on.")
+        return
+    reg = numpy_infer.NumpyOntoRegression().load(args.model)
+
+    def _request(p):
+        # as decoded off the socket: fresh objects for every arm; arms
+        # 1..same_plan_arms are hinted to arm 0's plan, the others get their own
+        arms = []
+        for a in range(args.num_arms):
+            plan = copy.deepcopy(p["Plan"])
+            if a > args.same_plan_arms:
+                plan["Total Cost"] = float(plan.get("Total Cost", 0.0)) * (1.0 + 0.05 * a)
+            arms.append({"Plan": plan, "metadata": copy.deepcopy(p.get("metadata", {})),
+                         "arm_config": {"index": a}})
+        return arms
+
+    rng = random.Random(0)
+    stream = [plans[rng.randrange(len(plans))] if rng.random() < args.repeat_rate else plans[i % len(plans)]
+              for i in range(args.requests)]
+    reqs = [_request(p) for p in stream]
+
+    def _cached(cache, cascade, r):
+        # OntoModel.__predict
+        keys = cache.keys(reg, r)
+        r = prediction_cache.share_inputs(r, keys)
+        if cascade is not None:
+            return cascade.predict(reg, r, cache=cache, keys=keys)
+        return cache.predict(keys, lambda idx: reg.predict([r[i] for i in idx]))
+
+    cascades = [None]
+    cascade = surrogate.Cascade(min_margin=args.margin, audit=0.0)
+    if cascade.applies(reg):
+        cascades.append(cascade)
+    for cascade in cascades:
+        name = "cascade" if cascade is not None else "model"
+        direct = cascade.predict if cascade is not None else lambda m, r: m.predict(r)
+        took, base = _timed(lambda: [direct(reg, copy.deepcopy(r)) for r in reqs], repeat=1)
+        print(f"{name:<8} uncached  {took / len(reqs) * 1000:8.3f}ms/request")
+        cache = prediction_cache.PredictionCache(args.capacity)
+        took, memo = _timed(lambda: [_cached(cache, cascade, copy.deepcopy(r)) for r in reqs], repeat=1)
+        worst = max(float(np.max(np.abs(a - b))) for a, b in zip(base, memo))
+        print(f"{name:<8} cached    {took / len(reqs) * 1000:8.3f}ms/request  max error {worst:.2e}")
+        print(json.dumps(cache.stats()))
+
+
+def bench_scaler(args):
+    import numpy as np
+    import numpy_infer
+    import reward_scale
+
+    pipeline = numpy_infer.NumpyOntoRegression().load(args.model).reward_pipeline
+    fast = reward_scale.RewardScale(pipeline)
+    rng = np.random.default_rng(0)
+    for n in args.arms:
+        preds = [rng.uniform(0.0, 1.0, size=n) for _ in range(args.calls)]
+        per_arm, a = _timed(lambda: [np.array([pipeline.inverse_transform([[1.0 - v]])[0][0] for v in p])
+                                     for p in preds], repeat=args.repeat)
+        batched, b = _timed(lambda: [pipeline.inverse_transform((1.0 - p).reshape(-1, 1)).reshape(-1)
+                                     for p in preds], repeat=args.repeat)
+        closed, c = _timed(lambda: [fast.real(p) for p in preds], repeat=args.repeat)
+        exact = all(np.array_equal(x, z) and np.array_equal(y, z) for x, y, z in zip(a, b, c))
+        print(f"{n:4d} arms  per-arm sklearn {per_arm / args.calls * 1e6:8.1f}us  "
+              f"batched sklearn {batched / args.calls * 1e6:7.1f}us  "
+              f"closed form {closed / args.calls * 1e6:6.1f}us  exact={exact}")
+
+
+def main():
+    parser = argparse.ArgumentParser("Onto server benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("featurize", help="parallel featurization speedup vs. workers")
+    p.add_argument("--limit", type=int, default=2000)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--max-workers", type=int, default=None)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_featurize)
+
+    p = sub.add_parser("sampler", help="select_samples_budgeted on a synthetic pool")
+    p.add_argument("--n", type=int, default=100000)
+    p.add_argument("--dim", type=int, default=512)
+    p.add_argument("--templates", type=int, default=200)
+    p.add_argument("--noise", type=float, default=0.2, help="within-template spread")
+    p.add_argument("--budget", type=int, default=1000)
+    p.add_argument("--cap", type=int, default=100)
+    p.add_argument("--arm-min", type=int, default=5)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--sketch-dim", type=int, default=32)
+    p.add_argument("--sketch-min", type=int, default=5000)
+    p.add_argument("--exact", action="store_true", help="also time the exact (unsketched) path")
+    p.set_defaults(fn=bench_sampler)
+
+    p = sub.add_parser("sampler-stream", help="StreamingSampler on a synthetic stream")
+    p.add_argument("--n", type=int, default=200000)
+    p.add_argument("--batch", type=int, default=10000)
+    p.add_argument("--dim", type=int, default=512)
+    p.add_argument("--templates", type=int, default=200)
+    p.add_argument("--noise", type=float, default=0.2)
+    p.add_argument("--budget", type=int, default=1000)
+    p.add_argument("--cap", type=int, default=100)
+    p.add_argument("--arm-min", type=int, default=5)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--sketch-dim", type=int, default=32)
+    p.set_defaults(fn=bench_sampler_stream)
+
+    p = sub.add_parser("sql", help="single-parse analyze_sql and the analysis cache vs. the two-pass analysis")
+    p.add_argument("--queries", default=os.path.join("..", "so_queries"))
+    p.add_argument("--limit", type=int, default=1000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_sql_analysis)
+
+    p = sub.add_parser("infer", help="NumPy vs. torch inference on a saved model")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_infer)
+
+    p = sub.add_parser("torch-runtime", help="eager vs. TorchScript vs. int8 torch inference")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--threads", type=int, default=1)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_torch_runtime)
+
+    p = sub.add_parser("batching", help="micro-batched vs. per-request forward passes under concurrency")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=500)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--max-batch", type=int, default=64)
+    p.add_argument("--windows", type=float, nargs="+", default=[0.5, 1.0, 2.0])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_batching)
+
+    p = sub.add_parser("cascade", help="surrogate + CNN cascade vs. the CNN alone on a saved model")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--margins", type=float, nargs="+", default=[0.05, 0.1, 0.25, 0.5])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_cascade)
+
+    p = sub.add_parser("backend", help="retrain time, planning latency and accuracy per model backend")
+    p.add_argument("--limit", type=int, default=500)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--backends", nargs="+", default=["cnn", "hgb"])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_backend)
+
+    p = sub.add_parser("knn", help="kNN reward memory search, flat vs. IVF, on synthetic embeddings")
+    p.add_argument("--n", type=int, default=100000)
+    p.add_argument("--dim", type=int, default=128)
+    p.add_argument("--templates", type=int, default=500)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--nprobe", type=int, default=8)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_knn)
+
+    p = sub.add_parser("ensemble", help="ensemble heads on a shared backbone vs. separate models vs. one head")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--members", type=int, nargs="+", default=[4, 8])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_ensemble)
+
+    p = sub.add_parser("prune", help="matrix width, latency and accuracy per ONTO_ATTR_PRUNE setting")
+    p.add_argument("--limit", type=int, default=500)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--settings", nargs="+", default=["off", "used", "8", "4"])
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_prune)
+
+    p = sub.add_parser("load", help="onto_model.bin vs. joblib + .npz model load time")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(fn=bench_load)
+
+    p = sub.add_parser("memo", help="select_plan-style requests with and without the prediction cache")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--requests", type=int, default=400)
+    p.add_argument("--num-arms", type=int, default=6)
+    p.add_argument("--repeat-rate", type=float, default=0.5, help="share of requests repeating an earlier plan")
+    p.add_argument("--same-plan-arms", type=int, default=2, help="arms after arm 0 hinted to its plan")
+    p.add_argument("--capacity", type=int, default=4096)
+    p.add_argument("--margin", type=float, default=0.25, help="cascade margin, when the model has a surrogate")
+    p.set_defaults(fn=bench_memo)
+
+    p = sub.add_parser("scaler", help="sklearn inverse_transform vs. the compiled reward scaler")
+    p.add_argument("--model", default="onto_default_model")
+    p.add_argument("--arms", type=int, nargs="+", default=[1, 6, 64])
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(fn=bench_scaler)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
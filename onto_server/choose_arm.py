@@ -13,8 +13,14 @@ def _impact_gate(est_cost: Optional[float], cap: float = 5.0) -> float:
 def _optimistic_scores(scores: np.ndarray,
                        tpl_arm_stats: Dict[int, Dict[str, float]],
                        beta: float = 0.0,
-                       higher_is_better: bool = False) -> np.ndarray:
+                       higher_is_better: bool = False,
+                       model_std: Optional[np.ndarray] = None,
+                       ucb_beta: float = 0.0) -> np.ndarray:
     s = scores.astype(float).copy()
+    if model_std is not None and ucb_beta > 0.0:
+        # UCB on the model's own uncertainty (ensemble spread, same units as scores)
+        std = np.asarray(model_std, dtype=float).reshape(-1)
+        s = s + ucb_beta * std if higher_is_better else s - ucb_beta * std
     if beta <= 0.0 or not tpl_arm_stats:
         return s
     for a, st in tpl_arm_stats.items():
@@ -38,7 +44,9 @@ def choose_arm(template_id: str,
                eps0: float = 0.2,
                eps_min: float = 0.02,
                optimism_beta: float = 0.0,
-               higher_is_better: bool = False) -> Tuple[int, dict]:
+               higher_is_better: bool = False,
+               model_std=None,
+               ucb_beta: float = 0.0) -> Tuple[int, dict]:
 
     # 1) normalize the scores to be one dimensional float array 
     scores = np.asarray(model_scores, dtype=float).reshape(-1)
@@ -54,7 +62,8 @@ def choose_arm(template_id: str,
     argmin_arm = order_model[0] if order_model else 0
 
     # 3) ranking after optimistic upper boundary
-    s_opt = _optimistic_scores(scores, tpl_arm_stats, optimism_beta, higher_is_better)
+    s_opt = _optimistic_scores(scores, tpl_arm_stats, optimism_beta, higher_is_better,
+                               model_std, ucb_beta)
     order = np.argsort(-s_opt) if higher_is_better else np.argsort(s_opt)
     order = _to_py_int_list(order)
     
@@ -101,5 +110,7 @@ def choose_arm(template_id: str,
         "mode": mode,
         "higher_is_better": bool(higher_is_better),
         "optimism_beta": float(optimism_beta),
+        "ucb_beta": float(ucb_beta),
+        "model_std": None if model_std is None else [float(x) for x in np.ravel(model_std)],
     }
     return int(chosen), trace
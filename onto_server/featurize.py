@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import general
 
@@ -11,49 +13,195 @@ JOIN_TYPES = ["Nested Loop", "Hash Join", "Merge Join"]
 LEAF_TYPES = ["Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Index Scan"]
 ALL_TYPES = JOIN_TYPES + LEAF_TYPES
 
-def build_adjacency_matrix(metadata_json):
+# per-column schema/SQL rows, the first rows of every feature matrix
+ATTRIBUTE_ROWS = [
+    "isNumeric", "inSQL", "inWhere", "inJoin", "hasIndex", "inGroup",
+    "correlationAbove0.9", "inSort"
+]
+
+# query-level rows of build_feature_matrix: one value broadcast over every column
+TEMPLATE_FLAG_ROWS = [
+    "tpl_has_distinct",
+    "tpl_has_exists",
+    "tpl_has_not_exists",
+    "tpl_has_non_equi_pred",
+    "tpl_need_sort_for_merge",
+    "tpl_post_link_present",
+    "tpl_post_link_occurs_2plus",
+]
+TEMPLATE_BUCKETS = {
+    "tpl_group_by_cols_bucket": 4,  # 0..3
+    "tpl_rows_bucket": 3,           # 0..2
+}
+SQL_ROWS = [
+    "sql_has_window",
+    "sql_has_like",
+    "sql_has_between",
+    "sql_has_in",
+    "sql_has_isnull",
+    "sql_has_case",
+    "sql_num_join_bucket_0",
+    "sql_num_join_bucket_1",
+    "sql_num_join_bucket_2",
+    "sql_num_aggs_bucket_0",
+    "sql_num_aggs_bucket_1",
+    "sql_num_aggs_bucket_2",
+    "sql_num_cte_bucket_0",
+    "sql_num_cte_bucket_1",
+    "sql_num_subquery_bucket_0",
+    "sql_num_subquery_bucket_1",
+    "sql_num_agg_distinct"   # COUNT DISTINCT
+]
+GLOBAL_ROWS = (TEMPLATE_FLAG_ROWS
+               + [f"{base}_{b}" for base, K in TEMPLATE_BUCKETS.items() for b in range(K)]
+               + SQL_ROWS
+               + [f"plan_{k}" for k in GCS_CANON_KEYS])
+NUM_GLOBAL = len(GLOBAL_ROWS)
+# GLOBAL_ROWS that do not depend on the plan (the plan_* cost shares come last)
+NUM_STATIC_GLOBAL = NUM_GLOBAL - len(GCS_CANON_KEYS)
+
+# ONTO_FEATURE_MODE: "broadcast" feeds the CNN every row as a channel;
+# "global" keeps the per-column rows in the matrix and the GLOBAL_ROWS in a
+# separate vector (see build_model_input)
+FEATURE_MODES = ("broadcast", "global")
+
+# ONTO_ATTR_PRUNE: attribute columns to keep (see prune_attributes)
+USAGE_FLAGS = ["inSQL", "inWhere", "inJoin", "inGroup", "inSort"]
+OTHER_COLUMN = "__other__"
+
+def _graph_nodes(metadata_json):
+    # node order: tables first, then "table.col" attributes table by table
     table_list = metadata_json.get("tables", [])
-
-    attr_list = []
-    table_attr_map = {} # table_name -> list of attribute full names
-
-    for table_name in table_list:
+    attr_list, attr_table = [], []
+    for t_idx, table_name in enumerate(table_list):
         cols = metadata_json.get(table_name, [])
-        full_attr_names = [f"{table_name}.{col}" for col in cols]
-        attr_list.extend(full_attr_names)
-        table_attr_map[table_name] = full_attr_names
-
-    # total node number = no. of tables + no. of attributes
-    num_nodes = len(table_list) + len(attr_list)
-    adjacency_matrix = np.zeros((num_nodes, num_nodes), dtype=int)
-
-
-    # table index: 0 ~ len(table_list)-1
-    # attr index:  len(table_list) ~ num_nodes-1
-
-    table_index_map = {name: idx for idx, name in enumerate(table_list)}
-    attr_index_map = {name: idx + len(table_list) for idx, name in enumerate(attr_list)}
-
-    # attribute is in a table
-    for table, attrs in table_attr_map.items():
-        t_idx = table_index_map[table]
-        for attr in attrs:
-            a_idx = attr_index_map[attr]
-            adjacency_matrix[t_idx][a_idx] = 1
-            adjacency_matrix[a_idx][t_idx] = 1 # undirected
-
-    # two attributes has an edge if they are in the same table
-    for attrs in table_attr_map.values():
-        for i in range(len(attrs)):
-            for j in range(i + 1, len(attrs)):
-                a_i = attr_index_map[attrs[i]]
-                a_j = attr_index_map[attrs[j]]
-                adjacency_matrix[a_i][a_j] = 1
-                adjacency_matrix[a_j][a_i] = 1  # undirected
-
+        attr_list.extend(f"{table_name}.{col}" for col in cols)
+        attr_table.extend([t_idx] * len(cols))
+    return table_list, attr_list, np.asarray(attr_table, dtype=np.int64)
+
+def _join_edges(metadata_json, n_t, attr_list):
+    # (2, E) COO of the SQL join edges in both directions, one dict lookup per
+    # join; self-joins (a column joined to itself) add no edge
+    joins = metadata_json.get("join_edges", [])
+    attr_index_map = {name: idx + n_t for idx, name in enumerate(attr_list)} if joins else {}
+    pairs = [(attr_index_map[l], attr_index_map[r]) for l, r, _jt in joins
+             if l in attr_index_map and r in attr_index_map and l != r]
+    jp = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return np.stack([np.concatenate([jp[:, 0], jp[:, 1]]), np.concatenate([jp[:, 1], jp[:, 0]])])
+
+def build_graph(metadata_json):
+    """
+    Sparse schema graph over [tables + attributes] (the feature matrix columns).
+
+    Returns a dict with
+        num_nodes, num_tables
+        attr_table: table index of every attribute node; attributes of the same
+                    table form a clique, which is kept implicit (O(attrs), not O(attrs^2))
+        edges:      (2, E) int64 COO of the explicit undirected edges, stored in
+                    both directions: table-attribute membership and SQL join edges
+    """
+    table_list, attr_list, attr_table = _graph_nodes(metadata_json)
+    n_t = len(table_list)
+    num_nodes = n_t + len(attr_list)
+    attr_nodes = np.arange(n_t, num_nodes, dtype=np.int64)
+    edges = np.concatenate([np.stack([attr_table, attr_nodes]), np.stack([attr_nodes, attr_table]),
+                            _join_edges(metadata_json, n_t, attr_list)], axis=1)
+    return {"num_nodes": num_nodes, "num_tables": n_t,
+            "attr_table": attr_table, "edges": _dedup_edges(edges, num_nodes)}
+
+def _dedup_edges(edges, num_nodes):
+    if edges.shape[1] == 0:
+        return edges.astype(np.int64)
+    keys = np.unique(edges[0] * num_nodes + edges[1])
+    return np.stack([keys // num_nodes, keys % num_nodes]).astype(np.int64)
+
+def _clique_ranges(graph):
+    # attributes of a table are contiguous, so each clique is a node range [lo, hi)
+    n_t, attr_table = graph["num_tables"], graph["attr_table"]
+    bounds = np.flatnonzero(np.diff(attr_table)) + 1
+    starts = np.concatenate([[0], bounds]).astype(np.int64) + n_t
+    ends = np.concatenate([bounds, [len(attr_table)]]).astype(np.int64) + n_t
+    return [(lo, hi) for lo, hi in zip(starts, ends) if hi > lo]
+
+def clique_edges(graph):
+    """Expand the implicit same-table attribute cliques into a (2, E) COO array."""
+    src, dst = [], []
+    for lo, hi in _clique_ranges(graph):
+        k = hi - lo
+        if k < 2:
+            continue
+        i, j = np.nonzero(~np.eye(k, dtype=bool))
+        src.append(i + lo); dst.append(j + lo)
+    if not src:
+        return np.zeros((2, 0), dtype=np.int64)
+    return np.stack([np.concatenate(src), np.concatenate(dst)]).astype(np.int64)
+
+def edge_index(graph, expand_cliques=True, as_tensor=False):
+    """
+    torch_geometric-style edge_index of a build_graph() graph: (2, E) int64,
+    both directions, no duplicates; a torch.long tensor with as_tensor. With
+    expand_cliques=False the same-table attribute cliques are left out (see
+    graph["attr_table"]).
+    """
+    edges = graph["edges"]
+    if expand_cliques:
+        # join edges inside one table are already part of that table's clique
+        n_t, attr_table = graph["num_tables"], graph["attr_table"]
+        both_attr = (edges[0] >= n_t) & (edges[1] >= n_t)
+        same = np.zeros(edges.shape[1], dtype=bool)
+        same[both_attr] = (attr_table[edges[0][both_attr] - n_t]
+                           == attr_table[edges[1][both_attr] - n_t])
+        edges = np.concatenate([edges[:, ~same], clique_edges(graph)], axis=1)
+    if as_tensor:
+        import torch
+        return torch.from_numpy(np.ascontiguousarray(edges))
+    return edges
+
+def build_edge_index(metadata_json, expand_cliques=True, as_tensor=False):
+    """edge_index(build_graph(metadata_json)), join edges included."""
+    return edge_index(build_graph(metadata_json), expand_cliques, as_tensor)
+
+def edge_index_to_csr(edge_index, num_nodes):
+    """(indptr, indices) CSR neighbour lists of a (2, E) COO edge array."""
+    order = np.lexsort((edge_index[1], edge_index[0]))
+    src, dst = edge_index[0][order], edge_index[1][order]
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+    return indptr, dst.astype(np.int64)
+
+def has_edge(graph, i, j):
+    """Edge test against build_graph() output, including the implicit cliques."""
+    n_t = graph["num_tables"]
+    if i != j and i >= n_t and j >= n_t and graph["attr_table"][i - n_t] == graph["attr_table"][j - n_t]:
+        return True
+    e = graph["edges"]
+    return bool(np.any((e[0] == i) & (e[1] == j)))
+
+def dense_adjacency(graph):
+    """The N x N 0/1 matrix of a build_graph() graph, for callers that need one."""
+    n = graph["num_nodes"]
+    adjacency_matrix = np.zeros((n, n), dtype=int)
+    e = graph["edges"]
+    adjacency_matrix[e[0], e[1]] = 1
+    for lo, hi in _clique_ranges(graph):
+        adjacency_matrix[lo:hi, lo:hi] = 1
+        adjacency_matrix[np.arange(lo, hi), np.arange(lo, hi)] = 0
     return adjacency_matrix
 
+def build_adjacency_matrix(metadata_json, dense=False):
+    """
+    The schema graph without SQL join edges (add them with
+    inject_sql_join_edges_into_adjacency): build_graph()'s sparse form, or its
+    dense 0/1 matrix with dense=True.
+    """
+    graph = build_graph({k: v for k, v in metadata_json.items() if k != "join_edges"})
+    return dense_adjacency(graph) if dense else graph
+
 def build_feature_matrix(metadata_json, num_arms=5, plan=None):
+    return _build_feature_rows(metadata_json, num_arms, plan)[0]
+
+
+def _build_feature_rows(metadata_json, num_arms=5, plan=None):
     """
     Build a binary feature matrix with both SQL metadata and arm configuration.
 
@@ -69,6 +217,8 @@ def build_feature_matrix(metadata_json, num_arms=5, plan=None):
         ......
 
     Columns = [tables + attributes]
+
+    Returns (matrix, row_names).
     """
     table_list = metadata_json.get("tables", [])
 
@@ -79,25 +229,11 @@ def build_feature_matrix(metadata_json, num_arms=5, plan=None):
     num_cols = len(table_list) + len(attr_list)
 
     # current rows
-    row_names = [
-        "isNumeric", "inSQL", "inWhere", "inJoin", "hasIndex", "inGroup",
-        "correlationAbove0.9", "inSort"
-    ]
+    row_names = list(ATTRIBUTE_ROWS)
 
     # template rows
-    tpl_flag_rows = [
-        "tpl_has_distinct",
-        "tpl_has_exists",
-        "tpl_has_not_exists",
-        "tpl_has_non_equi_pred",
-        "tpl_need_sort_for_merge",
-        "tpl_post_link_present",
-        "tpl_post_link_occurs_2plus",
-    ]
-    tpl_bucket_defs = {
-        "tpl_group_by_cols_bucket": 4,  # 0..3
-        "tpl_rows_bucket": 3,           # 0..2
-    }
+    tpl_flag_rows = TEMPLATE_FLAG_ROWS
+    tpl_bucket_defs = TEMPLATE_BUCKETS
     template_feature_rows = tpl_flag_rows[:]
     for base, K in tpl_bucket_defs.items():
         for b in range(K):
@@ -164,26 +300,9 @@ def build_feature_matrix(metadata_json, num_arms=5, plan=None):
                 _get("rows_bucket", 0))
 
     extra_rows = [
-        "plan_cost_share",     # broadcast
-        "plan_rows_share",     # broadcast
-        "sql_has_window",
-        "sql_has_like",
-        "sql_has_between",
-        "sql_has_in",
-        "sql_has_isnull",
-        "sql_has_case",
-        "sql_num_join_bucket_0",
-        "sql_num_join_bucket_1",
-        "sql_num_join_bucket_2",
-        "sql_num_aggs_bucket_0",
-        "sql_num_aggs_bucket_1",
-        "sql_num_aggs_bucket_2",
-        "sql_num_cte_bucket_0",
-        "sql_num_cte_bucket_1",
-        "sql_num_subquery_bucket_0",
-        "sql_num_subquery_bucket_1",
-        "sql_num_agg_distinct"   # COUNT DISTINCT（
-    ]
+        "plan_cost_share",     # per table, broadcast to its columns
+        "plan_rows_share",     # per table, broadcast to its columns
+    ] + SQL_ROWS
     row_names = row_names + extra_rows
     feature_matrix = np.pad(feature_matrix, ((0, len(extra_rows)), (0, 0)), mode="constant")
     row_map.update({name: idx for idx, name in enumerate(row_names)})
@@ -247,7 +366,185 @@ def build_feature_matrix(metadata_json, num_arms=5, plan=None):
     set_all("sql_num_agg_distinct", tf.get("num_agg_distinct", 0))
 
 
-    return feature_matrix
+    return feature_matrix, row_names
+
+
+def feature_mode():
+    mode = os.getenv("ONTO_FEATURE_MODE", "broadcast")
+    if mode not in FEATURE_MODES:
+        raise ValueError(f"ONTO_FEATURE_MODE must be one of {FEATURE_MODES}, not {mode!r}")
+    return mode
+
+
+def split_global_rows(feature_matrix, row_names):
+    """(per-column rows, GLOBAL_ROWS vector) of a build_feature_matrix result."""
+    index = {name: i for i, name in enumerate(row_names)}
+    glob = [index[name] for name in GLOBAL_ROWS]
+    skip = set(glob)
+    local = [i for i in range(len(row_names)) if i not in skip]
+    g = feature_matrix[glob, 0] if feature_matrix.shape[1] else np.zeros(NUM_GLOBAL, dtype=np.float32)
+    return feature_matrix[local], g
+
+
+def global_header_rows(channels):
+    return -(-NUM_GLOBAL // channels)
+
+
+def pack_global(cols, g):
+    """
+    One (header + columns, channels) float32 matrix holding cols and the global
+    vector g, so the split features travel through the same 2-D pipelines
+    (featurize_pool, shared_matrices) as the broadcast ones: g fills the first
+    global_header_rows(channels) rows, zero-padded.
+    """
+    h = global_header_rows(cols.shape[1])
+    head = np.zeros(h * cols.shape[1], dtype=np.float32)
+    head[:len(g)] = g
+    return np.concatenate([head.reshape(h, cols.shape[1]), cols]).astype(np.float32)
+
+
+def feature_layout(mode="broadcast"):
+    """
+    Channel names of build_model_input matrices in mode, in order; in global
+    mode the GLOBAL_ROWS of the header follow the per-column channels.
+    """
+    _, row_names = _build_feature_rows({"tables": ["t"], "t": ["c"]})
+    if mode == "broadcast":
+        return list(row_names)
+    skip = set(GLOBAL_ROWS)
+    return [name for name in row_names if name not in skip] + list(GLOBAL_ROWS)
+
+
+def unpack_global(X):
+    """(columns, g) from a pack_global matrix."""
+    h = global_header_rows(X.shape[-1])
+    return X[h:], X[:h].reshape(-1)[:NUM_GLOBAL]
+
+
+def pooled_summary(X, mode="broadcast", with_sum=False):
+    """
+    Fixed-length summary of a build_model_input matrix: the per-channel mean
+    and max (and sum, with_sum) over its columns, followed by the global
+    vector in global mode.
+    """
+    g = None
+    if mode == "global":
+        X, g = unpack_global(X)
+    parts = [X.mean(axis=0), X.max(axis=0)]
+    if with_sum:
+        parts.append(X.sum(axis=0))
+    if g is not None:
+        parts.append(g)
+    return np.concatenate(parts).astype(np.float32)
+
+
+def attr_prune():
+    """
+    ONTO_ATTR_PRUNE: unset / "off" keeps every attribute column, "used" keeps
+    the attributes prune_attributes considers used, an integer K at most the K
+    costliest of those per table.
+    """
+    v = os.getenv("ONTO_ATTR_PRUNE", "off")
+    if v == "off":
+        return None
+    return 0 if v == "used" else int(v)
+
+
+def _column_costs(metadata_json, plan):
+    # per-attribute column cost shares, computed on a scratch copy of the metadata
+    probe = {k: v for k, v in metadata_json.items()
+             if k not in ("_col_costs", "_table_costs", "global_cost_shares")}
+    try:
+        distribute_costs_to_tables_and_columns(probe, (plan or {}).get("Plan", plan or {}))
+    except Exception:
+        return {}
+    by_id = {(a.get("relid"), a.get("attnum")): a.get("name")
+             for a in metadata_json.get("attributes", []) if a.get("relid") is not None}
+    out = {}
+    for (relid, attnum), d in probe.get("_col_costs", {}).items():
+        name = by_id.get((relid, attnum))
+        if name is not None:
+            out[name] = {k: v for k, v in d.items() if k.endswith("_share")}
+    return out
+
+
+def prune_attributes(metadata_json, plan=None, top_k=0):
+    """
+    Metadata for a narrower matrix: per table, only the attributes that have a
+    usage flag (USAGE_FLAGS) or a non-zero column cost, the top_k costliest of
+    them if top_k > 0, plus one "<table>.__other__" column standing for the
+    rest: its flags are the OR of the dropped attributes' flags. Returns
+    (metadata, {summary column name: summed column cost shares}).
+    """
+    costs = _column_costs(metadata_json, plan)
+    attr_map = {a["name"]: a for a in metadata_json.get("attributes", []) if "name" in a}
+    pruned = dict(metadata_json)
+    attributes = []
+    other_costs = {}
+    for t in metadata_json.get("tables", []):
+        ranked = []
+        for c in metadata_json.get(t, []):
+            name = f"{t}.{c}"
+            a = attr_map.get(name, {})
+            cost = sum(costs.get(name, {}).values())
+            used = sum(bool(a.get(f)) for f in USAGE_FLAGS)
+            ranked.append((-cost, -used, c, name, cost > 0 or used > 0))
+        ranked.sort(key=lambda r: r[:2])
+        keep = [r for r in ranked if r[4]]
+        if top_k:
+            keep = keep[:top_k]
+        kept = {r[2] for r in keep}
+        cols = [c for c in metadata_json.get(t, []) if c in kept]
+        attributes.extend(attr_map[f"{t}.{c}"] for c in cols if f"{t}.{c}" in attr_map)
+
+        dropped = [r[3] for r in ranked if r[2] not in kept]
+        if dropped:
+            other = f"{t}.{OTHER_COLUMN}"
+            cols.append(OTHER_COLUMN)
+            summary = {"name": other}
+            for f in ATTRIBUTE_ROWS:
+                summary[f] = any(attr_map.get(n, {}).get(f, False) for n in dropped)
+            attributes.append(summary)
+            summed = {}
+            for n in dropped:
+                for k, v in costs.get(n, {}).items():
+                    summed[k] = summed.get(k, 0.0) + v
+            if summed:
+                other_costs[other] = summed
+        pruned[t] = cols
+    pruned["attributes"] = attributes
+    return pruned, other_costs
+
+
+def _build_pruned_rows(metadata_json, num_arms, plan, top_k):
+    pruned, other_costs = prune_attributes(metadata_json, plan, top_k)
+    feature_matrix, row_names = _build_feature_rows(pruned, num_arms, plan)
+    if other_costs:
+        # costs of attributes top_k dropped land on their table's summary column
+        tables = pruned.get("tables", [])
+        cols = list(tables) + [f"{t}.{c}" for t in tables for c in pruned.get(t, [])]
+        col_idx = {name: i for i, name in enumerate(cols)}
+        row_idx = {name: i for i, name in enumerate(row_names)}
+        for other, summed in other_costs.items():
+            for k, v in summed.items():
+                if k in row_idx:
+                    feature_matrix[row_idx[k], col_idx[other]] = v
+    return feature_matrix, row_names
+
+
+def build_model_input(metadata_json, num_arms=5, plan=None, mode="broadcast", attr_prune=None):
+    """
+    The (columns, channels) float32 matrix the CNN models take in the given
+    feature mode; attr_prune (see attr_prune()) narrows the attribute columns.
+    """
+    if attr_prune is None:
+        feature_matrix, row_names = _build_feature_rows(metadata_json, num_arms, plan)
+    else:
+        feature_matrix, row_names = _build_pruned_rows(metadata_json, num_arms, plan, attr_prune)
+    if mode == "broadcast":
+        return np.ascontiguousarray(feature_matrix.T, dtype=np.float32)
+    cols, g = split_global_rows(feature_matrix, row_names)
+    return pack_global(np.ascontiguousarray(cols.T), g)
 
 def get_arm_index(metadata_json, default_index=0):
     return int(metadata_json.get("arm_config_json", {}).get("index", default_index))
@@ -367,14 +664,15 @@ def broadcast_table_metric_to_columns(metadata_json, table_metric: dict, default
     return np.array(vec, dtype=np.float32)
 
 def inject_sql_join_edges_into_adjacency(adj, metadata_json):
-    tables = metadata_json.get("tables", [])
-    attrs = []
-    for t in tables:
-        attrs.extend([f"{t}.{c}" for c in metadata_json.get(t, [])])
-    attr_index_map = {name: idx + len(tables) for idx, name in enumerate(attrs)}
-
-    for lcol, rcol, _jt in metadata_json.get("join_edges", []):
-        if lcol in attr_index_map and rcol in attr_index_map:
-            i = attr_index_map[lcol]; j = attr_index_map[rcol]
-            adj[i, j] = 1; adj[j, i] = 1
+    """
+    adj with metadata_json's join edges added. A build_graph() graph gets them
+    appended to its edge list (a new dict); a dense matrix is filled in place.
+    """
+    _, attr_list, _ = _graph_nodes(metadata_json)
+    n_t = len(metadata_json.get("tables", []))
+    joins = _join_edges(metadata_json, n_t, attr_list)
+    if isinstance(adj, dict):
+        edges = np.concatenate([adj["edges"], joins], axis=1)
+        return dict(adj, edges=_dedup_edges(edges, adj["num_nodes"]))
+    adj[joins[0], joins[1]] = 1
     return adj
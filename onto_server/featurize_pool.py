@@ -0,0 +1,113 @@
+# featurize_pool.py
+# Featurize many plans at once across a process pool. Workers build the
+# (columns, channels) matrices for a chunk and hand them back through a
+# shared memory block (see shared_matrices.py) instead of pickling arrays.
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import shared_matrices
+
+# below this many plans a pool costs more than it saves
+MIN_PARALLEL_ITEMS = 64
+
+
+def featurize_workers():
+    """Worker count from ONTO_FEATURIZE_WORKERS (default 1 = featurize in-process)."""
+    n = int(os.getenv("ONTO_FEATURIZE_WORKERS", "1"))
+    if n <= 0:
+        n = os.cpu_count() or 1
+    return n
+
+
+def open_pool(workers=None):
+    """
+    A process pool of `workers` (default: featurize_workers()) for
+    build_feature_matrices(executor=...), or None for one worker. Callers that
+    featurize batch after batch open it once instead of paying the spawn
+    start-up per batch, and shut it down when done.
+    """
+    workers = featurize_workers() if workers is None else max(1, int(workers))
+    if workers == 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _featurize_one(meta, plan, num_arms, mode="broadcast", attr_prune=None):
+    import featurize
+    return featurize.build_model_input(meta, num_arms, plan, mode, attr_prune)
+
+
+def _featurize_chunk(tasks, num_arms, mode="broadcast", attr_prune=None):
+    # runs in a worker process
+    mats, failed = [], []
+    for i, (meta, plan) in enumerate(tasks):
+        try:
+            mats.append(_featurize_one(meta, plan, num_arms, mode, attr_prune))
+        except Exception as e:
+            failed.append((i, repr(e)))
+            mats.append(np.zeros((0, 0), dtype=np.float32))
+    shm, handle = shared_matrices.pack_shared(mats)
+    # the parent unlinks the block once it has copied the matrices out
+    shm.close()
+    return handle, failed
+
+
+def build_feature_matrices(tasks, num_arms, workers=None, chunk_size=None,
+                           on_error="raise", mode="broadcast", attr_prune=None, executor=None):
+    """
+    Featurize (meta, plan) pairs; plan may be None. Returns a list aligned with
+    `tasks` holding float32 (columns, channels) matrices in feature mode `mode`
+    with attribute pruning `attr_prune` (see featurize.build_model_input). With
+    on_error="skip" a failed item yields None instead of raising. An
+    `executor` from open_pool() is used as is; otherwise a pool is started for
+    this call when workers > 1.
+    """
+    tasks = list(tasks)
+    workers = featurize_workers() if workers is None else max(1, int(workers))
+
+    if (executor is None and workers == 1) or len(tasks) < MIN_PARALLEL_ITEMS:
+        out = []
+        for meta, plan in tasks:
+            try:
+                out.append(_featurize_one(meta, plan, num_arms, mode, attr_prune))
+            except Exception:
+                if on_error != "skip":
+                    raise
+                out.append(None)
+        return out
+
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(len(tasks) / (workers * 4)))
+    starts = list(range(0, len(tasks), chunk_size))
+
+    out = [None] * len(tasks)
+    pool = executor if executor is not None else open_pool(workers)
+    try:
+        jobs = [pool.submit(_featurize_chunk, tasks[s:s + chunk_size], num_arms, mode, attr_prune)
+                for s in starts]
+        errors = []
+        for s, job in zip(starts, jobs):
+            handle, failed = job.result()
+            shm, views = shared_matrices.attach_shared(handle)
+            try:
+                bad = {i for i, _ in failed}
+                for i, v in enumerate(views):
+                    if i not in bad:
+                        out[s + i] = np.array(v)
+                errors.extend((s + i, msg) for i, msg in failed)
+            finally:
+                del views
+                shm.close()
+                shm.unlink()
+    finally:
+        if pool is not executor:
+            pool.shutdown()
+
+    if errors and on_error != "skip":
+        i, msg = errors[0]
+        raise RuntimeError(f"featurization failed for item {i}: {msg}")
+    return out
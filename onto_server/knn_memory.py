@@ -0,0 +1,150 @@
+# knn_memory.py
+# Reward memory over plan embeddings (CNNMatrixDelta.embed) of the training
+# experience. Predictions are blended with the rewards of the most similar
+# past plans run with the same arm: the closer the neighbours, the more they
+# count. Rows are stored contiguously by (IVF list, arm), so a search is a few
+# dense float32 mat-vecs over slices, without copies or masks.
+import os
+
+import numpy as np
+
+NPZ_NAME = "onto_knn.npz"
+
+
+def enabled():
+    """ONTO_KNN=1: training builds the memory and saves it with the model."""
+    return os.getenv("ONTO_KNN", "0") == "1"
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    n = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(n, 1e-12)
+
+
+def _kmeans(x, k, iters=10, seed=0):
+    """Spherical k-means centroids (k, d) over unit rows x, fitted on a sample."""
+    rng = np.random.default_rng(seed)
+    sample = x[rng.choice(len(x), size=min(len(x), 64 * k), replace=False)]
+    c = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ c.T, axis=1)
+        for j in range(k):
+            members = sample[assign == j]
+            if len(members):
+                c[j] = members.sum(axis=0)
+        c = _normalize(c)
+    return c
+
+
+class KNNMemory:
+    """
+    blend(emb, arm_ids, pred_scaled) -> pred_scaled pulled towards the scaled
+    rewards of each plan's k nearest (cosine) neighbours with the same arm.
+    Neighbours are weighted by softmax(similarity / temp); the model keeps a
+    weight between alpha_max (far neighbours) and alpha_min (identical ones).
+    """
+
+    def __init__(self, g, y, arms, num_arms, k=5, temp=0.06, alpha_min=0.30, alpha_max=0.70,
+                 nlist=None, nprobe=8, seed=0):
+        g = _normalize(g)
+        y = np.asarray(y, dtype=np.float32)
+        arms = np.asarray(arms, dtype=np.int64)
+        self.num_arms = num_arms
+        self.k, self.temp = k, temp
+        self.alpha_min, self.alpha_max = alpha_min, alpha_max
+        self.nprobe = nprobe
+        if nlist is None:
+            # IVF only pays off for large memories
+            nlist = int(np.sqrt(len(g))) if len(g) >= int(os.getenv("ONTO_KNN_IVF_MIN", "20000")) else 1
+        if nlist > 1:
+            self.centroids = _kmeans(g, nlist, seed=seed)
+            lists = np.argmax(g @ self.centroids.T, axis=1)
+        else:
+            self.centroids = np.zeros((1, g.shape[1]), dtype=np.float32)
+            lists = np.zeros(len(g), dtype=np.int64)
+        order = np.lexsort((arms, lists))
+        self.g = np.ascontiguousarray(g[order])
+        self.y = y[order]
+        # rows of list l and arm a: offsets[l, a] : offsets[l, a + 1]
+        counts = np.zeros((len(self.centroids), num_arms), dtype=np.int64)
+        np.add.at(counts, (lists, arms), 1)
+        start = (np.cumsum(counts) - counts.ravel()).reshape(counts.shape)
+        self.offsets = np.concatenate([start, start[:, -1:] + counts[:, -1:]], axis=1)
+        # as nested lists: Python ints slice faster than NumPy scalars
+        self._bounds = self.offsets.tolist()
+
+    def __len__(self):
+        return len(self.g)
+
+    def search(self, q, arm, probes=None):
+        """(similarities, scaled rewards) of the k nearest rows with `arm` to unit vector q."""
+        if probes is None:
+            probes = self._probes(q[None])[0]
+        sims, ys = [], []
+        for l in probes:
+            lo, hi = self._bounds[l][arm], self._bounds[l][arm + 1]
+            if hi > lo:
+                sims.append(self.g[lo:hi] @ q)
+                ys.append(self.y[lo:hi])
+        if not sims:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        sims, ys = np.concatenate(sims), np.concatenate(ys)
+        if len(sims) > self.k:
+            top = np.argpartition(-sims, self.k - 1)[:self.k]
+            sims, ys = sims[top], ys[top]
+        return sims, ys
+
+    def _probes(self, Q):
+        # the nprobe closest IVF lists of every query row, in one mat-mul
+        if len(self.centroids) == 1:
+            return [(0,)] * len(Q)
+        n = min(self.nprobe, len(self.centroids))
+        return np.argpartition(-(Q @ self.centroids.T), n - 1, axis=1)[:, :n].tolist()
+
+    def blend(self, emb, arm_ids, pred_scaled):
+        q = _normalize(emb)
+        probes = self._probes(q)
+        out = np.array(pred_scaled, dtype=np.float64)
+        for i, arm in enumerate(arm_ids):
+            if not 0 <= arm < self.num_arms:
+                continue
+            sims, ys = self.search(q[i], int(arm), probes[i])
+            if not len(sims):
+                continue
+            top = float(sims.max())
+            w = np.exp((sims - top) / self.temp)
+            knn = float(np.dot(w, ys) / w.sum())
+            alpha = self.alpha_max - (self.alpha_max - self.alpha_min) * min(max(top, 0.0), 1.0)
+            out[i] = alpha * out[i] + (1.0 - alpha) * knn
+        return out
+
+    def arrays(self):
+        """The memory as named arrays (save, model_artifact)."""
+        return {"g": self.g, "y": self.y, "centroids": self.centroids, "offsets": self.offsets,
+                "params": np.array([self.num_arms, self.k, self.temp, self.alpha_min,
+                                    self.alpha_max, self.nprobe], dtype=np.float64)}
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        self = cls.__new__(cls)
+        self.g, self.y = arrays["g"], arrays["y"]
+        self.centroids, self.offsets = arrays["centroids"], arrays["offsets"]
+        num_arms, k, temp, alpha_min, alpha_max, nprobe = arrays["params"]
+        self._bounds = self.offsets.tolist()
+        self.num_arms, self.k, self.nprobe = int(num_arms), int(k), int(nprobe)
+        self.temp, self.alpha_min, self.alpha_max = float(temp), float(alpha_min), float(alpha_max)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls.from_arrays({k: z[k] for k in z.files})
+
+
+def load_if_present(model_dir):
+    path = os.path.join(model_dir, NPZ_NAME)
+    return KNNMemory.load(path) if os.path.exists(path) else None
@@ -6,8 +6,6 @@ import time
 import os
 import storage
 import storage2
-import model
-import train
 import math
 import reg_blocker
 from constants import (PG_OPTIMIZER_INDEX, DEFAULT_MODEL_PATH,
@@ -18,14 +16,34 @@ import logging
 import numpy as np
 import math, json
 
+import prediction_cache
 from featurize import augment_meta_from_plan
 from onto_utils_template import template_from_plan_meta
 from choose_arm import choose_arm
 
-from sqlglot_parse import parse_sqlglot, enrich_sql_semantics
+from sql_analysis_cache import analyze_sql_cached, decode_analysis, default_cache
 from featurize_sqlglot_bridge import merge_parsed_sqlglot_into_meta, merge_semantics_into_meta
 
 
+def send_json_reply(sock, obj):
+    # same framing as the requests: 4-byte big-endian length, then JSON
+    b = json.dumps(obj).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(b)) + b)
+
+def new_regression(fp):
+    """
+    The regression model saved at fp, for serving. A model with an
+    onto_model.bin or exported onto_cnn_delta.npz runs on NumPy and torch is
+    never imported; otherwise (or
+    with ONTO_INFERENCE=torch) this falls back to model.OntoRegression.
+    """
+    import numpy_infer
+    if numpy_infer.inference_backend(fp) == "numpy":
+        return numpy_infer.NumpyOntoRegression(have_cache_data=True).load(fp)
+    import model
+    model.pin_torch_threads()
+    return model.OntoRegression(have_cache_data=True).load(fp)
+
 def add_buffer_info_to_plans(buffer_info, plans):
     for p in plans:
         p["Buffers"] = buffer_info
@@ -36,11 +54,26 @@ def add_meta_info_to_plans(metadata, plans):
     return plans
 
 class OntoModel:
-    def __init__(self):
+    def __init__(self, batcher=None, cascade=None, cache=None):
         self.__current_model = None
+        self.batcher = batcher
+        self.cascade = cascade
+        self.cache = cache
+        # weight of an ensemble model's spread in choose_arm (ONTO_UCB_BETA)
+        self.ucb_beta = float(os.getenv("ONTO_UCB_BETA", "1.0"))
         self.logger = logging.getLogger(__name__)
 
-    def select_plan(self, messages):
+    def has_model(self):
+        return self.__current_model is not None
+
+    def inference(self):
+        """"numpy" or "torch" for the live model, None without one."""
+        if self.__current_model is None:
+            return None
+        return getattr(self.__current_model, "backend", "torch")
+
+    def select_plan(self, messages, record=True):
+        # record=False (warm-up) leaves the template tables untouched
         start = time.time()
         *arms, buffers, metadata  = messages
         if self.__current_model is None:
@@ -65,7 +98,7 @@ class OntoModel:
             self.logger.warning("[AUGMENT] failed: %s", e)
             meta_aug = meta0
 
-        res = self.__current_model.predict(arms)
+        res, model_std = self.__predict(arms, with_std=True)
 
         try:
             template_id = template_from_plan_meta(arms[0], meta_aug)
@@ -90,7 +123,8 @@ class OntoModel:
             return idx
 
         try:
-            storage.upsert_template(template_id, key_tuple_json=json.dumps(key_dbg))
+            if record:
+                storage.upsert_template(template_id, key_tuple_json=json.dumps(key_dbg))
         except Exception:
             pass
 
@@ -118,7 +152,9 @@ class OntoModel:
                          eps0=0.2,
                          eps_min=0.1,
                          optimism_beta=0.00,
-                         higher_is_better=False)
+                         higher_is_better=False,
+                         model_std=model_std,
+                         ucb_beta=self.ucb_beta)
 
         # idx = res.argmin()
         stop = time.time()
@@ -128,6 +164,30 @@ class OntoModel:
               "/", res[0])
         return idx
 
+    def __predict(self, plans, with_std=False):
+        # with_std: (rewards, ensemble spread or None)
+        model = self.__current_model
+        forward = self.batcher.forward_for(model) if self.batcher is not None else None
+        keys = None
+        if self.cache is not None:
+            keys = self.cache.keys(model, plans)
+            plans = prediction_cache.share_inputs(plans, keys)
+        # the cascade picks between arms; a single plan always gets the full model
+        if self.cascade is not None and len(plans) > 1 and self.cascade.applies(model):
+            return self.cascade.predict(model, plans, forward, with_std=with_std,
+                                        cache=self.cache, keys=keys)
+        if self.cache is None:
+            return self.__score(model, plans, forward, with_std)
+        return self.cache.predict(
+            keys, lambda idx: self.__score(model, [plans[i] for i in idx], forward, with_std), with_std)
+
+    @staticmethod
+    def __score(model, plans, forward, with_std):
+        kwargs = {"with_std": True} if with_std else {}
+        if forward is not None:
+            return model.predict(plans, forward=forward, **kwargs)
+        return model.predict(plans, **kwargs)
+
     # Predict
     def predict(self, messages):
         plan, buffers, metadata, arm_config = messages
@@ -142,13 +202,41 @@ class OntoModel:
 
         plans[0]["arm_config"] = arm_config
 
-        res = self.__current_model.predict(plans)
+        res = self.__predict(plans)
         return res[0][0]
     
+    def validate_model(self, fp):
+        """Load fp into a scratch regression model; does not touch the live model."""
+        try:
+            new_regression(fp)
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        return {"ok": True}
+
+    def status(self):
+        info = storage.status_counts()
+        info["Experience"] = storage.experience_size()
+        info["Model loaded"] = self.has_model()
+        info["Inference"] = self.inference()
+        if getattr(self.__current_model, "drift", None) is not None:
+            # a scripted / quantized torch runtime, compared with the eager model at load
+            info["Torch runtime"] = self.__current_model.runtime
+            info["Runtime drift"] = self.__current_model.drift
+        net = getattr(self.__current_model, "model", None)
+        if hasattr(net, "stats"):
+            # two-tower model: SQL embedding cache and FLOPs per arm
+            info["SQL tower cache"] = net.stats()
+        if self.batcher is not None:
+            info["Batching"] = self.batcher.stats()
+        if self.cascade is not None:
+            info["Cascade"] = self.cascade.stats()
+        if self.cache is not None:
+            info["Prediction cache"] = self.cache.stats()
+        return info
+
     def load_model(self, fp):
         try:
-            new_model = model.OntoRegression(have_cache_data=True)
-            new_model.load(fp)
+            new_model = new_regression(fp)
 
             if reg_blocker.should_replace_model(
                     self.__current_model,
@@ -250,12 +338,17 @@ class JSONTCPHandler(socketserver.BaseRequestHandler):
             except Exception:
                 logger.exception("[SERVER] Exception while updating template stats")
 
-            raw = storage2.get_sql(metadata.get("sequence_id", ""))
+            raw, features = storage2.get_sql_features(metadata.get("sequence_id", ""))
             if raw:
-                parsed = parse_sqlglot(raw, read_dialect="postgres")
+                if features:
+                    # analyzed by sql_store at ingest time
+                    parsed, sem = decode_analysis(features)
+                else:
+                    parsed, sem = analyze_sql_cached(raw, read_dialect="postgres")
+                    stats = default_cache().metrics()
+                    if stats["lookups"] and stats["lookups"] % 500 == 0:
+                        logger.info("[SQL CACHE] %s", stats)
                 metadata = merge_parsed_sqlglot_into_meta(metadata, parsed)
-
-                sem = enrich_sql_semantics(raw, read_dialect="postgres")
                 metadata = merge_semantics_into_meta(metadata, sem)
 
             plan = add_meta_info_to_plans(metadata, [plan])[0]
@@ -265,6 +358,15 @@ class JSONTCPHandler(socketserver.BaseRequestHandler):
             path = payload[0]["path"]
             self.server.onto_model.load_model(path)
 
+        elif mtype == "validate model":
+            path = payload[0]["path"]
+            send_json_reply(self.request, self.server.onto_model.validate_model(path))
+            self.request.close()
+
+        elif mtype == "status":
+            send_json_reply(self.request, self.server.onto_model.status())
+            self.request.close()
+
         else:
             print("Unknown message type:", mtype)
 
@@ -272,6 +374,13 @@ class OntoJSONHandler(JSONTCPHandler):
     def setup(self):
         self.__messages = []
 
+class OntoTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+class OntoThreadingTCPServer(socketserver.ThreadingMixIn, OntoTCPServer):
+    # handler threads never keep the server process alive
+    daemon_threads = True
+
 def start_server(listen_on, port):
     setup_logging()
 
@@ -281,15 +390,29 @@ def start_server(listen_on, port):
     logger.info("Sever is listening on %d", port)
     logger.info("Server is listening on %s:%d", listen_on, port)
 
-    model = OntoModel()
+    import batcher
+    import surrogate
+    # ONTO_BATCH_WINDOW_MS > 0: concurrent requests share forward passes;
+    # ONTO_CASCADE=0 always runs the CNN instead of the distilled surrogate first;
+    # ONTO_PREDICTION_CACHE=0 scores every arm of every request
+    model = OntoModel(batcher=batcher.from_env(), cascade=surrogate.from_env(),
+                      cache=prediction_cache.from_env())
 
     if os.path.exists(DEFAULT_MODEL_PATH):
         print("Loading existing model")
         sys.stdout.flush()
         model.load_model(DEFAULT_MODEL_PATH)
-    
-    socketserver.TCPServer.allow_reuse_address = True
-    with socketserver.TCPServer((listen_on, port), OntoJSONHandler) as server:
+
+    if os.getenv("ONTO_WARMUP", "1") != "0":
+        import warmup
+        report = warmup.warm_up(model)
+        print("Warm-up done in", report["seconds"], "s;", report["requests"],
+              "canned requests; first request", report["first_request_ms"], "ms")
+        sys.stdout.flush()
+
+    # batching only pays off when requests are handled concurrently
+    server_cls = OntoThreadingTCPServer if model.batcher else OntoTCPServer
+    with server_cls((listen_on, port), OntoJSONHandler) as server:
         server.onto_model = model
         server.serve_forever()
 
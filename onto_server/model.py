@@ -1,6 +1,8 @@
 import json
+import hashlib
 import numpy as np
 import collections
+import time
 import torch
 import torch.optim
 import joblib
@@ -11,9 +13,17 @@ import torch.nn as nn
 
 from torch.utils.data import DataLoader
 import featurize
+import featurize_pool
+import numpy_infer
+import surrogate
+import knn_memory
+import model_artifact
+import reward_scale
+import tree_backend
 from logger import log_matrix, close_log
 
 from net_cnn_delta import CNNMatrixDelta
+from net_two_tower import TwoTowerDelta
 
 CUDA = torch.cuda.is_available()
 
@@ -46,16 +56,155 @@ def _inv_log1p(x):
 def _onto_path(base, name):
             return os.path.join(base, f"onto_{name}")
 
+
+# ONTO_MODEL_ARCH: "cnn" (CNNMatrixDelta) or "two_tower" (TwoTowerDelta, needs
+# the global feature mode)
+ARCHS = ("cnn", "two_tower")
+
+
+def ensemble_size():
+    """ONTO_ENSEMBLE: delta heads of a cnn model (1, the default, is a single head)."""
+    return max(1, int(os.getenv("ONTO_ENSEMBLE", "1")))
+
+
+def model_arch():
+    arch = os.getenv("ONTO_MODEL_ARCH", "cnn")
+    if arch not in ARCHS:
+        raise ValueError(f"ONTO_MODEL_ARCH must be one of {ARCHS}, not {arch!r}")
+    return arch
+
+
+# Backend (onto.cfg) / ONTO_BACKEND: "cnn" (the torch net picked by
+# ONTO_MODEL_ARCH) or "hgb" (tree_backend.TreeRegressor)
+BACKENDS = ("cnn", "hgb")
+
+
+def model_backend():
+    backend = os.getenv("ONTO_BACKEND")
+    if backend is None:
+        import configparser
+        config = configparser.ConfigParser()
+        config.read("onto.cfg")
+        backend = config.get("onto", "Backend", fallback="cnn")
+    backend = backend.strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, not {backend!r}")
+    return backend
+
+
+def default_feature_mode():
+    return "global" if model_arch() == "two_tower" else featurize.feature_mode()
+
+
+def train_seconds():
+    """ONTO_TRAIN_SECONDS: wall-clock budget of one CNN training run; None (unset or 0) for no limit."""
+    seconds = float(os.getenv("ONTO_TRAIN_SECONDS", "0"))
+    return seconds if seconds > 0 else None
+
+
+# resumable training state, written to the directory the model is trained into
+CHECKPOINT_NAME = "onto_train_checkpoint.pt"
+
+
+def _save_checkpoint(path, state):
+    # written aside and renamed: a run killed mid-write keeps the previous one
+    torch.save(state, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _load_checkpoint(path, fingerprint):
+    """The checkpoint at path if it was taken on the same data and model shape, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        state = torch.load(path, map_location="cpu", weights_only=False)
+    except Exception as e:
+        print(f"[CNN] ignoring unreadable checkpoint {path}: {e}")
+        return None
+    return state if state.get("fingerprint") == fingerprint else None
+
+
+# serving runtimes for a torch-backed model (ONTO_TORCH_RUNTIME)
+RUNTIMES = ("fp32", "scripted", "quantized")
+_SCRIPT_FILES = {"scripted": "onto_cnn_delta.ts", "quantized": "onto_cnn_delta_int8.ts"}
+# written by _save_common, and for network backends in onto_model.bin as well
+_COMMON_FILES = ["onto_backend", "onto_y_transform", "onto_channels", "onto_feature_mode",
+                 "onto_arch", "onto_attr_prune", "onto_ensemble", "onto_surrogate",
+                 knn_memory.NPZ_NAME]
+
+_threads_pinned = False
+
+
+def pin_torch_threads():
+    """
+    Inference threads for a serving process, once: ONTO_TORCH_THREADS (default
+    1) intra-op and 1 inter-op. The planning hosts share their cores with
+    PostgreSQL, and a one-query forward pass gains nothing from a thread pool.
+    The setting is process-wide, so only the server (main.new_regression)
+    calls it; load() does not, or a retrain after it would run on one thread.
+    """
+    global _threads_pinned
+    if _threads_pinned:
+        return
+    torch.set_num_threads(max(1, int(os.getenv("ONTO_TORCH_THREADS", "1"))))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # only allowed before the first parallel op in this process
+        pass
+    _threads_pinned = True
+
+
+def compile_runtime(net, runtime):
+    """A frozen TorchScript copy of an eval-mode CNNMatrixDelta; "quantized" first
+    converts its Linear layers to dynamic int8."""
+    import copy
+    net = copy.deepcopy(net).cpu().eval()
+    if runtime == "quantized":
+        net = torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+    return torch.jit.freeze(torch.jit.script(net))
+
+
+def _probe_inputs(in_channels, seed=0):
+    # feature matrices are mostly 0/1 flags and [0, 1] shares
+    g = torch.Generator().manual_seed(seed)
+    return [torch.rand(n, in_channels, generator=g).round() * torch.rand(n, in_channels, generator=g)
+            for n in (4, 12, 32, 64)]
+
+
+def featurize_training_set(plans, num_arms, mode=None, attr_prune="env"):
+    """
+    Build the (columns, channels) matrix of every plan with a valid arm index,
+    in feature mode `mode` (default: what ONTO_FEATURE_MODE / ONTO_MODEL_ARCH ask for)
+    with attribute pruning `attr_prune` (default ONTO_ATTR_PRUNE).
+    Returns (matrices, arm_ids, kept) where kept are the positions in `plans`
+    that produced a matrix.
+    """
+    tasks, arm_ids, kept = [], [], []
+    for i, plan in enumerate(plans):
+        meta = dict(plan.get("metadata", {}) or {})
+        arm_idx = meta.get('arm_config_json', {}).get('index', -1)
+        if arm_idx < 0 or arm_idx >= num_arms:
+            continue
+        tasks.append((meta, plan))
+        arm_ids.append(int(arm_idx))
+        kept.append(i)
+    if attr_prune == "env":
+        attr_prune = featurize.attr_prune()
+    # ONTO_FEATURIZE_WORKERS > 1 spreads this over a process pool
+    X_list = featurize_pool.build_feature_matrices(tasks, num_arms,
+                                                   mode=mode or default_feature_mode(),
+                                                   attr_prune=attr_prune)
+    return X_list, arm_ids, kept
+
+
 class OntoRegression:
     def __init__(self, have_cache_data=False, verbose=False):
         # self.verbose = verbose
         self.have_cache_data = have_cache_data
 
-        # --- kNN related ---
-        self.knn_db_g = None
-        self.knn_db_g_norm = None
-        self.knn_db_y = None
-        self.knn_db_arm = None
+        # --- kNN reward memory (knn_memory.KNNMemory, ONTO_KNN=1) ---
+        self.knn = None
         self.knn_k = 5
 
         self.alpha_temp = 0.06
@@ -71,8 +220,16 @@ class OntoRegression:
         self.verbose = verbose
         self.model = None
         self.in_channels = None
+        self.backend_name = model_backend()
+        self.arch = model_arch()
+        self.ensemble = ensemble_size() if self.arch == "cnn" else 1
+        self.feature_mode = default_feature_mode()
+        self.attr_prune = featurize.attr_prune()
+        self.runtime, self.runtime_model, self.drift = "fp32", None, None
+        self.surrogate = None
         log_t = preprocessing.FunctionTransformer(np.log1p, np.expm1, validate=True)
         self.reward_pipeline = Pipeline([('log', log_t), ('scale', preprocessing.MinMaxScaler())])
+        self.reward_scale = None
 
 
     def _ensure_model(self, in_dim, device):
@@ -84,6 +241,9 @@ class OntoRegression:
             self.model.to(device)
 
     def adjacency_to_edge_index(self, adj):
+        # a featurize.build_graph() graph converts without an N x N matrix
+        if isinstance(adj, dict):
+            return featurize.edge_index(adj, as_tensor=True)
         row, col = torch.nonzero(adj, as_tuple=True)
         edge_index = torch.stack([row, col], dim=0)
         return edge_index
@@ -95,8 +255,12 @@ class OntoRegression:
             and len(list(self.model.parameters())) > 0
         )
 
-    def predict(self, plans):
-        results = []
+    def predict(self, plans, with_std=False):
+        """
+        Predicted rewards for plans; with_std also returns the spread of the
+        ensemble members' predictions (None for a single-head model).
+        """
+        scaled, member_scaled = [], []
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
         if self.is_torch_model():
@@ -105,6 +269,7 @@ class OntoRegression:
 
         num_of_arms = getattr(self, "num_arms", None) or 7
 
+        mats, arm_ids = [], []
         for plan in plans:
             meta = plan["metadata"]
             arm_cfg = plan.get("arm_config") or plan.get("arm_config_json", {})
@@ -114,65 +279,129 @@ class OntoRegression:
             if arm_idx < 0 or arm_idx >= num_of_arms:
                 arm_idx = 0
 
-            X = featurize.build_feature_matrix(meta, num_of_arms, plan).T
+            X = featurize.build_model_input(meta, num_of_arms, plan, self.feature_mode, self.attr_prune)
 
             if self.is_torch_model():
                 X = torch.from_numpy(X).float().to(device)
                 with torch.no_grad():
-                    base, delta = self.model(X)
+                    base, delta = (self.runtime_model or self.model)(X)
                     delta = delta.view(-1, num_of_arms)[0]
-
-                    raw   = delta[arm_idx]
-                    tau = 0.5
-                    k   = 6.0
-
-                    score = F.softplus(raw / tau) - math.log(2.0)
-
-                    y_scaled = torch.sigmoid(k * score)
-
-                    eps = 1e-3
-                    y_scaled = torch.clamp(y_scaled - 0.5, 0.0, 1.0)
-
-                    pred_scaled = float(y_scaled.item())
-
+                    pred_scaled = self._scaled(delta[arm_idx])
+                    if self.knn is not None:
+                        g = self.model.embed(X).cpu().numpy()
+                        pred_scaled = float(self.knn.blend(g, [arm_idx], [pred_scaled])[0])
+                    if self.ensemble > 1:
+                        members = self.model.delta_head.members_out(self.model.embed(X))[:, 0, arm_idx]
+                        member_scaled.append([self._scaled(m) for m in members])
+                scaled.append(pred_scaled)
             else:
-                X_flat = X.flatten().reshape(1, -1)
-                pred_scaled = float(self.model.predict([X_flat]).reshape(-1)[0])
-
-            real_pred = self.reward_pipeline.inverse_transform([[1.0 - pred_scaled]])[0][0]
-
-            results.append(real_pred)
-
-        return np.array(results, dtype=float)
-
-
-    def fit(self, plans, rewards):
+                mats.append(X)
+                arm_ids.append(arm_idx)
+
+        if mats:
+            # tree backend: every plan in one call
+            scaled = self.model.predict_scaled(mats, arm_ids)
+
+        # every plan's reward in one vectorized inverse scaling
+        results = self.real_rewards(scaled)
+        if with_std:
+            stds = None
+            if member_scaled:
+                member_scaled = np.array(member_scaled, dtype=float)
+                stds = self.real_rewards(member_scaled).reshape(member_scaled.shape).std(axis=1)
+            return results, stds
+        return results
+
+    def real_rewards(self, pred_scaled):
+        """Real rewards for scaled predictions: the reward pipeline's inverse, as one array."""
+        if self.reward_scale is None or self.reward_scale.pipeline is not self.reward_pipeline:
+            self.reward_scale = reward_scale.RewardScale(self.reward_pipeline)
+        return self.reward_scale.real(pred_scaled)
+
+    @staticmethod
+    def _scaled(raw):
+        tau = 0.5
+        k   = 6.0
+
+        score = F.softplus(raw / tau) - math.log(2.0)
+
+        y_scaled = torch.sigmoid(k * score)
+
+        y_scaled = torch.clamp(y_scaled - 0.5, 0.0, 1.0)
+
+        return float(y_scaled.item())
+
+    def runtime_drift(self, runtime_model, num_probes=4):
+        """
+        How far runtime_model's predictions are from the eager model's on probe
+        matrices: max absolute error of the raw deltas and of the predicted
+        reward, over every arm.
+        """
+        worst_delta, worst_pred = 0.0, 0.0
+        with torch.no_grad():
+            for X in _probe_inputs(self.in_channels)[:num_probes]:
+                _, d0 = self.model.cpu()(X)
+                _, d1 = runtime_model(X)
+                d0, d1 = d0.view(-1), d1.view(-1)
+                worst_delta = max(worst_delta, float((d0 - d1).abs().max()))
+                for a in range(d0.numel()):
+                    y0, y1 = self.real_rewards([self._scaled(d0[a]), self._scaled(d1[a])])
+                    worst_pred = max(worst_pred, abs(float(y0) - float(y1)))
+        return {"max_abs_delta": worst_delta, "max_abs_pred": worst_pred}
+
+
+    def fit(self, plans, rewards, seed=None, checkpoint_dir=None):
         assert isinstance(plans, (list, tuple)), "fit(plans, rewards): plans must be a list"
         rewards = np.array(rewards).reshape(-1)
         if len(plans) != len(rewards):
             raise ValueError(f"plans ({len(plans)}) and rewards ({len(rewards)}) length mismatch")
 
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
         y = np.array(rewards, dtype=np.float32).reshape(-1, 1)
         y_scaled = (1.0 - self.reward_pipeline.fit_transform(y)).astype(np.float32).squeeze(1)
+        self.reward_scale = None  # refitted: compile again
+
+        X_list, arm_ids, kept = featurize_training_set(plans, self.num_arms, self.feature_mode, self.attr_prune)
+        y_list = [float(y_scaled[i]) for i in kept]
+        return self._train(X_list, arm_ids, y_list, seed=seed, checkpoint_dir=checkpoint_dir)
+
+    def fit_featurized(self, X_list, arm_ids, rewards, seed=None, checkpoint_dir=None):
+        """Fit on matrices already built by featurize_training_set (e.g. shared-memory views)."""
+        if len(X_list) != len(rewards) or len(X_list) != len(arm_ids):
+            raise ValueError(f"X_list ({len(X_list)}), arm_ids ({len(arm_ids)}) and "
+                             f"rewards ({len(rewards)}) length mismatch")
+
+        y = np.array(rewards, dtype=np.float32).reshape(-1, 1)
+        y_scaled = (1.0 - self.reward_pipeline.fit_transform(y)).astype(np.float32).squeeze(1)
+        self.reward_scale = None  # refitted: compile again
+        return self._train(list(X_list), list(arm_ids), [float(v) for v in y_scaled], seed=seed,
+                           checkpoint_dir=checkpoint_dir)
+
+    def _train(self, X_list, arm_ids, y_list, seed=None, checkpoint_dir=None):
+        """
+        checkpoint_dir: write the training state there every
+        ONTO_CHECKPOINT_SECONDS (default 30), and resume from it when a run
+        on the same data was interrupted. With ONTO_TRAIN_SECONDS, training
+        stops when the budget is spent and keeps the best epoch so far.
+        """
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        X_list, arm_ids, y_list = [], [], []
-        for plan, yv in zip(plans, y_scaled): 
-            meta = dict(plan.get("metadata", {}) or {})
-            arm_idx = meta.get('arm_config_json', {}).get('index', -1)
-            if arm_idx < 0 or arm_idx >= self.num_arms:
-                continue
-            X = featurize.build_feature_matrix(meta, self.num_arms, plan).T 
-            X_list.append(torch.tensor(X, dtype=torch.float32))
-            arm_ids.append(int(arm_idx))
-            y_list.append(float(yv))
         if len(X_list) == 0:
             raise RuntimeError('No samples with valid arm index')
+        if self.backend_name == "hgb":
+            self.in_channels = self.in_channels or X_list[0].shape[1]
+            self.model = tree_backend.TreeRegressor(self.num_arms, self.feature_mode,
+                                                    seed=seed or 0).fit(X_list, arm_ids, y_list)
+            self.surrogate = self.knn = None
+            return self
+        if seed is not None:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+
+        X_list = [torch.as_tensor(X, dtype=torch.float32) for X in X_list]
 
         if self.in_channels is None:
             self.in_channels = X_list[0].shape[1]
-        self.model = CNNMatrixDelta(in_channels=self.in_channels, num_arms=self.num_arms).to(device)
+        self.model = self._build_net().to(device)
 
         optimizer = optim.AdamW(self.model.parameters(), lr=1e-3, weight_decay=1e-3) 
         mse = nn.MSELoss()
@@ -180,21 +409,56 @@ class OntoRegression:
         epochs, min_epoch, patience = 50, 20, 5
         best_loss, patience_ctr = 1e9, 0
 
+        if self.ensemble > 1:
+            # bootstrap: each member sees every sample Poisson(1) times, so they disagree where data is thin
+            boot = torch.poisson(torch.ones(self.ensemble, len(X_list))).to(device)
+
+        budget = train_seconds()
+        start = time.perf_counter()
+        deadline = start + budget if budget is not None else None
+        every = float(os.getenv("ONTO_CHECKPOINT_SECONDS", "30"))
+        ckpt_path = os.path.join(checkpoint_dir, CHECKPOINT_NAME) if checkpoint_dir else None
+        fingerprint = self._train_fingerprint(X_list, arm_ids, y_list) if ckpt_path else None
+        first_ep, best_ep, best_state = 0, None, None
+        resumed = _load_checkpoint(ckpt_path, fingerprint) if ckpt_path else None
+        if resumed is not None:
+            self.model.load_state_dict(resumed["model"])
+            optimizer.load_state_dict(resumed["optimizer"])
+            torch.set_rng_state(resumed["rng"])
+            first_ep, best_loss, patience_ctr = resumed["epoch"], resumed["best_loss"], resumed["patience"]
+            best_ep, best_state = resumed["best_epoch"], resumed["best_state"]
+            if self.ensemble > 1:
+                boot = resumed["boot"].to(device)
+            print(f"[CNN] resuming from {ckpt_path} at epoch {first_ep}")
+        last_ckpt = time.perf_counter()
+
         self.model.train()
-        for ep in range(epochs):
+        expired, ep = False, first_ep - 1
+        for ep in range(first_ep, epochs):
             total = 0.0
+            ep_start = time.perf_counter()
             for i, X in enumerate(X_list):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    expired = True
+                    break
                 X = X.to(device)
                 a = arm_ids[i]
                 target = torch.tensor(y_list[i], dtype=torch.float32, device=device)
 
-                base, delta = self.model(X)
-                base  = base.view(-1)[0]
-                delta = delta.view(-1, self.num_arms)[0]
+                if self.ensemble > 1:
+                    g = self.model.embed(X)
+                    base = self.model.base_head(g).view(-1)[0]
+                    members = self.model.delta_head.members_out(g)[:, 0, a]
+                    loss_base = mse(base, target)
+                    loss_delta = (boot[:, i] * (members - (target - base).detach()) ** 2).mean()
+                else:
+                    base, delta = self.model(X)
+                    base  = base.view(-1)[0]
+                    delta = delta.view(-1, self.num_arms)[0]
 
-                pred = base + delta[a]
-                loss_base  = mse(base,  target)
-                loss_delta = mse(delta[a], (target - base).detach())
+                    pred = base + delta[a]
+                    loss_base  = mse(base,  target)
+                    loss_delta = mse(delta[a], (target - base).detach())
 
                 loss = loss_base + 0.5 * loss_delta
 
@@ -202,42 +466,269 @@ class OntoRegression:
                 loss.backward()
                 optimizer.step()
                 total += float(loss.item())
+            if expired:
+                # a partial epoch's loss is not comparable: it does not count
+                break
 
-            if self.verbose and (ep % 5 == 0 or ep == epochs-1):
-                print(f"[CNN] epoch {ep} loss={total:.4f}")
+            took = time.perf_counter() - ep_start
+            if self.verbose:
+                print(f"[CNN] epoch {ep} loss={total:.4f} {took:.2f}s "
+                      f"{len(X_list) / max(took, 1e-9):.1f} samples/s")
 
+            stop = False
             if total + 1e-4 < best_loss:
                 best_loss = total
                 patience_ctr = 0
+                if deadline is not None or ckpt_path:
+                    best_ep = ep
+                    best_state = {k: v.detach().clone() for k, v in self.model.state_dict().items()}
             else:
                 patience_ctr += 1
                 if ep >= min_epoch and patience_ctr >= patience:
                     if self.verbose:
                         print(f"[CNN] early stop at {ep}")
-                    break
+                    stop = True
+
+            if ckpt_path and not stop and time.perf_counter() - last_ckpt >= every:
+                _save_checkpoint(ckpt_path, {
+                    "fingerprint": fingerprint, "epoch": ep + 1,
+                    "model": self.model.state_dict(), "optimizer": optimizer.state_dict(),
+                    "rng": torch.get_rng_state(), "best_loss": best_loss, "patience": patience_ctr,
+                    "best_epoch": best_ep, "best_state": best_state,
+                    "boot": boot.cpu() if self.ensemble > 1 else None})
+                last_ckpt = time.perf_counter()
+            if stop:
+                break
+
+        elapsed = time.perf_counter() - start
+        if expired:
+            if best_state is not None:
+                self.model.load_state_dict(best_state)
+            best = f"epoch {best_ep} (loss={best_loss:.4f})" if best_state is not None else "the current weights"
+            print(f"[CNN] ONTO_TRAIN_SECONDS={budget:g} spent in epoch {ep} after {elapsed:.1f}s; "
+                  f"keeping {best}")
+        elif self.verbose:
+            print(f"[CNN] trained {ep + 1 - first_ep} epochs in {elapsed:.1f}s")
+        if ckpt_path and os.path.exists(ckpt_path):
+            # finished: the next run starts afresh
+            os.remove(ckpt_path)
 
         self.model.eval()
+        self.surrogate = self.knn = None
+        if knn_memory.enabled() and self.arch == "cnn":
+            self.knn = self._build_knn(X_list, arm_ids, y_list, device)
+        else:
+            # the cascade never uses a surrogate next to a kNN memory (surrogate.Cascade)
+            self.surrogate = self._distill(X_list, arm_ids, device)
         return self
 
-    def save(self, path):
+    def _train_fingerprint(self, X_list, arm_ids, y_list):
+        # a checkpoint only resumes the same training set on the same model shape
+        h = hashlib.sha1(json.dumps([self.arch, self.ensemble, self.num_arms, self.in_channels,
+                                     self.feature_mode, [tuple(X.shape) for X in X_list]]).encode())
+        h.update(np.asarray(arm_ids, dtype=np.int64).tobytes())
+        h.update(np.asarray(y_list, dtype=np.float32).tobytes())
+        for X in X_list:
+            h.update(np.ascontiguousarray(np.asarray(X, dtype=np.float32)).tobytes())
+        return h.hexdigest()
+
+    def _build_knn(self, X_list, arm_ids, y_list, device):
+        # embeddings of the training plans with their scaled rewards, for blending
+        with torch.no_grad():
+            g = np.stack([self.model.embed(X.to(device))[0].cpu().numpy() for X in X_list])
+        return knn_memory.KNNMemory(g, y_list, arm_ids, self.num_arms, k=self.knn_k,
+                                    temp=self.alpha_temp, alpha_min=self.alpha_min,
+                                    alpha_max=self.alpha_max)
+
+    def _distill(self, X_list, arm_ids, device):
+        # the cascade's fast path (surrogate.Cascade), fitted to the trained net's outputs
+        raw = []
+        with torch.no_grad():
+            for X, a in zip(X_list, arm_ids):
+                _, delta = self.model(X.to(device))
+                raw.append(float(delta.view(-1, self.num_arms)[0, a]))
+        return surrogate.distill([X.numpy() for X in X_list], arm_ids, raw,
+                                 self.num_arms, self.feature_mode)
+
+    def _global_dim(self):
+        return featurize.NUM_GLOBAL if self.feature_mode == "global" else 0
+
+    def _sql_dims(self):
+        # the SQL tower's share of the per-column rows and of the globals
+        return len(featurize.ATTRIBUTE_ROWS), featurize.NUM_STATIC_GLOBAL
+
+    def _build_net(self):
+        if self.arch == "two_tower":
+            sql_channels, sql_global_dim = self._sql_dims()
+            return TwoTowerDelta(in_channels=self.in_channels, num_arms=self.num_arms,
+                                 global_dim=self._global_dim(), sql_channels=sql_channels,
+                                 sql_global_dim=sql_global_dim)
+        return CNNMatrixDelta(in_channels=self.in_channels, num_arms=self.num_arms,
+                              global_dim=self._global_dim(), ensemble=self.ensemble)
+
+    def save(self, path, torchscript=None, legacy=None):
+        """
+        Network backends are saved as onto_model.bin alone. legacy (default:
+        ONTO_SAVE_LEGACY=1) also writes the older per-part files
+        (onto_cnn_delta.pt, .npz, joblib) for tools that predate it.
+        torchscript (default: ONTO_SAVE_TORCHSCRIPT=1) also writes the frozen
+        TorchScript graphs for ONTO_TORCH_RUNTIME=scripted / quantized.
+        """
         os.makedirs(path, exist_ok=True)
-        torch.save(self.model.state_dict(), os.path.join(path, 'onto_cnn_delta.pt'))
-        import joblib
+        if legacy is None:
+            legacy = os.getenv("ONTO_SAVE_LEGACY", "0") == "1"
+        # a directory reused across backends must not keep the other one's model,
+        # nor older copies of this one that could disagree with it
+        if self.backend_name == "hgb":
+            stale = (['onto_cnn_delta.pt', numpy_infer.NPZ_NAME, model_artifact.FILE_NAME]
+                     + list(_SCRIPT_FILES.values()))
+        else:
+            stale = [numpy_infer.TREE_NAME]
+            if not legacy:
+                stale += ['onto_cnn_delta.pt', numpy_infer.NPZ_NAME] + _COMMON_FILES
+        for name in stale:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        if self.backend_name == "hgb":
+            self._save_common(path)
+            with open(os.path.join(path, numpy_infer.TREE_NAME), 'wb') as f:
+                joblib.dump(self.model, f)
+            return
+        if legacy:
+            torch.save(self.model.state_dict(), os.path.join(path, 'onto_cnn_delta.pt'))
+            # same weights for the torch-free server (numpy_infer)
+            numpy_infer.export_npz(self.model.state_dict(), numpy_infer.npz_path(path), self.num_arms,
+                                   global_dim=self._global_dim(), arch=self.arch,
+                                   sql_dims=self._sql_dims(), attr_prune=self.attr_prune)
+            self._save_common(path)
+        if torchscript is None:
+            torchscript = os.getenv("ONTO_SAVE_TORCHSCRIPT", "0") == "1"
+        if torchscript:
+            for runtime, name in _SCRIPT_FILES.items():
+                torch.jit.save(compile_runtime(self.model, runtime), os.path.join(path, name))
+        self._save_artifact(path)
+
+    def _save_artifact(self, path):
+        # onto_model.bin: everything a network model needs in one memory-mappable
+        # file, which both loaders prefer
+        header = {"backend": self.backend_name, "arch": self.arch, "in_channels": self.in_channels,
+                  "num_arms": self.num_arms, "feature_mode": self.feature_mode,
+                  "global_dim": self._global_dim(), "sql_dims": list(self._sql_dims()),
+                  "kernel_size": numpy_infer.KERNEL_SIZE, "dilations": list(numpy_infer.DILATIONS),
+                  "attr_prune": self.attr_prune, "ensemble": self.ensemble,
+                  "layout_hash": model_artifact.layout_hash(self.feature_mode),
+                  "reward_scaler": model_artifact.scaler_params(self.reward_pipeline),
+                  "surrogate": None, "knn": self.knn is not None}
+        tensors = {f"net.{k}": v.detach().cpu().numpy().astype(np.float32)
+                   for k, v in self.model.state_dict().items()}
+        if self.surrogate is not None:
+            s = self.surrogate
+            header["surrogate"] = {"num_arms": s.num_arms, "feature_mode": s.feature_mode,
+                                   "alpha": s.alpha, "report": s.report}
+            tensors.update({"surrogate.mean": s.mean, "surrogate.scale": s.scale,
+                            "surrogate.weights": s.weights})
+        if self.knn is not None:
+            tensors.update({f"knn.{k}": v for k, v in self.knn.arrays().items()})
+        model_artifact.write(model_artifact.artifact_path(path), header, tensors)
+
+    def _save_common(self, path):
+        # what every backend needs besides its model file
+        with open(os.path.join(path, 'onto_backend'), 'wb') as f:
+            joblib.dump(self.backend_name, f)
         with open(os.path.join(path, 'onto_y_transform'), 'wb') as f:
             joblib.dump(self.reward_pipeline, f)
         with open(os.path.join(path, 'onto_channels'), 'wb') as f:
             joblib.dump(self.in_channels, f)
+        with open(os.path.join(path, 'onto_feature_mode'), 'wb') as f:
+            joblib.dump(self.feature_mode, f)
+        with open(os.path.join(path, 'onto_arch'), 'wb') as f:
+            joblib.dump(self.arch, f)
+        with open(os.path.join(path, 'onto_attr_prune'), 'wb') as f:
+            joblib.dump(self.attr_prune, f)
+        with open(os.path.join(path, 'onto_ensemble'), 'wb') as f:
+            joblib.dump(self.ensemble, f)
+        if self.surrogate is not None:
+            with open(os.path.join(path, 'onto_surrogate'), 'wb') as f:
+                joblib.dump(self.surrogate, f)
+        if self.knn is not None:
+            self.knn.save(os.path.join(path, knn_memory.NPZ_NAME))
+        elif os.path.exists(os.path.join(path, knn_memory.NPZ_NAME)):
+            os.remove(os.path.join(path, knn_memory.NPZ_NAME))
 
     def load(self, path):
+        if model_artifact.has_artifact(path):
+            return self._load_artifact(model_artifact.artifact_path(path))
         import joblib
         with open(os.path.join(path, 'onto_y_transform'), 'rb') as f:
             self.reward_pipeline = joblib.load(f)
         with open(os.path.join(path, 'onto_channels'), 'rb') as f:
             self.in_channels = joblib.load(f)
-        self.model = CNNMatrixDelta(in_channels=self.in_channels, num_arms=self.num_arms)
+        self.feature_mode = "broadcast"
+        if os.path.exists(os.path.join(path, 'onto_feature_mode')):
+            with open(os.path.join(path, 'onto_feature_mode'), 'rb') as f:
+                self.feature_mode = joblib.load(f)
+        self.arch = "cnn"
+        if os.path.exists(os.path.join(path, 'onto_arch')):
+            with open(os.path.join(path, 'onto_arch'), 'rb') as f:
+                self.arch = joblib.load(f)
+        self.attr_prune = None
+        if os.path.exists(os.path.join(path, 'onto_attr_prune')):
+            with open(os.path.join(path, 'onto_attr_prune'), 'rb') as f:
+                self.attr_prune = joblib.load(f)
+        self.ensemble = 1
+        if os.path.exists(os.path.join(path, 'onto_ensemble')):
+            with open(os.path.join(path, 'onto_ensemble'), 'rb') as f:
+                self.ensemble = joblib.load(f)
+        self.surrogate = None
+        if os.path.exists(os.path.join(path, 'onto_surrogate')):
+            with open(os.path.join(path, 'onto_surrogate'), 'rb') as f:
+                self.surrogate = joblib.load(f)
+        self.knn = knn_memory.load_if_present(path)
+        self.backend_name = "cnn"
+        if os.path.exists(os.path.join(path, 'onto_backend')):
+            with open(os.path.join(path, 'onto_backend'), 'rb') as f:
+                self.backend_name = joblib.load(f)
+        if self.backend_name == "hgb":
+            with open(os.path.join(path, numpy_infer.TREE_NAME), 'rb') as f:
+                self.model = joblib.load(f)
+            self.runtime, self.runtime_model, self.drift = "fp32", None, None
+            return self
         state = torch.load(os.path.join(path, 'onto_cnn_delta.pt'),
                            map_location=('cuda' if torch.cuda.is_available() else 'cpu'))
+        return self._load_net(state, path)
+
+    def _load_artifact(self, path):
+        header, tensors = model_artifact.load(path)
+        self.reward_pipeline, self.surrogate, self.knn = model_artifact.side_models(header, tensors)
+        self.backend_name, self.arch = header["backend"], header["arch"]
+        self.in_channels, self.num_arms = header["in_channels"], header["num_arms"]
+        self.feature_mode, self.attr_prune = header["feature_mode"], header["attr_prune"]
+        self.ensemble = header["ensemble"]
+        # the mapped arrays are read-only: torch needs its own copy
+        state = {k: torch.from_numpy(np.array(v)) for k, v in model_artifact.split(tensors, "net").items()}
+        return self._load_net(state, os.path.dirname(path))
+
+    def _load_net(self, state, path):
+        self.model = self._build_net()
         self.model.load_state_dict(state)
         self.model.to(torch.device('cuda' if torch.cuda.is_available() else 'cpu'))
         self.model.eval()
-        return self
\ No newline at end of file
+        self._load_runtime(path)
+        return self
+
+    def _load_runtime(self, path):
+        # ONTO_TORCH_RUNTIME=fp32 (eager, default) | scripted | quantized
+        runtime = os.getenv("ONTO_TORCH_RUNTIME", "fp32").lower()
+        if runtime not in RUNTIMES:
+            raise ValueError(f"ONTO_TORCH_RUNTIME must be one of {RUNTIMES}, not {runtime!r}")
+        self.runtime, self.runtime_model, self.drift = runtime, None, None
+        if runtime == "fp32" or torch.cuda.is_available():
+            return
+        fp = os.path.join(path, _SCRIPT_FILES[runtime])
+        if os.path.exists(fp):
+            self.runtime_model = torch.jit.load(fp, map_location="cpu")
+        else:
+            # saved without TorchScript: compile it now
+            self.runtime_model = compile_runtime(self.model, runtime)
+        self.drift = self.runtime_drift(self.runtime_model)
+        print(f"[OntoRegression] {runtime} runtime, drift vs. eager: {self.drift}")
\ No newline at end of file
@@ -0,0 +1,178 @@
+# model_artifact.py
+# onto_model.bin: everything a network model directory needs at serving time
+# in one versioned file. A fixed prefix (magic, schema version, header length)
+# and a JSON header (shapes, reward-scaler parameters, feature-layout hash,
+# tensor table, checksum) are followed by 64-byte aligned tensors, which
+# load() memory-maps: nothing is unpickled and nothing is copied up front.
+#
+# Inspect a model directory with
+#   python3 model_artifact.py onto_default_model
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import featurize
+
+FILE_NAME = "onto_model.bin"
+MAGIC = b"ONTOMDL\0"
+SCHEMA_VERSION = 1
+ALIGN = 64
+_PREFIX = struct.Struct("<8sII")  # magic, schema version, header bytes
+
+
+def artifact_path(model_dir):
+    return os.path.join(model_dir, FILE_NAME)
+
+
+def has_artifact(model_dir):
+    return os.path.exists(artifact_path(model_dir))
+
+
+def layout_hash(feature_mode):
+    """Fingerprint of featurize's channel layout in feature_mode."""
+    layout = {"mode": feature_mode, "channels": featurize.feature_layout(feature_mode)}
+    return hashlib.sha1(json.dumps(layout).encode()).hexdigest()[:16]
+
+
+def scaler_params(reward_pipeline):
+    """The fitted MinMaxScaler of an OntoRegression reward pipeline, as plain floats."""
+    s = reward_pipeline.named_steps["scale"]
+    return {"min": float(s.min_[0]), "scale": float(s.scale_[0]),
+            "data_min": float(s.data_min_[0]), "data_max": float(s.data_max_[0]),
+            "feature_range": [float(v) for v in s.feature_range],
+            "samples": int(s.n_samples_seen_)}
+
+
+def reward_pipeline(params):
+    """The log1p + MinMaxScaler pipeline scaler_params() came from, without refitting."""
+    from sklearn import preprocessing
+    from sklearn.pipeline import Pipeline
+    log_t = preprocessing.FunctionTransformer(np.log1p, np.expm1, validate=True)
+    s = preprocessing.MinMaxScaler(feature_range=tuple(params["feature_range"]))
+    s.min_ = np.array([params["min"]])
+    s.scale_ = np.array([params["scale"]])
+    s.data_min_ = np.array([params["data_min"]])
+    s.data_max_ = np.array([params["data_max"]])
+    s.data_range_ = s.data_max_ - s.data_min_
+    s.n_features_in_ = 1
+    s.n_samples_seen_ = params["samples"]
+    return Pipeline([('log', log_t), ('scale', s)])
+
+
+def _align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def write(path, header, tensors):
+    """
+    Write header (JSON-able) and tensors ({name: array}) to path. The tensor
+    table, data size and crc32 are added to the header; the file is written
+    next to path and renamed over it, so readers never see half a model.
+    """
+    table, offset = {}, 0
+    arrays = {}
+    for name, v in tensors.items():
+        a = np.ascontiguousarray(v)
+        arrays[name] = a
+        table[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset = _align(offset + a.nbytes)
+    data = bytearray(offset)
+    for name, a in arrays.items():
+        at = table[name]["offset"]
+        data[at:at + a.nbytes] = a.tobytes()
+    header = dict(header, schema=SCHEMA_VERSION, tensors=table, data_bytes=len(data),
+                  crc32=zlib.crc32(data))
+    blob = json.dumps(header).encode()
+    # pad the header so the data starts on an ALIGN boundary
+    blob += b" " * (_align(_PREFIX.size + len(blob)) - _PREFIX.size - len(blob))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, SCHEMA_VERSION, len(blob)))
+        f.write(blob)
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def read_header(path):
+    """(header, data offset) of an artifact; ValueError if it is not one this code reads."""
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"{path}: truncated")
+        magic, schema, size = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an Onto model artifact")
+        if schema != SCHEMA_VERSION:
+            raise ValueError(f"{path}: schema version {schema}, this server reads {SCHEMA_VERSION}")
+        header = json.loads(f.read(size))
+    return header, _PREFIX.size + size
+
+
+def check(path):
+    """
+    The header of the artifact at path after the cheap checks: schema, file
+    size and that its feature layout matches this featurize. ValueError otherwise.
+    """
+    header, start = read_header(path)
+    if os.path.getsize(path) != start + header["data_bytes"]:
+        raise ValueError(f"{path}: {os.path.getsize(path)} bytes, header says "
+                         f"{start + header['data_bytes']}")
+    expected = layout_hash(header["feature_mode"])
+    if header["layout_hash"] != expected:
+        raise ValueError(f"{path}: feature layout {header['layout_hash']} does not match "
+                         f"this server's {expected} ({header['feature_mode']} mode)")
+    return header
+
+
+def load(path, verify=None):
+    """
+    (header, {name: read-only array}) with the arrays memory-mapped from path.
+    verify (default: ONTO_ARTIFACT_VERIFY, on) also checks the data's crc32.
+    """
+    header = check(path)
+    start = os.path.getsize(path) - header["data_bytes"]
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=start, shape=(header["data_bytes"],))
+    if verify is None:
+        verify = os.getenv("ONTO_ARTIFACT_VERIFY", "1") != "0"
+    if verify and zlib.crc32(data) != header["crc32"]:
+        raise ValueError(f"{path}: checksum mismatch, the file is corrupt")
+    tensors = {}
+    for name, t in header["tensors"].items():
+        dtype = np.dtype(t["dtype"])
+        count = int(np.prod(t["shape"], dtype=np.int64))
+        tensors[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                      offset=t["offset"]).reshape(t["shape"])
+    return header, tensors
+
+
+def split(tensors, prefix):
+    """The tensors under prefix + '.', with the prefix stripped."""
+    p = prefix + "."
+    return {k[len(p):]: v for k, v in tensors.items() if k.startswith(p)}
+
+
+def side_models(header, tensors):
+    """(reward pipeline, Surrogate or None, KNNMemory or None) of a loaded artifact."""
+    import knn_memory
+    import surrogate
+    s = None
+    if header.get("surrogate") is not None:
+        cfg = header["surrogate"]
+        s = surrogate.Surrogate(cfg["num_arms"], cfg["feature_mode"], cfg["alpha"])
+        arrays = split(tensors, "surrogate")
+        s.mean, s.scale, s.weights = arrays["mean"], arrays["scale"], arrays["weights"]
+        s.report = cfg["report"]
+    knn = knn_memory.KNNMemory.from_arrays(split(tensors, "knn")) if header.get("knn") else None
+    return reward_pipeline(header["reward_scaler"]), s, knn
+
+
+if __name__ == "__main__":
+    import sys
+    for d in sys.argv[1:]:
+        h, _ = read_header(artifact_path(d))
+        h.pop("tensors")
+        print(d, json.dumps(h, indent=2))
@@ -1,12 +1,46 @@
 
+import math
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+
+class EnsembleDeltaHead(nn.Module):
+    """
+    `members` delta heads (Linear -> LeakyReLU -> Linear) with their weights
+    stacked, so all of them run as one batched matmul per layer. forward is
+    the members' mean, so the head drops in for the single one.
+    """
+
+    def __init__(self, feat_dim, num_arms, members, hidden=256):
+        super().__init__()
+        bound = 1.0 / math.sqrt(feat_dim)
+        self.w1 = nn.Parameter(torch.empty(members, feat_dim, hidden).uniform_(-bound, bound))
+        self.b1 = nn.Parameter(torch.empty(members, hidden).uniform_(-bound, bound))
+        # zero last layer, as in the single head
+        self.w2 = nn.Parameter(torch.zeros(members, hidden, num_arms))
+        self.b2 = nn.Parameter(torch.zeros(members, num_arms))
+
+    def members_out(self, g):
+        """(batch, feat_dim) -> (members, batch, num_arms)"""
+        h = F.leaky_relu(torch.einsum("bf,mfh->mbh", g, self.w1) + self.b1[:, None, :])
+        return torch.einsum("mbh,mha->mba", h, self.w2) + self.b2[:, None, :]
+
+    def forward(self, g):
+        return self.members_out(g).mean(dim=0)
+
 
 class CNNMatrixDelta(nn.Module):
-    def __init__(self, in_channels, num_arms, hidden_channels=(64,128,128,64), kernel_size=5, dilations=(1,2,4,8), dropout=0.1):
+    def __init__(self, in_channels, num_arms, hidden_channels=(64,128,128,64), kernel_size=5, dilations=(1,2,4,8), dropout=0.1,
+                 global_dim=0, ensemble=1):
         super().__init__()
         self.in_channels = in_channels
         self.num_arms = num_arms
+        # global_dim > 0: the input is a featurize.pack_global matrix; the global
+        # vector in its header rows skips the convolutions and joins after pooling
+        self.global_dim = global_dim
+        self.header_rows = -(-global_dim // in_channels)
         layers = []
         ch = in_channels
         dil = list(dilations) + [1]*max(0, (len(hidden_channels)-len(dilations)))
@@ -17,7 +51,7 @@ class CNNMatrixDelta(nn.Module):
                        nn.Dropout(dropout)]
             ch = h
         self.backbone = nn.Sequential(*layers)
-        feat_dim = ch*2
+        feat_dim = ch*2 + global_dim
         self.base_head = nn.Sequential(
             nn.Linear(feat_dim, 256),
             nn.LeakyReLU(),
@@ -25,6 +59,12 @@ class CNNMatrixDelta(nn.Module):
             nn.LeakyReLU(),
             nn.Linear(64, 1),
         )
+        # ensemble > 1: that many delta heads on the shared backbone; their
+        # spread is the model's uncertainty (see OntoRegression.predict)
+        self.ensemble = ensemble
+        if ensemble > 1:
+            self.delta_head = EnsembleDeltaHead(feat_dim, self.num_arms, ensemble)
+            return
         self.delta_head = nn.Sequential(
             nn.Linear(feat_dim, 256),
             nn.LeakyReLU(),
@@ -41,15 +81,25 @@ class CNNMatrixDelta(nn.Module):
         elif x.dim() == 3:
             x = x.transpose(1,2)
         else:
-            raise ValueError(f"Unexpected input shape: {tuple(x.shape)}")
+            raise ValueError(f"Unexpected input shape: {list(x.shape)}")
         z = self.backbone(x)
         z_max = torch.amax(z, dim=2)
         z_avg = torch.mean(z, dim=2)
         g = torch.cat([z_max, z_avg], dim=1)
         return g
 
+    def embed(self, x):
+        """What the heads take: the pooled conv features, plus the global vector in global mode."""
+        if self.global_dim > 0:
+            if x.dim() == 2:
+                x = x.unsqueeze(0)
+            h = self.header_rows
+            extra = x[:, :h, :].flatten(1)[:, :self.global_dim]
+            return torch.cat([self.encode(x[:, h:, :]), extra], dim=1)
+        return self.encode(x)
+
     def forward(self, x):
-        g = self.encode(x)
+        g = self.embed(x)
         base = self.base_head(g).squeeze(-1)
         delta = self.delta_head(g)
         return base, delta
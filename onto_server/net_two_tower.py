@@ -0,0 +1,77 @@
+
+import torch
+import torch.nn as nn
+
+
+class TwoTowerDelta(nn.Module):
+    """
+    CNNMatrixDelta split in two. Takes featurize.pack_global matrices
+    (ONTO_FEATURE_MODE=global) and returns (base, delta) like CNNMatrixDelta.
+
+    The SQL tower runs the dilated conv backbone over the schema/SQL rows of
+    each column (the first sql_channels) and the plan-independent globals; its
+    output is the same for every arm and every run of a template, so serving
+    caches it. The plan tower is a pointwise layer over the per-column plan
+    cost rows, pooled, plus the plan-level cost shares: the only per-arm work.
+    """
+
+    def __init__(self, in_channels, num_arms, global_dim, sql_channels, sql_global_dim,
+                 hidden_channels=(64,128,128,64), kernel_size=5, dilations=(1,2,4,8), dropout=0.1,
+                 embed_dim=128, plan_channels=32):
+        super().__init__()
+        self.in_channels = in_channels
+        self.num_arms = num_arms
+        self.global_dim = global_dim
+        self.header_rows = -(-global_dim // in_channels)
+        self.sql_channels = sql_channels
+        self.sql_global_dim = sql_global_dim
+
+        layers = []
+        ch = sql_channels
+        dil = list(dilations) + [1]*max(0, (len(hidden_channels)-len(dilations)))
+        for h, d in zip(hidden_channels, dil):
+            pad = (kernel_size - 1) // 2 * d
+            layers += [nn.Conv1d(ch, h, kernel_size=kernel_size, dilation=d, padding=pad),
+                       nn.LeakyReLU(),
+                       nn.Dropout(dropout)]
+            ch = h
+        self.sql_backbone = nn.Sequential(*layers)
+        self.sql_proj = nn.Sequential(nn.Linear(ch*2 + sql_global_dim, embed_dim), nn.LeakyReLU())
+
+        self.plan_point = nn.Sequential(nn.Linear(in_channels - sql_channels, plan_channels), nn.LeakyReLU())
+        feat_dim = embed_dim + plan_channels*2 + (global_dim - sql_global_dim)
+        self.base_head = nn.Sequential(
+            nn.Linear(feat_dim, 128),
+            nn.LeakyReLU(),
+            nn.Linear(128, 1),
+        )
+        self.delta_head = nn.Sequential(
+            nn.Linear(feat_dim, 128),
+            nn.LeakyReLU(),
+            nn.Linear(128, self.num_arms),
+        )
+        for m in self.delta_head[-1:].modules():
+            if isinstance(m, nn.Linear):
+                nn.init.zeros_(m.weight)
+                nn.init.zeros_(m.bias)
+
+    def split(self, x):
+        """(columns, globals) of a batch of packed matrices."""
+        h = self.header_rows
+        return x[:, h:, :], x[:, :h, :].flatten(1)[:, :self.global_dim]
+
+    def sql_embed(self, cols, glob):
+        z = self.sql_backbone(cols[:, :, :self.sql_channels].transpose(1, 2))
+        g = torch.cat([torch.amax(z, dim=2), torch.mean(z, dim=2), glob[:, :self.sql_global_dim]], dim=1)
+        return self.sql_proj(g)
+
+    def heads(self, emb, cols, glob):
+        p = self.plan_point(cols[:, :, self.sql_channels:])
+        g = torch.cat([emb, torch.amax(p, dim=1), torch.mean(p, dim=1), glob[:, self.sql_global_dim:]], dim=1)
+        return self.base_head(g).squeeze(-1), self.delta_head(g)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            x = x.unsqueeze(0)
+        cols, glob = self.split(x)
+        return self.heads(self.sql_embed(cols, glob), cols, glob)
@@ -0,0 +1,611 @@
+# numpy_infer.py
+# Torch-free inference for CNNMatrixDelta. The trained weights are exported to a
+# flat .npz (onto_cnn_delta.npz, written next to onto_cnn_delta.pt by
+# OntoRegression.save) and the forward pass runs as im2col + matmul in NumPy,
+# so a serving process never has to import torch.
+#
+# Export an existing model directory with
+#   python3 numpy_infer.py onto_default_model
+import collections
+import hashlib
+import math
+import os
+import threading
+
+import numpy as np
+
+import knn_memory
+import model_artifact
+import reward_scale
+
+NPZ_NAME = "onto_cnn_delta.npz"
+TREE_NAME = "onto_hgb"
+
+# must match CNNMatrixDelta's defaults
+KERNEL_SIZE = 5
+DILATIONS = (1, 2, 4, 8)
+LEAKY_SLOPE = 0.01
+
+# OntoRegression.predict's score -> scaled reward mapping
+TAU = 0.5
+K = 6.0
+
+
+def npz_path(model_dir):
+    return os.path.join(model_dir, NPZ_NAME)
+
+
+def export_npz(state_dict, path, num_arms, kernel_size=KERNEL_SIZE, dilations=DILATIONS, global_dim=0,
+               arch="cnn", sql_dims=(0, 0), attr_prune=None):
+    """Write a CNNMatrixDelta / TwoTowerDelta state_dict (tensors or arrays) and its shape to path."""
+    arrays = {}
+    for name, v in state_dict.items():
+        if hasattr(v, "detach"):
+            v = v.detach().cpu().numpy()
+        arrays[name] = np.asarray(v, dtype=np.float32)
+    arrays["__num_arms__"] = np.array(num_arms, dtype=np.int64)
+    arrays["__kernel_size__"] = np.array(kernel_size, dtype=np.int64)
+    arrays["__dilations__"] = np.array(dilations, dtype=np.int64)
+    arrays["__global_dim__"] = np.array(global_dim, dtype=np.int64)
+    arrays["__arch__"] = np.array(arch)
+    arrays["__sql_dims__"] = np.array(sql_dims, dtype=np.int64)
+    # featurize.attr_prune(): -1 for None (every attribute)
+    arrays["__attr_prune__"] = np.array(-1 if attr_prune is None else attr_prune, dtype=np.int64)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def export_model_dir(model_dir, num_arms=6):
+    """Convert model_dir/onto_cnn_delta.pt to model_dir/onto_cnn_delta.npz (needs torch)."""
+    import joblib
+    import torch
+    import featurize
+    state = torch.load(os.path.join(model_dir, "onto_cnn_delta.pt"), map_location="cpu")
+    global_dim, arch = 0, "cnn"
+    if os.path.exists(os.path.join(model_dir, "onto_feature_mode")):
+        if joblib.load(os.path.join(model_dir, "onto_feature_mode")) == "global":
+            global_dim = featurize.NUM_GLOBAL
+    if os.path.exists(os.path.join(model_dir, "onto_arch")):
+        arch = joblib.load(os.path.join(model_dir, "onto_arch"))
+    attr_prune = None
+    if os.path.exists(os.path.join(model_dir, "onto_attr_prune")):
+        attr_prune = joblib.load(os.path.join(model_dir, "onto_attr_prune"))
+    # the delta head's last layer has num_arms outputs
+    heads = [int(k.split(".")[1]) for k in state if k.startswith("delta_head.") and k.endswith(".weight")]
+    if heads:
+        num_arms = int(state[f"delta_head.{max(heads)}.weight"].shape[0])
+    elif "delta_head.b2" in state:
+        num_arms = int(state["delta_head.b2"].shape[1])
+    export_npz(state, npz_path(model_dir), num_arms, global_dim=global_dim, arch=arch,
+               sql_dims=(len(featurize.ATTRIBUTE_ROWS), featurize.NUM_STATIC_GLOBAL),
+               attr_prune=attr_prune)
+    return npz_path(model_dir)
+
+
+def _leaky_relu(x):
+    return np.where(x > 0, x, x * np.float32(LEAKY_SLOPE))
+
+
+def _layers(arrays, prefix):
+    # Sequential children with parameters, in index order
+    idx = sorted({int(k.split(".")[1]) for k in arrays if k.startswith(prefix + ".")})
+    return [(arrays[f"{prefix}.{i}.weight"], arrays[f"{prefix}.{i}.bias"]) for i in idx]
+
+
+def _conv_stack(arrays, prefix):
+    # [(im2col weight (in*k, out), bias, dilation, padding, k)] of a conv backbone
+    k = int(arrays["__kernel_size__"])
+    convs = _layers(arrays, prefix)
+    dilations = [int(d) for d in arrays["__dilations__"]]
+    dilations += [1] * max(0, len(convs) - len(dilations))
+    # (out, in, k) -> (in*k, out), matching the im2col column order
+    return [(w.reshape(w.shape[0], -1).T.copy(), b, d, (k - 1) // 2 * d, k)
+            for (w, b), d in zip(convs, dilations)]
+
+
+def _conv_encode(convs, X, lengths=None):
+    """
+    X: (batch, columns, channels) -> max/mean pooled conv features.
+    lengths gives each matrix's real column count when X is zero-padded on
+    the right; padded positions are masked after every layer and out of the
+    pooling, so the result equals encoding each matrix on its own.
+    """
+    x = np.ascontiguousarray(X, dtype=np.float32)
+    n, length, _ = x.shape
+    mask = None
+    if lengths is not None and int(np.min(lengths)) < length:
+        mask = (np.arange(length)[None, :] < np.asarray(lengths)[:, None])[:, :, None]
+    for w, b, d, pad, k in convs:
+        xp = np.pad(x, ((0, 0), (pad, pad), (0, 0)))
+        taps = np.arange(length)[:, None] + d * np.arange(k)[None, :]
+        # (batch, length, k, in) -> (batch, length, in, k) to match the weight layout
+        cols = xp[:, taps, :].transpose(0, 1, 3, 2).reshape(n, length, -1)
+        x = _leaky_relu(cols @ w + b)
+        if mask is not None:
+            x *= mask
+    if mask is None:
+        return np.concatenate([x.max(axis=1), x.mean(axis=1)], axis=1)
+    z_max = np.where(mask, x, -np.inf).max(axis=1)
+    z_avg = x.sum(axis=1) / np.asarray(lengths, dtype=np.float32)[:, None]
+    return np.concatenate([z_max, z_avg], axis=1).astype(np.float32)
+
+
+def _length_batches(lengths, slack=1.25, max_rows=2048):
+    """
+    Index arrays grouping matrices of similar column counts: sorted by length,
+    the longest member of a group is at most slack x the shortest one and a
+    group stays under max_rows padded columns, so the padding and the im2col
+    buffer stay small.
+    """
+    order = np.argsort(lengths, kind="stable")
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while (end < len(order) and lengths[order[end]] <= slack * lengths[order[start]]
+               and (end - start + 1) * lengths[order[end]] <= max_rows):
+            end += 1
+        yield order[start:end]
+        start = end
+
+
+def _pad(mats, idx, lengths, channels):
+    X = np.zeros((len(idx), int(lengths[idx].max()), channels), dtype=np.float32)
+    for j, i in enumerate(idx):
+        X[j, :lengths[i]] = mats[i]
+    return X
+
+
+class NumpyCNNDelta:
+    """Eval-mode CNNMatrixDelta.forward over float32 arrays."""
+
+    def __init__(self, arrays):
+        self.num_arms = int(arrays["__num_arms__"])
+        self.in_channels = int(arrays["backbone.0.weight"].shape[1])
+        # > 0: inputs are featurize.pack_global matrices (ONTO_FEATURE_MODE=global)
+        self.global_dim = int(arrays.get("__global_dim__", 0))
+        self.header_rows = -(-self.global_dim // self.in_channels)
+        self.convs = _conv_stack(arrays, "backbone")
+        self.base_head = [(w.T.copy(), b) for w, b in _layers(arrays, "base_head")]
+        # an EnsembleDeltaHead (ONTO_ENSEMBLE > 1) stacks its members' weights
+        self.members = 1
+        if "delta_head.w1" in arrays:
+            self.ensemble_head = tuple(arrays[f"delta_head.{n}"] for n in ("w1", "b1", "w2", "b2"))
+            self.members = int(self.ensemble_head[0].shape[0])
+        else:
+            self.delta_head = [(w.T.copy(), b) for w, b in _layers(arrays, "delta_head")]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls({k: z[k] for k in z.files})
+
+    def encode(self, X, lengths=None):
+        """X: (batch, columns, channels) -> pooled features (batch, 2 * last_channels); see _conv_encode."""
+        return _conv_encode(self.convs, X, lengths)
+
+    @staticmethod
+    def _mlp(layers, g):
+        for i, (w, b) in enumerate(layers):
+            g = g @ w + b
+            if i < len(layers) - 1:
+                g = _leaky_relu(g)
+        return g
+
+    def _delta_members(self, g):
+        # (batch, features) -> (members, batch, num_arms), every member in one batched matmul
+        w1, b1, w2, b2 = self.ensemble_head
+        h = _leaky_relu(np.matmul(g, w1) + b1[:, None, :])
+        return np.matmul(h, w2) + b2[:, None, :]
+
+    def _delta(self, g):
+        if self.members > 1:
+            return self._delta_members(g).mean(axis=0)
+        return self._mlp(self.delta_head, g)
+
+    def _split(self, X):
+        # the global vector lives in the header rows of a packed matrix
+        h = self.header_rows
+        return X[..., h:, :], X[..., :h, :].reshape(*X.shape[:-2], -1)[..., :self.global_dim]
+
+    def forward(self, X):
+        """(base, delta) for a (columns, channels) matrix or a batch of same-size ones."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 2:
+            X = X[None]
+        if self.global_dim:
+            X, extra = self._split(X)
+            g = np.concatenate([self.encode(X), extra], axis=1)
+        else:
+            g = self.encode(X)
+        return self._mlp(self.base_head, g)[:, 0], self._delta(g)
+
+    __call__ = forward
+
+    def embed_many(self, mats):
+        """
+        CNNMatrixDelta.embed (len(mats), features) for (columns, channels)
+        matrices of any sizes, run as zero-padded, masked batches of similar lengths.
+        """
+        extra = None
+        if self.global_dim:
+            parts = [self._split(np.asarray(m, dtype=np.float32)) for m in mats]
+            mats = [c for c, _ in parts]
+            extra = np.stack([e for _, e in parts])
+        lengths = np.array([m.shape[0] for m in mats])
+        out = np.empty((len(mats), 2 * self.convs[-1][0].shape[1] + self.global_dim), dtype=np.float32)
+        for idx in _length_batches(lengths):
+            g = self.encode(_pad(mats, idx, lengths, self.in_channels), lengths[idx])
+            if extra is not None:
+                g = np.concatenate([g, extra[idx]], axis=1)
+            out[idx] = g
+        return out
+
+    def forward_many(self, mats, with_embedding=False):
+        """delta (len(mats), num_arms), and the embed_many features with_embedding."""
+        g = self.embed_many(mats)
+        delta = self._delta(g).astype(np.float32)
+        return (delta, g) if with_embedding else delta
+
+    def forward_members(self, mats):
+        """Every ensemble member's delta: (len(mats), members, num_arms)."""
+        return self._delta_members(self.embed_many(mats)).transpose(1, 0, 2).astype(np.float32)
+
+
+# SQL tower embeddings of NumpyTwoTower, shared by every loaded model:
+# (model version, fingerprint of the SQL tower's input) -> embedding
+_embed_cache = collections.OrderedDict()
+_embed_lock = threading.Lock()
+
+
+def _embed_capacity():
+    return int(os.getenv("ONTO_TOWER_CACHE_SIZE", "4096"))
+
+
+class NumpyTwoTower:
+    """
+    Eval-mode TwoTowerDelta over float32 arrays. forward_many computes each
+    distinct SQL tower input once and caches its embedding by fingerprint and
+    model version, so the arms of a query, and later runs of its template, only
+    pay for the pointwise plan tower and the heads.
+    """
+
+    def __init__(self, arrays):
+        self.num_arms = int(arrays["__num_arms__"])
+        self.global_dim = int(arrays["__global_dim__"])
+        self.sql_channels, self.sql_global_dim = (int(v) for v in arrays["__sql_dims__"])
+        self.convs = _conv_stack(arrays, "sql_backbone")
+        (self.proj_w, self.proj_b), = [(w.T.copy(), b) for w, b in _layers(arrays, "sql_proj")]
+        (self.point_w, self.point_b), = [(w.T.copy(), b) for w, b in _layers(arrays, "plan_point")]
+        self.in_channels = self.sql_channels + self.point_w.shape[0]
+        self.header_rows = -(-self.global_dim // self.in_channels)
+        self.base_head = [(w.T.copy(), b) for w, b in _layers(arrays, "base_head")]
+        self.delta_head = [(w.T.copy(), b) for w, b in _layers(arrays, "delta_head")]
+
+        digest = hashlib.sha1()
+        for name in sorted(arrays):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        self.version = digest.hexdigest()[:16]
+
+        self.lookups = self.hits = 0
+        self.flops = 0
+        self.arms = 0
+        self.uncached_flops = 0
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls({k: z[k] for k in z.files})
+
+    def _split(self, X):
+        h = self.header_rows
+        return X[h:], X[:h].reshape(-1)[:self.global_dim]
+
+    def _sql_flops(self, length):
+        conv = sum(2 * length * w.shape[0] * w.shape[1] for w, *_ in self.convs)
+        return conv + 2 * self.proj_w.size
+
+    def _arm_flops(self, length):
+        heads = sum(2 * w.size for w, _ in self.base_head + self.delta_head)
+        return 2 * length * self.point_w.size + heads
+
+    def _embed(self, cols, glob):
+        """SQL tower embeddings for lists of column blocks and globals (no cache)."""
+        lengths = np.array([c.shape[0] for c in cols])
+        out = np.empty((len(cols), self.proj_w.shape[1]), dtype=np.float32)
+        sc, sg = self.sql_channels, self.sql_global_dim
+        for idx in _length_batches(lengths):
+            z = _conv_encode(self.convs, _pad([c[:, :sc] for c in cols], idx, lengths, sc), lengths[idx])
+            g = np.concatenate([z, np.stack([glob[i][:sg] for i in idx])], axis=1)
+            out[idx] = _leaky_relu(g @ self.proj_w + self.proj_b)
+        return out
+
+    def _heads(self, emb, cols, glob):
+        # plan tower over all arms' columns at once, pooled per matrix
+        lengths = np.array([c.shape[0] for c in cols])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        p = _leaky_relu(np.concatenate([c[:, self.sql_channels:] for c in cols]) @ self.point_w
+                        + self.point_b)
+        g = np.concatenate([emb, np.maximum.reduceat(p, starts, axis=0),
+                            np.add.reduceat(p, starts, axis=0) / lengths[:, None].astype(np.float32),
+                            np.stack([x[self.sql_global_dim:] for x in glob])], axis=1)
+        return NumpyCNNDelta._mlp(self.base_head, g)[:, 0], NumpyCNNDelta._mlp(self.delta_head, g)
+
+    def forward(self, X):
+        """(base, delta) for a packed matrix or a batch of same-size ones, without the cache."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 2:
+            X = X[None]
+        parts = [self._split(x) for x in X]
+        cols, glob = [c for c, _ in parts], [g for _, g in parts]
+        return self._heads(self._embed(cols, glob), cols, glob)
+
+    __call__ = forward
+
+    def forward_many(self, mats):
+        parts = [self._split(np.asarray(m, dtype=np.float32)) for m in mats]
+        cols, glob = [c for c, _ in parts], [g for _, g in parts]
+        sc, sg = self.sql_channels, self.sql_global_dim
+        keys = [hashlib.blake2b(np.ascontiguousarray(c[:, :sc]).tobytes() + g[:sg].tobytes()
+                                + bytes(str(c.shape[0]), "ascii"), digest_size=16).digest()
+                for c, g in parts]
+
+        first = {}
+        for i, k in enumerate(keys):
+            first.setdefault(k, i)
+        emb = {}
+        with _embed_lock:
+            for k in first:
+                hit = _embed_cache.get((self.version, k))
+                if hit is not None:
+                    _embed_cache.move_to_end((self.version, k))
+                    emb[k] = hit
+        todo = [k for k in first if k not in emb]
+        if todo:
+            fresh = self._embed([cols[first[k]] for k in todo], [glob[first[k]] for k in todo])
+            with _embed_lock:
+                for k, e in zip(todo, fresh):
+                    emb[k] = e
+                    _embed_cache[(self.version, k)] = e
+                while len(_embed_cache) > _embed_capacity():
+                    _embed_cache.popitem(last=False)
+
+        _, delta = self._heads(np.stack([emb[k] for k in keys]), cols, glob)
+        with _embed_lock:
+            self.lookups += len(first)
+            self.hits += len(first) - len(todo)
+            self.arms += len(mats)
+            self.flops += (sum(self._sql_flops(cols[first[k]].shape[0]) for k in todo)
+                           + sum(self._arm_flops(c.shape[0]) for c in cols))
+            self.uncached_flops += sum(self._sql_flops(c.shape[0]) + self._arm_flops(c.shape[0])
+                                       for c in cols)
+        return delta
+
+    def stats(self):
+        """SQL embedding cache hit rate and FLOPs per arm scored, against running both towers per arm."""
+        with _embed_lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "cache_size": len(_embed_cache),
+                "flops_per_arm": self.flops / self.arms if self.arms else None,
+                "uncached_flops_per_arm": self.uncached_flops / self.arms if self.arms else None,
+            }
+
+
+def load_network(path):
+    """NumpyCNNDelta or NumpyTwoTower for an exported .npz."""
+    with np.load(path) as z:
+        return network_from_arrays({k: z[k] for k in z.files})
+
+
+def artifact_network(header, tensors):
+    """The network of a loaded model_artifact, as load_network builds it from an .npz."""
+    arrays = model_artifact.split(tensors, "net")
+    arrays["__num_arms__"] = np.array(header["num_arms"])
+    arrays["__kernel_size__"] = np.array(header["kernel_size"])
+    arrays["__dilations__"] = np.array(header["dilations"])
+    arrays["__global_dim__"] = np.array(header["global_dim"])
+    arrays["__arch__"] = np.array(header["arch"])
+    arrays["__sql_dims__"] = np.array(header["sql_dims"])
+    arrays["__attr_prune__"] = np.array(-1 if header["attr_prune"] is None else header["attr_prune"])
+    return network_from_arrays(arrays)
+
+
+def network_from_arrays(arrays):
+    net = NumpyTwoTower(arrays) if str(arrays.get("__arch__", "cnn")) == "two_tower" else NumpyCNNDelta(arrays)
+    prune = int(arrays.get("__attr_prune__", -1))
+    net.attr_prune = None if prune < 0 else prune
+    return net
+
+
+def _scaled_from_delta(raw):
+    # softplus(raw / tau) - log 2, squashed as in OntoRegression.predict
+    score = np.logaddexp(0.0, raw / TAU) - math.log(2.0)
+    y = 1.0 / (1.0 + np.exp(-K * score))
+    return np.clip(y - 0.5, 0.0, 1.0)
+
+
+class NumpyOntoRegression:
+    """
+    Drop-in for OntoRegression at serving time: load(path) and predict(plans),
+    with the same featurization and output mapping, without torch.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, have_cache_data=False, verbose=False):
+        self.have_cache_data = have_cache_data
+        self.verbose = verbose
+        self.num_arms = 6
+        self.in_channels = None
+        self.feature_mode = "broadcast"
+        self.attr_prune = None
+        self.surrogate = None
+        self.knn = None
+        self.model = None
+        self.reward_pipeline = None
+        self.reward_scale = None
+
+    def load(self, path):
+        if model_artifact.has_artifact(path):
+            return self._load_artifact(model_artifact.artifact_path(path))
+        import joblib
+        with open(os.path.join(path, "onto_y_transform"), "rb") as f:
+            self.reward_pipeline = joblib.load(f)
+        with open(os.path.join(path, "onto_channels"), "rb") as f:
+            self.in_channels = joblib.load(f)
+        if os.path.exists(os.path.join(path, "onto_surrogate")):
+            with open(os.path.join(path, "onto_surrogate"), "rb") as f:
+                self.surrogate = joblib.load(f)
+        self.knn = knn_memory.load_if_present(path)
+        if has_tree(path):
+            # Backend = hgb: a tree_backend.TreeRegressor, no network
+            with open(os.path.join(path, TREE_NAME), "rb") as f:
+                self.model = joblib.load(f)
+            self.num_arms = self.model.num_arms
+            self.feature_mode = self.model.feature_mode
+            if os.path.exists(os.path.join(path, "onto_attr_prune")):
+                self.attr_prune = joblib.load(os.path.join(path, "onto_attr_prune"))
+            return self
+        self.model = load_network(npz_path(path))
+        if self.model.in_channels != self.in_channels:
+            raise ValueError(f"{NPZ_NAME} has {self.model.in_channels} input channels, "
+                             f"onto_channels says {self.in_channels}")
+        self.num_arms = self.model.num_arms
+        self.feature_mode = "global" if self.model.global_dim else "broadcast"
+        self.attr_prune = self.model.attr_prune
+        return self
+
+    def _load_artifact(self, path):
+        # onto_model.bin: the weights stay memory-mapped, nothing is unpickled
+        header, tensors = model_artifact.load(path)
+        self.reward_pipeline, self.surrogate, self.knn = model_artifact.side_models(header, tensors)
+        self.model = artifact_network(header, tensors)
+        self.in_channels = header["in_channels"]
+        if self.model.in_channels != self.in_channels:
+            raise ValueError(f"{path} has {self.model.in_channels} input channels, "
+                             f"its header says {self.in_channels}")
+        self.num_arms = self.model.num_arms
+        self.feature_mode = header["feature_mode"]
+        self.attr_prune = header["attr_prune"]
+        return self
+
+    def featurize(self, plans):
+        """(matrices, arm indices) for plans, as OntoRegression.predict builds them."""
+        import featurize
+
+        num_of_arms = self.num_arms or 7
+        mats, arm_ids = [], []
+        # plans sharing their Plan and metadata objects (prediction_cache) differ
+        # only in the arm, which the matrix does not depend on: build it once
+        built = {}
+        for plan in plans:
+            meta = plan["metadata"]
+            arm_cfg = plan.get("arm_config") or plan.get("arm_config_json", {})
+            meta["arm_config_json"] = arm_cfg
+
+            arm_idx = int(arm_cfg.get("index", 0))
+            if arm_idx < 0 or arm_idx >= num_of_arms:
+                arm_idx = 0
+            key = (id(plan["Plan"]), id(meta)) if "Plan" in plan else id(plan)
+            if key not in built:
+                built[key] = featurize.build_model_input(meta, num_of_arms, plan, self.feature_mode,
+                                                         self.attr_prune)
+            mats.append(built[key])
+            arm_ids.append(arm_idx)
+        return mats, arm_ids
+
+    def rewards(self, raw, emb=None, arm_ids=None):
+        """
+        Predicted rewards for each plan's raw delta, blended with the kNN
+        memory's neighbours of its embedding when both are given.
+        """
+        pred_scaled = _scaled_from_delta(np.asarray(raw, dtype=np.float32).astype(np.float64))
+        if emb is not None and self.knn is not None:
+            pred_scaled = self.knn.blend(emb, arm_ids, pred_scaled)
+        return self.real_rewards(pred_scaled)
+
+    def real_rewards(self, pred_scaled):
+        """Real rewards for scaled predictions: the reward pipeline's inverse, as one array."""
+        if self.reward_scale is None or self.reward_scale.pipeline is not self.reward_pipeline:
+            self.reward_scale = reward_scale.RewardScale(self.reward_pipeline)
+        return self.reward_scale.real(pred_scaled)
+
+    def predict(self, plans, forward=None, with_std=False):
+        """
+        Predicted rewards for plans. forward(mats) -> deltas defaults to this
+        model's forward_many (forward_members for an ensemble); the server's
+        micro-batcher passes its own. with_std also returns the spread of the
+        ensemble members' predictions (None for a single-head model).
+        """
+        mats, arm_ids = self.featurize(plans)
+        if not mats:
+            empty = np.array([], dtype=float)
+            return (empty, None) if with_std else empty
+        return self.predict_featurized(mats, arm_ids, forward, with_std)
+
+    def predict_featurized(self, mats, arm_ids, forward=None, with_std=False):
+        """predict() on the output of featurize()."""
+        pred, std = self._predict_featurized(mats, arm_ids, forward)
+        return (pred, std) if with_std else pred
+
+    def _predict_featurized(self, mats, arm_ids, forward):
+        if hasattr(self.model, "predict_scaled"):
+            return self.real_rewards(self.model.predict_scaled(mats, arm_ids)), None
+        # a matrix shared by several arms (see featurize) goes through the network once
+        uniq, rows = _distinct(mats)
+        if getattr(self.model, "members", 1) > 1:
+            raw = (forward or self.model.forward_members)(uniq)[rows, :, arm_ids]
+            emb = self.model.embed_many(uniq)[rows] if self.knn is not None else None
+            members = self.rewards(raw.reshape(-1)).reshape(raw.shape)
+            return self.rewards(raw.mean(axis=1), emb, arm_ids), members.std(axis=1)
+        emb = None
+        if self.knn is None:
+            delta = (forward or self.model.forward_many)(uniq)
+        elif forward is None:
+            delta, emb = self.model.forward_many(uniq, with_embedding=True)
+        else:
+            # the batcher only hands back deltas: embed separately
+            delta, emb = forward(uniq), self.model.embed_many(uniq)
+        if emb is not None:
+            emb = emb[rows]
+        return self.rewards(delta[rows, arm_ids], emb, arm_ids), None
+
+
+def _distinct(mats):
+    """(the distinct matrices of mats, by identity; index of each input among them)."""
+    first, uniq = {}, []
+    for m in mats:
+        if first.setdefault(id(m), len(uniq)) == len(uniq):
+            uniq.append(m)
+    return uniq, np.array([first[id(m)] for m in mats], dtype=np.int64)
+
+
+def has_npz(model_dir):
+    return os.path.exists(npz_path(model_dir))
+
+
+def has_tree(model_dir):
+    return os.path.exists(os.path.join(model_dir, TREE_NAME))
+
+
+def inference_backend(model_dir):
+    """
+    "numpy" or "torch" for model_dir. ONTO_INFERENCE=numpy|torch forces one;
+    the default (auto) uses NumPy whenever the model has an onto_model.bin
+    or exported .npz, or is a tree backend (which never needs torch).
+    """
+    mode = os.getenv("ONTO_INFERENCE", "auto").lower()
+    if mode in ("numpy", "torch"):
+        return mode
+    if model_artifact.has_artifact(model_dir) or has_npz(model_dir) or has_tree(model_dir):
+        return "numpy"
+    return "torch"
+
+
+if __name__ == "__main__":
+    import sys
+    for d in sys.argv[1:]:
+        print("wrote", export_model_dir(d))
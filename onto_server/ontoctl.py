@@ -1,6 +1,12 @@
+# Control client for the Onto server. Only the stdlib is imported at module
+# level: control messages (load/validate model, status) are answered by the
+# server, which already has torch and the databases open. Heavier commands
+# (--train, --retrain, experiments) import what they need when used.
 import argparse
+import os
 import socket
 import json
+import struct
 
 def __json_bytes(obj):
     return (json.dumps(obj) + "\n").encode("UTF-8")
@@ -9,12 +15,32 @@ def __send_json(s, obj):
     b = json.dumps(obj).encode("utf-8")
     s.sendall(len(b).to_bytes(4, byteorder='big'))
     s.sendall(b)
-    
+
+def __recv_json(s):
+    def recv_exact(n):
+        data = b''
+        while len(data) < n:
+            chunk = s.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the Onto server")
+            data += chunk
+        return data
+    n = struct.unpack("!I", recv_exact(4))[0]
+    return json.loads(recv_exact(n).decode("utf-8"))
+
 def __connect():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(("localhost", 9381))
+    s.connect((os.getenv("ONTO_HOST", "localhost"), int(os.getenv("ONTO_PORT", "9381"))))
     return s
 
+def __request(mtype, *payload):
+    with __connect() as s:
+        __send_json(s, {"type": mtype})
+        for p in payload:
+            __send_json(s, p)
+        __send_json(s, {"final": True})
+        return __recv_json(s)
+
 def send_model_load(path):
     with __connect() as s:
         __send_json(s, {"type": "load model"})
@@ -27,6 +53,13 @@ def send_model_load(path):
         except:
             print("[WARN] No ack received.")
 
+def validate_model(path):
+    """Ask the server to load `path` into a scratch model: {"ok": bool, "error": str}."""
+    return __request("validate model", {"path": os.path.abspath(path)})
+
+def server_status():
+    return __request("status")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Onto for PostgreSQL Controller")
     parser.add_argument("--load",
@@ -55,13 +88,18 @@ if __name__ == "__main__":
         exit(0)
 
     if args.load:
-        import model
-        print("Attempting to load the Onto model...")
-        reg = model.OntoRegression(have_cache_data=True)
-        reg.load(args.load)
-        
-        print("Model loaded. Sending message to Onto server...")
-        send_model_load(args.load)
+        print("Asking the Onto server to validate the model...")
+        try:
+            res = validate_model(args.load)
+        except OSError as e:
+            print("Could not reach the Onto server:", e)
+            exit(1)
+        if not res.get("ok"):
+            print("Model failed to load on the server:", res.get("error"))
+            exit(1)
+
+        print("Model validated. Sending message to Onto server...")
+        send_model_load(os.path.abspath(args.load))
         print("Message sent to server.")
         exit(0)
 
@@ -100,9 +138,12 @@ if __name__ == "__main__":
         exit(0)
 
     if args.status:
-        from reg_blocker import ExperimentRunner
-        er = ExperimentRunner()
-        info = er.status()
+        try:
+            info = server_status()
+        except OSError:
+            # server not running: the same COUNT queries, locally
+            import storage
+            info = storage.status_counts()
 
         max_key_length = max(len(x) for x in info.keys())
 
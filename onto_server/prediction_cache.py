@@ -0,0 +1,165 @@
+# prediction_cache.py
+# Memoized predictions for select_plan. Repeated templates often produce the
+# very same plan for an arm, and extension hints often give several arms of
+# one request the same plan; both are scored once and then served from an LRU
+# keyed by (plan hash, metadata fingerprint, arm, model version) and the
+# predictor that produced the value.
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# plan keys that are not part of the plan itself: hashed separately, once per request
+_SIDE_KEYS = ("metadata", "arm_config", "arm_config_json", "Buffers")
+
+
+def _digest(obj):
+    blob = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def plan_keys(plans):
+    """(plan hash, metadata fingerprint, arm) per plan, as the model would featurize it."""
+    shared = {}  # id() -> digest: arms of a request share their metadata and buffers
+
+    def _shared(obj, drop=()):
+        k = id(obj)
+        if k not in shared:
+            shared[k] = _digest({n: v for n, v in obj.items() if n not in drop}
+                                if isinstance(obj, dict) else obj)
+        return shared[k]
+
+    keys = []
+    for p in plans:
+        cfg = p.get("arm_config") or p.get("arm_config_json") or {}
+        # featurize writes arm_config_json into the metadata: not part of the fingerprint
+        meta = _shared(p.get("metadata") or {}, drop=("arm_config_json",))
+        keys.append((_digest({n: v for n, v in p.items() if n not in _SIDE_KEYS}),
+                     meta + _shared(p.get("Buffers")),
+                     int(cfg.get("index", 0))))
+    return keys
+
+
+def share_inputs(plans, keys):
+    """
+    plans, where plans that differ only in their arm share the first one's
+    Plan and metadata objects, so the model featurizes them once
+    (NumpyOntoRegression.featurize) and runs one forward pass for all their arms.
+    """
+    first, out = {}, []
+    for p, key in zip(plans, keys):
+        rep = first.setdefault(key[:2], p)
+        if rep is not p and "Plan" in p and "Plan" in rep:
+            p = dict(p, Plan=rep["Plan"], metadata=rep.get("metadata"))
+        out.append(p)
+    return out
+
+
+class PredictionCache:
+    """
+    keys(model, plans) once per request, then predict(keys, score, ...) per
+    predictor: every plan is looked up under (key, predictor) and only the
+    distinct missing ones go to score, in one call. Predictors never answer
+    for each other, so the cascade's surrogate and CNN outputs are cached
+    side by side. Keys carry the model's version, which moves on whenever a
+    different model object is passed, so a model swap invalidates the cache.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._lru = collections.OrderedDict()  # (key, predictor) -> (reward, std or None)
+        self._lock = threading.Lock()
+        self._model = None
+        self.version = 0
+        self._zero()
+
+    def _zero(self):
+        self.lookups = collections.Counter()  # per predictor
+        self.hits = collections.Counter()
+        self.duplicates = self.evictions = self.invalidations = 0
+
+    def keys(self, model, plans):
+        """(plan hash, metadata fingerprint, arm, model version) per plan."""
+        with self._lock:
+            if model is not self._model:
+                if self._model is not None:
+                    self.invalidations += 1
+                self._model = model
+                self.version += 1
+                self._lru.clear()
+            version = self.version
+        return [k + (version,) for k in plan_keys(plans)]
+
+    def predict(self, keys, score, with_std=False, predictor="model"):
+        """
+        Rewards of the plans behind keys; score(indices) -> rewards (with_std:
+        (rewards, std or None)) of the plans at those indices. The std is None
+        unless every plan has one: a missing spread is never filled in.
+        """
+        lookups = [(key, predictor) for key in keys]
+        found, todo = {}, {}  # todo: lookup -> index of the first plan with it
+        with self._lock:
+            for i, k in enumerate(lookups):
+                self.lookups[predictor] += 1
+                entry = self._lru.get(k)
+                if entry is not None:
+                    self._lru.move_to_end(k)
+                    self.hits[predictor] += 1
+                    found[k] = entry
+                elif k in todo:
+                    self.duplicates += 1
+                else:
+                    todo[k] = i
+
+        if todo:
+            res = score(list(todo.values()))
+            pred, std = res if with_std else (res, None)
+            with self._lock:
+                for j, k in enumerate(todo):
+                    entry = (float(pred[j]), None if std is None else float(std[j]))
+                    found[k] = entry
+                    if k[0][-1] == self.version:
+                        self._lru[k] = entry
+                        self._lru.move_to_end(k)
+                while len(self._lru) > self.capacity:
+                    self._lru.popitem(last=False)
+                    self.evictions += 1
+
+        entries = [found[k] for k in lookups]
+        pred = np.array([e[0] for e in entries], dtype=float)
+        if not with_std:
+            return pred
+        if any(e[1] is None for e in entries):
+            return pred, None
+        return pred, np.array([e[1] for e in entries], dtype=float)
+
+    def clear(self):
+        """Drop every entry and zero the counters."""
+        with self._lock:
+            self._lru.clear()
+            self._zero()
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.lookups.values())
+            return {
+                "size": len(self._lru),
+                "capacity": self.capacity,
+                "model_version": self.version,
+                "lookups": lookups,
+                "hit_rate": sum(self.hits.values()) / lookups if lookups else None,
+                "hit_rate_by_predictor": {p: self.hits[p] / n for p, n in self.lookups.items() if n},
+                # identical plans within one request, scored once
+                "duplicate_rate": self.duplicates / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def from_env():
+    """A PredictionCache of ONTO_PREDICTION_CACHE entries (default 4096), None for 0."""
+    capacity = int(os.getenv("ONTO_PREDICTION_CACHE", "4096"))
+    return PredictionCache(capacity) if capacity > 0 else None
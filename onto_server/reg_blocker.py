@@ -93,13 +93,7 @@ class ExperimentRunner:
         return True
 
     def status(self):
-        to_r = {}
-        
-        to_r["Unexecuted experiments"] = len(storage.unexecuted_experiments())
-        to_r["Completed experiments"] = len(storage.experiment_experience())
-        to_r["Exploration queries"] = storage.num_experimental_queries()
-        
-        return to_r
+        return storage.status_counts()
         
     def explore(self, time_limit):
         start = time.time()
@@ -217,15 +211,11 @@ def compute_regressions(onto_reg):
     return (total_regressed, total_regression)
 
 
-def should_replace_model(old_model, new_model):
-    # Check the trained model for regressions on experimental queries.
-    new_num_reg, new_reg_amnt = compute_regressions(new_model)
-    cur_num_reg, cur_reg_amnt = compute_regressions(old_model)
-
-    print("Old model # regressions:", cur_num_reg,
-          "regression amount:", cur_reg_amnt)
-    print("New model # regressions:", new_num_reg,
-          "regression amount:", new_reg_amnt)
+def is_better_profile(cur_profile, new_profile):
+    # Acceptance rule shared by should_replace_model and candidate training.
+    # Profiles are (# regressed queries, total regression) tuples.
+    cur_num_reg, cur_reg_amnt = cur_profile
+    new_num_reg, new_reg_amnt = new_profile
 
     # If our new model has no regressions, always accept it.
     # Otherwise, see if our regression profile is strictly better than
@@ -242,6 +232,20 @@ def should_replace_model(old_model, new_model):
         return False
 
 
+def should_replace_model(old_model, new_model):
+    # Check the trained model for regressions on experimental queries.
+    new_num_reg, new_reg_amnt = compute_regressions(new_model)
+    cur_num_reg, cur_reg_amnt = compute_regressions(old_model)
+
+    print("Old model # regressions:", cur_num_reg,
+          "regression amount:", cur_reg_amnt)
+    print("New model # regressions:", new_num_reg,
+          "regression amount:", new_reg_amnt)
+
+    return is_better_profile((cur_num_reg, cur_reg_amnt),
+                             (new_num_reg, new_reg_amnt))
+
+
 if __name__ == "__main__":
     import model
     
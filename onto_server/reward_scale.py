@@ -0,0 +1,46 @@
+# reward_scale.py
+# The fitted reward pipeline (log1p, then MinMaxScaler) compiled to its closed
+# form. sklearn's inverse_transform validates and copies its input on every
+# call, which costs more than the model for a handful of arms; undoing the
+# scaling is one affine map and an expm1.
+import numpy as np
+
+
+class RewardScale:
+    """
+    real(pred_scaled) == pipeline.inverse_transform(1 - pred_scaled) as a flat
+    float64 array, for all predictions in one vectorized operation. Pipelines
+    of another shape are kept and called as before.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.min = self.scale = None
+        if _is_log_minmax(pipeline):
+            s = pipeline.named_steps["scale"]
+            # the fitted values as they are: inverse_transform promotes them the same way
+            self.min, self.scale = s.min_[0], s.scale_[0]
+
+    @property
+    def compiled(self):
+        return self.min is not None
+
+    def real(self, pred_scaled):
+        y = 1.0 - np.asarray(pred_scaled, dtype=np.float64).reshape(-1)
+        if not len(y):
+            return np.array([], dtype=float)
+        if self.min is None:
+            return np.asarray(self.pipeline.inverse_transform(y.reshape(-1, 1)), dtype=float).reshape(-1)
+        # MinMaxScaler.inverse_transform: (X - min_) / scale_, then the log step's expm1
+        return np.expm1((y - self.min) / self.scale)
+
+
+def _is_log_minmax(pipeline):
+    from sklearn import preprocessing
+    steps = getattr(pipeline, "named_steps", {})
+    log, scale = steps.get("log"), steps.get("scale")
+    return (list(steps) == ["log", "scale"]
+            and isinstance(log, preprocessing.FunctionTransformer)
+            and log.inverse_func is np.expm1
+            and isinstance(scale, preprocessing.MinMaxScaler)
+            and hasattr(scale, "scale_") and len(scale.scale_) == 1)
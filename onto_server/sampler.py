@@ -1,9 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Dict, Any, Tuple
-import json, hashlib, math, random
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+import json, hashlib, heapq, math, os, random
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 # -------------------------- helpers --------------------------
 
@@ -15,12 +15,6 @@ def _safe_get_arm(meta: Dict[str, Any], num_arms: int) -> int:
         return -1
     return idx if 0 <= idx < num_arms else -1
 
-def _build_feature_matrix(meta: Dict[str, Any], num_arms: int) -> np.ndarray:
-    # lazy import to avoid heavy deps at module import
-    import featurize
-    X = featurize.build_feature_matrix(meta, num_arms).T  # (C, R)
-    return X
-
 def _split_sql_vs_arm(X: np.ndarray, num_arms: int) -> Tuple[np.ndarray, np.ndarray]:
     """Return (sql_only, arm_onehot_rows) flattened."""
     # X shape (C, R). The last num_arms rows in featurize are arm rows by convention.
@@ -49,11 +43,14 @@ class Item:
     v_all: np.ndarray  # flattened whole embedding (with arm)
     template: str      # hashed sql-only template id
     raw: Tuple[str, float]  # (plan_json_str, reward)
+    v_sk: Optional[np.ndarray] = None  # random-projection sketch of v_sql (large pools only)
 
 # -------------------------- main selection --------------------------
 
-def _prep_items(examples: List[Tuple[str, float]], num_arms: int) -> List[Item]:
-    items: List[Item] = []
+def _prep_items(examples: List[Tuple[str, float]], num_arms: int, executor=None) -> List[Item]:
+    # lazy import to avoid heavy deps at module import
+    import featurize_pool
+    parsed = []
     for plan_str, reward in examples:
         try:
             plan = json.loads(plan_str)
@@ -63,9 +60,15 @@ def _prep_items(examples: List[Tuple[str, float]], num_arms: int) -> List[Item]:
         arm = _safe_get_arm(meta, num_arms)
         if arm < 0:
             continue
-        try:
-            X = _build_feature_matrix(meta, num_arms)
-        except Exception:
+        parsed.append((meta, arm, plan_str, reward))
+
+    # ONTO_FEATURIZE_WORKERS > 1 spreads this over a process pool (executor, if given)
+    mats = featurize_pool.build_feature_matrices(
+        [(meta, None) for meta, _, _, _ in parsed], num_arms, on_error="skip", executor=executor)
+
+    items: List[Item] = []
+    for (meta, arm, plan_str, reward), X in zip(parsed, mats):
+        if X is None:
             continue
         v_sql, v_arm = _split_sql_vs_arm(X, num_arms)
         v_all = np.concatenate([v_sql, v_arm], axis=0)
@@ -73,32 +76,135 @@ def _prep_items(examples: List[Tuple[str, float]], num_arms: int) -> List[Item]:
         items.append(Item(meta=meta, reward=float(reward), arm=arm, v_sql=v_sql, v_all=v_all, template=template, raw=(plan_str, float(reward))))
     return items
 
-def _maxmin_diverse(items: List[Item], k: int, dup_cos=0.995) -> List[int]:
-    """k-center greedy on v_sql to maximize diversity; drop near-duplicates by cosine."""
+def _stack(vs: List[np.ndarray]) -> np.ndarray:
+    """Stack flattened vectors; ragged ones (different column counts) are zero-padded."""
+    width = max(v.shape[0] for v in vs)
+    if all(v.shape[0] == width for v in vs):
+        return np.stack(vs, axis=0)
+    out = np.zeros((len(vs), width), dtype=np.float32)
+    for i, v in enumerate(vs):
+        out[i, :v.shape[0]] = v
+    return out
+
+def _sketch_items(items: List[Item], dim: int, seed: int = 0) -> None:
+    """Fill it.v_sk with a Gaussian random projection of v_sql (shared matrix, truncated per width)."""
+    todo = [it for it in items if it.v_sk is None or it.v_sk.shape[0] != dim]
+    if not todo:
+        return
+    width = max(it.v_sql.shape[0] for it in todo)
+    rng = np.random.default_rng(seed)
+    R = (rng.standard_normal((width, dim)) / math.sqrt(dim)).astype(np.float32)
+    by_width: Dict[int, List[Item]] = defaultdict(list)
+    for it in todo:
+        by_width[it.v_sql.shape[0]].append(it)
+    for w, group in by_width.items():
+        for s in range(0, len(group), 4096):
+            chunk = group[s:s + 4096]
+            proj = np.stack([it.v_sql for it in chunk], axis=0) @ R[:w]
+            for it, p in zip(chunk, proj):
+                it.v_sk = p
+
+def _is_dup(vecs: np.ndarray, units: np.ndarray, norms: np.ndarray,
+            sel_units: np.ndarray, sel: List[int], nxt: int, dup_cos: float,
+            eps: float = 1e-8, tol: float = 1e-4) -> bool:
+    """Batched cosine duplicate check of vecs[nxt] against all selected rows."""
+    if norms[nxt] < eps or not sel:
+        return False
+    cos = sel_units[:len(sel)] @ units[nxt]
+    if np.any(cos >= dup_cos + tol):
+        return True
+    # re-check borderline pairs with the scalar formula so results match _cosine exactly
+    near = np.nonzero(np.abs(cos - dup_cos) < tol)[0]
+    return any(_cosine(vecs[nxt], vecs[sel[j]]) >= dup_cos for j in near)
+
+def _maxmin_sketch(vecs: np.ndarray, first: int, kk: int, dup_cos: float) -> List[int]:
+    """
+    Approximate k-center on low-dimensional sketches. One float32 matvec per
+    step yields both the squared distances (expanded form) and the cosines
+    used for duplicate checks; every near-duplicate of a new center is retired
+    at once instead of being rejected one by one.
+    """
+    V = np.ascontiguousarray(vecs, dtype=np.float32)
+    sq = np.einsum("ij,ij->i", V, V)
+    norms = np.sqrt(sq)
+    inv = np.where(norms >= 1e-8, 1.0 / np.maximum(norms, 1e-30), 0.0).astype(np.float32)
+    noise = np.float32(1e-6 * max(float(sq.max()), 1e-12))
+
+    selected = [first]
+    nn_dist = np.empty_like(sq)
+    buf = np.empty_like(sq)
+    keep = np.empty(sq.shape, dtype=bool)
+
+    def _update(i, dot, retire_dups):
+        # squared distances minus the rounding noise floor, so coinciding
+        # vectors land exactly on 0; argmax/min only need the order
+        np.multiply(dot, -2.0, out=buf)
+        np.add(buf, sq, out=buf)
+        np.add(buf, sq[i] - noise, out=buf)
+        np.maximum(buf, 0.0, out=buf)
+        np.minimum(nn_dist, buf, out=nn_dist)
+        nn_dist[i] = 0.0
+        if retire_dups:
+            np.multiply(dot, inv, out=buf)
+            np.multiply(buf, inv[i], out=buf)
+            np.less(buf, dup_cos, out=keep)
+            np.multiply(nn_dist, keep, out=nn_dist)
+
+    nn_dist.fill(np.inf)
+    _update(first, V @ V[first], True)
+    while len(selected) < kk:
+        nxt = int(np.argmax(nn_dist))
+        if nn_dist[nxt] <= 0.0:
+            if norms[nxt] < 1e-8:
+                selected.extend([nxt] * (kk - len(selected)))
+            break
+        dot = V @ V[nxt]
+        sel = np.asarray(selected)
+        is_dup = inv[nxt] > 0 and bool(np.any(dot[sel] * inv[sel] * inv[nxt] >= dup_cos))
+        if not is_dup:
+            selected.append(nxt)
+        _update(nxt, dot, not is_dup)
+    return selected
+
+def _maxmin_diverse(items: List[Item], k: int, dup_cos=0.995, use_sketch: bool = False,
+                    vecs: Optional[np.ndarray] = None) -> List[int]:
+    """k-center greedy on v_sql to maximize diversity; drop near-duplicates by cosine.
+
+    With use_sketch the k-center runs on the random-projection sketches (it.v_sk,
+    or the pre-stacked `vecs`), which is approximate but O(k*n*dim) for a small dim.
+    """
     if not items:
         return []
     # pick the farthest-from-mean first
-    vecs = np.stack([it.v_sql for it in items], axis=0)
+    if vecs is None:
+        vecs = _stack([it.v_sk if use_sketch else it.v_sql for it in items])
     mean = vecs.mean(axis=0, keepdims=True)
     d = np.sum((vecs - mean) ** 2, axis=1)
+    kk = min(k, len(items))
+    if use_sketch:
+        return _maxmin_sketch(vecs, int(np.argmax(d)), kk, dup_cos)
+
+    norms = np.linalg.norm(vecs.astype(np.float64), axis=1)
+    units = (vecs / np.where(norms > 0, norms, 1.0)[:, None]).astype(np.float32)
+    sel_units = np.zeros((kk, vecs.shape[1]), dtype=np.float32)
+
     selected = [int(np.argmax(d))]
+    sel_units[0] = units[selected[0]]
     # distances to nearest selected
     nn_dist = np.linalg.norm(vecs - vecs[selected[0]], axis=1)
-    while len(selected) < min(k, len(items)):
+    while len(selected) < kk:
         nxt = int(np.argmax(nn_dist))
-        # duplicate check
-        is_dup = False
-        for j in selected:
-            if _cosine(vecs[nxt], vecs[j]) >= dup_cos:
-                is_dup = True
-                break
-        if not is_dup:
+        if nn_dist[nxt] <= 0.0:
+            # every candidate coincides with a selected/rejected vector: only
+            # zero vectors (never duplicates) can still be picked, repeatedly
+            if norms[nxt] < 1e-8:
+                selected.extend([nxt] * (kk - len(selected)))
+            break
+        if not _is_dup(vecs, units, norms, sel_units, selected, nxt, dup_cos):
+            sel_units[len(selected)] = units[nxt]
             selected.append(nxt)
         # update dists
         nn_dist = np.minimum(nn_dist, np.linalg.norm(vecs - vecs[nxt], axis=1))
-        # early break if no progress
-        if len(selected) >= k:
-            break
     return selected
 
 def select_samples_budgeted(
@@ -110,6 +216,9 @@ def select_samples_budgeted(
     hard_tail_ratio: float = 0.20,
     template_getter=None,
     hard_cap: int | None = None,
+    sketch_dim: int | None = None,
+    sketch_min_items: int = 5000,
+    seed: int = 0,
 ) -> List[Tuple[str, float]]:
     """
     Return a subset of examples within `budget` following coverage and diversity rules.
@@ -117,7 +226,35 @@ def select_samples_budgeted(
     - Enforce per-template cap.
     - Ensure each arm has at least `arm_min_coverage` if available.
     - Fill the rest via MaxMin diversity on SQL-only embeddings.
+
+    sketch_dim (default ONTO_SAMPLER_SKETCH_DIM, 0 = off) runs the k-center on
+    `seed`-ed random-projection sketches for pools of at least `sketch_min_items`.
     """
+    items = _prep_items(examples, num_arms=num_arms)
+    return select_from_items(items, num_arms=num_arms, budget=budget,
+                             per_template_cap=per_template_cap,
+                             arm_min_coverage=arm_min_coverage,
+                             hard_tail_ratio=hard_tail_ratio,
+                             template_getter=template_getter, hard_cap=hard_cap,
+                             sketch_dim=sketch_dim, sketch_min_items=sketch_min_items,
+                             seed=seed)
+
+def select_from_items(
+    items: List[Item],
+    num_arms: int = 7,
+    budget: int = 100,
+    per_template_cap: int = 10,
+    arm_min_coverage: int = 3,
+    hard_tail_ratio: float = 0.20,
+    template_getter=None,
+    hard_cap: int | None = None,
+    sketch_dim: int | None = None,
+    sketch_min_items: int = 5000,
+    seed: int = 0,
+    hard_idx: Optional[set] = None,
+) -> List[Tuple[str, float]]:
+    """select_samples_budgeted on already prepared items.
+    hard_idx (indices into items) overrides the hard tail computed from hard_tail_ratio."""
     def _tpl_key(it):
         # 优先用外部提供的新模板键
         if template_getter is not None:
@@ -129,36 +266,57 @@ def select_samples_budgeted(
                 pass
         # 回退到旧模板：SQL-only 哈希/聚类
         return it.template   # ← 这里保持你原来的字段/算法
-    items = _prep_items(examples, num_arms=num_arms)
     if len(items) <= budget:
         return [it.raw for it in items]
 
+    if sketch_dim is None:
+        sketch_dim = int(os.getenv("ONTO_SAMPLER_SKETCH_DIM", "0"))
+    sketches = None
+    def _diverse(idxs, k):
+        nonlocal sketches
+        sub = [items[i] for i in idxs]
+        if not sketch_dim or len(idxs) < sketch_min_items:
+            return _maxmin_diverse(sub, k=k)
+        if sketches is None:
+            _sketch_items(items, sketch_dim, seed)
+            sketches = np.stack([it.v_sk for it in items], axis=0)
+        return _maxmin_diverse(sub, k=k, use_sketch=True, vecs=sketches[idxs])
+
     # 1) Hard tail (largest reward are worst latency)
     n_hard = int(math.ceil(len(items) * hard_tail_ratio))
     if hard_cap is not None:
         n_hard = min(n_hard, hard_cap)
-    hard_idx = np.argsort([it.reward for it in items])[-n_hard:].tolist()
-    hard_set = set(hard_idx)
+    rewards = np.array([it.reward for it in items])
+    if hard_idx is not None:
+        hard_set = set(hard_idx)
+    elif n_hard > 0:
+        hard_set = set(np.argpartition(rewards, len(items) - n_hard)[-n_hard:].tolist())
+    else:
+        hard_set = set(range(len(items)))  # same as argsort(...)[-0:]
 
     # 2) Enforce per-template cap: within each template, keep up to cap prioritizing hard then diverse
     by_template: Dict[str, List[int]] = defaultdict(list)
     for i, it in enumerate(items):
         tkey = _tpl_key(it)
         by_template[tkey].append(i)
-    kept = []
+    kept, kept_set = [], set()
     for tpl, idxs in by_template.items():
+        if len(kept) >= budget:
+            # later templates would only land past the budget and be trimmed in 5)
+            break
         # split hard vs non-hard
         hard = [i for i in idxs if i in hard_set]
         non  = [i for i in idxs if i not in hard_set]
         chosen = hard[:per_template_cap]
         # fill with diverse among remaining of this template
         if len(chosen) < per_template_cap and non:
-            sub = [items[i] for i in non]
-            pick_rel = _maxmin_diverse(sub, k=per_template_cap - len(chosen))
+            pick_rel = _diverse(non, per_template_cap - len(chosen))
             chosen.extend([non[j] for j in pick_rel])
-        kept.extend(chosen)
-    # de-duplicate
-    kept = list(dict.fromkeys(kept))
+        # de-duplicate
+        for i in chosen:
+            if i not in kept_set:
+                kept.append(i)
+                kept_set.add(i)
 
     # 3) Arm coverage: ensure min coverage per arm by pulling additional examples if needed
     counts_by_arm = {a:0 for a in range(num_arms)}
@@ -166,21 +324,24 @@ def select_samples_budgeted(
         counts_by_arm[items[i].arm] += 1
     need_more = [(a, arm_min_coverage - c) for a, c in counts_by_arm.items() if arm_min_coverage - c > 0]
     if need_more:
+        by_arm: Dict[int, List[int]] = defaultdict(list)
+        for i, it in enumerate(items):
+            by_arm[it.arm].append(i)
         for a, need in need_more:
-            candidates = [i for i, it in enumerate(items) if it.arm == a and i not in kept]
+            candidates = [i for i in by_arm[a] if i not in kept_set]
             if not candidates:
                 continue
             # pick diverse within arm
-            sub = [items[i] for i in candidates]
-            pick_rel = _maxmin_diverse(sub, k=need)
-            kept.extend([candidates[j] for j in pick_rel])
+            pick_rel = _diverse(candidates, need)
+            picked = [candidates[j] for j in pick_rel]
+            kept.extend(picked)
+            kept_set.update(picked)
 
     # 4) Global budget fill with MaxMin across remaining pool
     if len(kept) < budget:
-        remaining = [i for i in range(len(items)) if i not in kept]
-        sub = [items[i] for i in remaining]
+        remaining = [i for i in range(len(items)) if i not in kept_set]
         need = budget - len(kept)
-        pick_rel = _maxmin_diverse(sub, k=need)
+        pick_rel = _diverse(remaining, need)
         kept.extend([remaining[j] for j in pick_rel])
 
     # 5) If over budget (unlikely), trim by removing most redundant
@@ -190,3 +351,264 @@ def select_samples_budgeted(
     # Stable order for reproducibility
     kept = sorted(kept)
     return [items[i].raw for i in kept]
+
+# -------------------------- streaming selection --------------------------
+
+class _Reservoir:
+    """Uniform sample (Algorithm R) of at most `size` stream indices."""
+    __slots__ = ("size", "seen", "idx")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.seen = 0
+        self.idx: List[int] = []
+
+    def offer(self, i: int, rng: random.Random) -> None:
+        self.seen += 1
+        if len(self.idx) < self.size:
+            self.idx.append(i)
+            return
+        j = rng.randrange(self.seen)
+        if j < self.size:
+            self.idx[j] = i
+
+    def shrink(self, size: int, rng: random.Random) -> None:
+        # a uniform subset of a uniform sample is one: Algorithm R goes on from there
+        if len(self.idx) > size:
+            self.idx = rng.sample(self.idx, size)
+        self.size = size
+
+class _OnlineKCenter:
+    """
+    Doubling algorithm for streaming k-center: keeps at most `m` centers that are
+    pairwise farther apart than r, doubling r (and thinning) whenever it overflows.
+    """
+
+    def __init__(self, m: int):
+        self.m = max(1, m)
+        self.r = 0.0
+        self.idx: List[int] = []
+        self.C: Optional[np.ndarray] = None
+
+    def add_batch(self, idxs: List[int], vecs: np.ndarray) -> None:
+        vecs = np.asarray(vecs, dtype=np.float32)
+        start = 0
+        while start < len(idxs):
+            start = self._add_run(idxs, vecs, start)
+
+    def _add_run(self, idxs: List[int], vecs: np.ndarray, start: int) -> int:
+        # distances to the current centers in one product; points added during
+        # the run are only checked against the (few) new centers. A thin step
+        # changes r, so the run ends there and the caller restarts after it.
+        n0 = len(self.idx)
+        if n0:
+            d_old = self._dist(vecs[start:], self.C).min(axis=1)
+        else:
+            d_old = np.full(len(idxs) - start, np.inf, dtype=np.float32)
+        buf = np.empty((self.m + 1 - n0, vecs.shape[1]), dtype=np.float32)
+        bsq = np.empty(len(buf), dtype=np.float32)
+        k = 0
+        for j in np.nonzero(d_old > self.r)[0]:
+            v = vecs[start + j]
+            vsq = float(v @ v)
+            if k:
+                d2 = bsq[:k] + vsq - 2.0 * (buf[:k] @ v)
+                if float(d2.min()) <= self.r * self.r:
+                    continue
+            buf[k], bsq[k] = v, vsq
+            k += 1
+            self.idx.append(idxs[start + j])
+            if len(self.idx) > self.m:
+                self.C = np.vstack([self.C, buf[:k]]) if n0 else buf[:k].copy()
+                self._thin()
+                return start + j + 1
+        if k:
+            self.C = np.vstack([self.C, buf[:k]]) if n0 else buf[:k].copy()
+        return len(idxs)
+
+    @staticmethod
+    def _dist(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+        d2 = (A * A).sum(1)[:, None] + (B * B).sum(1)[None, :] - 2.0 * (A @ B.T)
+        return np.sqrt(np.maximum(d2, 0.0))
+
+    def _thin(self) -> None:
+        D = self._dist(self.C, self.C)
+        np.fill_diagonal(D, np.inf)
+        if self.r <= 0.0:
+            pos = D[D > 0]
+            self.r = float(pos.min()) if pos.size else 1e-12
+        while len(self.idx) > self.m:
+            self.r *= 2.0
+            keep = []
+            for j in range(len(self.idx)):
+                if not keep or D[j, keep].min() > self.r:
+                    keep.append(j)
+            self.idx = [self.idx[j] for j in keep]
+            self.C = self.C[keep]
+            D = D[np.ix_(keep, keep)]
+
+class StreamingSampler:
+    """
+    One-pass variant of select_samples_budgeted for experience that does not fit
+    in memory. Feed (plan_json, reward) batches to add(); result() runs the usual
+    selection on what was retained:
+    - per-template reservoirs, for templates in first-seen order until their
+      capped sizes cover the budget: budget * reservoir_factor slots split evenly
+      over the admitted templates, at most reservoir_factor * per_template_cap
+      each, shrunk whenever another template is admitted;
+    - a top-k heap of the largest rewards (k = hard_cap, or budget * hard_tail_ratio);
+    - per-arm reservoirs of reservoir_factor * arm_min_coverage items;
+    - an online k-center over random-projection sketches with budget centers;
+    - a uniform reservoir of budget items, so the pool never falls short of the
+      budget when the k-center has thinned out clustered data.
+    Memory is O(budget * reservoir_factor) items, independent of stream length.
+    """
+
+    def __init__(self, num_arms: int = 7, budget: int = 100, per_template_cap: int = 10,
+                 arm_min_coverage: int = 3, hard_tail_ratio: float = 0.20,
+                 template_getter=None, hard_cap: int | None = None,
+                 reservoir_factor: int = 2, sketch_dim: int = 32, seed: int = 0,
+                 featurize_executor=None):
+        self.num_arms = num_arms
+        self.budget = budget
+        self.per_template_cap = per_template_cap
+        self.arm_min_coverage = arm_min_coverage
+        self.template_getter = template_getter
+        self.hard_k = hard_cap if hard_cap is not None else int(math.ceil(budget * hard_tail_ratio))
+        self.reservoir_factor = max(1, reservoir_factor)
+        self.sketch_dim = sketch_dim
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.featurize_executor = featurize_executor  # featurize_pool.open_pool(), reused by add()
+
+        self.items: Dict[int, Item] = {}
+        self.n_seen = 0
+        self.templates: "OrderedDict[Any, _Reservoir]" = OrderedDict()
+        self.templates_full = False
+        self._tpl_covered = 0  # sum of min(seen, per_template_cap) over the templates
+        self.hard: List[Tuple[float, int]] = []  # min-heap of (reward, stream index)
+        self.arms = [_Reservoir(self.reservoir_factor * arm_min_coverage) for _ in range(num_arms)]
+        self.kcenter = _OnlineKCenter(budget)
+        self.uniform = _Reservoir(budget)
+        self._R: Optional[np.ndarray] = None
+
+    def _tpl_key(self, it: Item):
+        if self.template_getter is not None:
+            try:
+                k = self.template_getter(it)
+                if k is not None:
+                    return k
+            except Exception:
+                pass
+        return it.template
+
+    def _sketch(self, vs: List[np.ndarray]) -> np.ndarray:
+        # same projection as _sketch_items: rows are drawn in order, so growing R keeps its prefix
+        width = max(v.shape[0] for v in vs)
+        if self._R is None or self._R.shape[0] < width:
+            grow = max(width, 2 * (0 if self._R is None else self._R.shape[0]))
+            rng = np.random.default_rng(self.seed)
+            self._R = (rng.standard_normal((grow, self.sketch_dim)) / math.sqrt(self.sketch_dim)).astype(np.float32)
+        if all(v.shape[0] == width for v in vs):
+            return np.stack(vs, axis=0) @ self._R[:width]
+        return np.stack([v @ self._R[:v.shape[0]] for v in vs], axis=0)
+
+    def _admit_template(self, key) -> _Reservoir:
+        # every template covers at least one item, so at most budget are admitted
+        # and each keeps at least reservoir_factor slots
+        size = min(self.reservoir_factor * self.per_template_cap,
+                   self.reservoir_factor * self.budget // (len(self.templates) + 1))
+        for res in self.templates.values():
+            if res.size > size:
+                res.shrink(size, self.rng)
+        res = self.templates[key] = _Reservoir(size)
+        return res
+
+    def add(self, examples: Iterable[Tuple[str, float]]) -> None:
+        self.add_items(_prep_items(list(examples), num_arms=self.num_arms,
+                                   executor=self.featurize_executor))
+
+    def add_items(self, batch: List[Item]) -> None:
+        if not batch:
+            return
+        idxs = list(range(self.n_seen, self.n_seen + len(batch)))
+        self.n_seen += len(batch)
+        for i, it in zip(idxs, batch):
+            self.items[i] = it
+            key = self._tpl_key(it)
+            res = self.templates.get(key)
+            if res is None and not self.templates_full:
+                res = self._admit_template(key)
+            if res is not None:
+                res.offer(i, self.rng)
+                if res.seen <= self.per_template_cap:
+                    self._tpl_covered += 1
+                    # mirror the early break of the in-memory sampler: templates
+                    # first seen after capped sizes reach the budget are never selected
+                    self.templates_full = self._tpl_covered >= self.budget
+            if len(self.hard) < self.hard_k:
+                heapq.heappush(self.hard, (it.reward, i))
+            elif self.hard_k and it.reward > self.hard[0][0]:
+                heapq.heapreplace(self.hard, (it.reward, i))
+            self.arms[it.arm].offer(i, self.rng)
+            self.uniform.offer(i, self.rng)
+        self.kcenter.add_batch(idxs, self._sketch([it.v_sql for it in batch]))
+        self._gc()
+
+    def _retained(self) -> set:
+        keep = set(self.kcenter.idx)
+        keep.update(self.uniform.idx)
+        keep.update(i for _, i in self.hard)
+        for res in self.templates.values():
+            keep.update(res.idx)
+        for res in self.arms:
+            keep.update(res.idx)
+        return keep
+
+    def _gc(self) -> None:
+        keep = self._retained()
+        for i in [i for i in self.items if i not in keep]:
+            del self.items[i]
+
+    def result(self) -> List[Tuple[str, float]]:
+        order = sorted(self._retained())
+        pool = [self.items[i] for i in order]
+        pos = {i: p for p, i in enumerate(order)}
+        return select_from_items(pool, num_arms=self.num_arms, budget=self.budget,
+                                 per_template_cap=self.per_template_cap,
+                                 arm_min_coverage=self.arm_min_coverage,
+                                 template_getter=self.template_getter, sketch_dim=0,
+                                 seed=self.seed, hard_idx={pos[i] for _, i in self.hard})
+
+def select_samples_streaming(
+    batches: Iterable[List[Tuple[str, float]]],
+    num_arms: int = 7,
+    budget: int = 100,
+    per_template_cap: int = 10,
+    arm_min_coverage: int = 3,
+    hard_tail_ratio: float = 0.20,
+    template_getter=None,
+    hard_cap: int | None = None,
+    reservoir_factor: int = 2,
+    sketch_dim: int = 32,
+    seed: int = 0,
+) -> List[Tuple[str, float]]:
+    """
+    Streaming counterpart of select_samples_budgeted over an iterable of example
+    batches (e.g. storage.iter_experience()). See StreamingSampler. With
+    ONTO_FEATURIZE_WORKERS > 1 one featurize pool serves every batch.
+    """
+    import featurize_pool
+    pool = featurize_pool.open_pool()
+    try:
+        s = StreamingSampler(num_arms=num_arms, budget=budget, per_template_cap=per_template_cap,
+                             arm_min_coverage=arm_min_coverage, hard_tail_ratio=hard_tail_ratio,
+                             template_getter=template_getter, hard_cap=hard_cap,
+                             reservoir_factor=reservoir_factor, sketch_dim=sketch_dim, seed=seed,
+                             featurize_executor=pool)
+        for batch in batches:
+            s.add(batch)
+        return s.result()
+    finally:
+        if pool is not None:
+            pool.shutdown()
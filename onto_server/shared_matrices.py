@@ -0,0 +1,41 @@
+# shared_matrices.py
+# Pack a ragged list of 2-D float32 matrices into one shared memory block so
+# worker processes can read them without pickling every matrix.
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def pack_shared(mats):
+    """
+    Copy `mats` into a new shared memory block.
+    Returns (shm, handle). The caller owns shm and must close()/unlink() it;
+    handle is a small picklable dict for attach_shared().
+    """
+    shapes = [tuple(int(d) for d in m.shape) for m in mats]
+    sizes = [r * c for r, c in shapes]
+    offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).tolist()
+    total = max(1, offsets[-1]) * np.dtype(np.float32).itemsize
+
+    shm = shared_memory.SharedMemory(create=True, size=total)
+    flat = np.ndarray((offsets[-1],), dtype=np.float32, buffer=shm.buf)
+    for m, off, n in zip(mats, offsets, sizes):
+        flat[off:off + n] = np.asarray(m, dtype=np.float32).reshape(-1)
+    del flat
+
+    handle = {"name": shm.name, "shapes": shapes, "offsets": offsets}
+    return shm, handle
+
+
+def attach_shared(handle):
+    """
+    Attach to a block created by pack_shared().
+    Returns (shm, views). The views are backed by shm and shared with every
+    other attached process, so treat them as read-only and drop them before
+    calling shm.close().
+    """
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    flat = np.ndarray((handle["offsets"][-1],), dtype=np.float32, buffer=shm.buf)
+    views = [flat[off:off + r * c].reshape(r, c)
+             for (r, c), off in zip(handle["shapes"], handle["offsets"])]
+    return shm, views
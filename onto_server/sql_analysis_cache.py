@@ -0,0 +1,166 @@
+# sql_analysis_cache.py
+# Two-level cache for analyze_sql() results: an in-process LRU in front of a
+# SQLite table, keyed by a literal-stripped, whitespace-normalized fingerprint
+# of the SQL text. Queries of one template that differ only in their literals
+# share an entry, so a hit skips sqlglot entirely.
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from sqlglot_parse import analyze_sql
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS sql_analysis_cache (
+    fingerprint TEXT PRIMARY KEY,
+    parsed_json TEXT NOT NULL,
+    sem_json    TEXT NOT NULL,
+    parse_ms    REAL NOT NULL,
+    created_at  REAL NOT NULL
+)"""
+
+_STRING_OR_COMMENT = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+# LIMIT/OFFSET values end up in the features (limit_val), so they stay in the key
+_NUMBER = re.compile(r"\b(?:limit|offset)\s+\d+|(?<![\w.$])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?(?![\w.])", re.I)
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL text with comments dropped, literals replaced by ? and whitespace collapsed."""
+    s = _STRING_OR_COMMENT.sub(lambda m: "?" if m.group(0)[0] == "'" else " ", sql)
+    s = _NUMBER.sub(lambda m: m.group(0) if m.group(0)[0].isalpha() else "?", s)
+    s = _IN_LIST.sub("(?)", s)  # IN lists of any length
+    s = _SPACE.sub(" ", s).strip().rstrip(";").strip()
+    return s.lower()
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def _decode(parsed_json, sem_json):
+    # restore the tuples JSON turned into lists
+    parsed = json.loads(parsed_json)
+    sem = json.loads(sem_json)
+    parsed["order_by"] = [tuple(x) for x in parsed.get("order_by", [])]
+    sem["join_edges"] = [tuple(x) for x in sem.get("join_edges", [])]
+    return parsed, sem
+
+
+def encode_analysis(parsed: Dict, sem: Dict) -> str:
+    """One JSON document for an analyze_sql() result (see sql_store features_json)."""
+    return json.dumps({"parsed": parsed, "sem": sem})
+
+
+def decode_analysis(doc: str) -> Tuple[Dict, Dict]:
+    obj = json.loads(doc)
+    return _decode(json.dumps(obj["parsed"]), json.dumps(obj["sem"]))
+
+
+class SQLAnalysisCache:
+    """
+    analyze(sql) -> (parsed, sem) as analyze_sql(), served from the LRU, then the
+    SQLite table, then sqlglot. Literal-only differences (other than LIMIT and
+    OFFSET) share an entry, so fields that echo raw expression text, such as
+    select_cols[...]["raw"], come from the first query seen of that shape.
+    """
+
+    def __init__(self, db_path="onto.db", capacity=4096, read_dialect="postgres"):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.read_dialect = read_dialect
+        self._lru: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()  # JSON, JSON, parse seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits_mem = 0
+        self.hits_db = 0
+        self.misses = 0
+        self.parse_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(_DDL)
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def analyze(self, sql: str) -> Tuple[Dict, Dict]:
+        key = fingerprint(sql)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                self.hits_mem += 1
+                self.saved_seconds += entry[2]
+                return _decode(entry[0], entry[1])
+
+            row = self._db().execute(
+                "SELECT parsed_json, sem_json, parse_ms FROM sql_analysis_cache WHERE fingerprint = ?",
+                (key,)).fetchone()
+            if row is not None:
+                entry = (row[0], row[1], row[2] / 1000.0)
+                self._remember(key, entry)
+                self.hits_db += 1
+                self.saved_seconds += entry[2]
+                return _decode(row[0], row[1])
+
+        start = time.perf_counter()
+        parsed, sem = analyze_sql(sql, read_dialect=self.read_dialect)
+        took = time.perf_counter() - start
+        entry = (json.dumps(parsed), json.dumps(sem), took)
+
+        with self._lock:
+            self.misses += 1
+            self.parse_seconds += took
+            self._remember(key, entry)
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO sql_analysis_cache "
+                       "(fingerprint, parsed_json, sem_json, parse_ms, created_at) VALUES (?, ?, ?, ?, ?)",
+                       (key, entry[0], entry[1], took * 1000.0, time.time()))
+            db.commit()
+        return _decode(entry[0], entry[1])
+
+    def metrics(self) -> Dict:
+        lookups = self.hits_mem + self.hits_db + self.misses
+        return {
+            "lookups": lookups,
+            "hits_mem": self.hits_mem,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "hit_rate": (self.hits_mem + self.hits_db) / lookups if lookups else 0.0,
+            "parse_seconds": round(self.parse_seconds, 4),
+            "saved_seconds": round(self.saved_seconds, 4),
+            "lru_size": len(self._lru),
+        }
+
+
+_default = None
+
+
+def default_cache() -> SQLAnalysisCache:
+    """Process-wide cache; ONTO_SQL_CACHE_DB / ONTO_SQL_CACHE_SIZE configure it."""
+    global _default
+    if _default is None:
+        _default = SQLAnalysisCache(db_path=os.getenv("ONTO_SQL_CACHE_DB", "onto.db"),
+                                    capacity=int(os.getenv("ONTO_SQL_CACHE_SIZE", "4096")))
+    return _default
+
+
+def analyze_sql_cached(sql: str, read_dialect: str = "postgres") -> Tuple[Dict, Dict]:
+    """analyze_sql() through the default cache (ONTO_SQL_CACHE=0 bypasses it)."""
+    if os.getenv("ONTO_SQL_CACHE", "1") == "0" or read_dialect != "postgres":
+        return analyze_sql(sql, read_dialect=read_dialect)
+    return default_cache().analyze(sql)
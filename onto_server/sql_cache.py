@@ -0,0 +1,175 @@
+# sql_cache.py
+# The sql_cache table (sequence_id -> SQL text and ingest-time features) behind
+# one persistent connection and an in-memory LRU. sql_store (writer, run by the
+# query driver), storage and storage2 (readers, in the server) all go through
+# here, so they agree on the database: ONTO_DB_PATH, default onto_server/onto2.db.
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS sql_cache (
+    sequence_id   TEXT PRIMARY KEY,
+    sql_text      TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    features_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sql_cache_created ON sql_cache(created_at);
+"""
+
+# SQLite caps host parameters per statement (999 in older builds)
+_BATCH = 500
+
+_lock = threading.RLock()
+_conn = None
+_conn_pid = None
+_conn_path = None
+_lru: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+_last_rowid = 0
+
+
+def db_path() -> str:
+    return os.getenv("ONTO_DB_PATH",
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "onto2.db"))
+
+
+def _capacity() -> int:
+    return int(os.getenv("ONTO_SQL_LRU_SIZE", "10000"))
+
+
+def connection() -> sqlite3.Connection:
+    """The shared connection; PRAGMAs and DDL run once per process."""
+    global _conn, _conn_pid, _conn_path, _last_rowid
+    path = db_path()
+    with _lock:
+        # a forked child must not reuse the parent's handle
+        if _conn is not None and _conn_pid == os.getpid() and _conn_path == path:
+            return _conn
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.executescript(_DDL)
+        # databases created before features_json existed
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(sql_cache)")]
+        if "features_json" not in cols:
+            conn.execute("ALTER TABLE sql_cache ADD COLUMN features_json TEXT")
+        conn.commit()
+        _conn, _conn_pid, _conn_path = conn, os.getpid(), path
+        _lru.clear()
+        _last_rowid = 0
+        return conn
+
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None and _conn_pid == os.getpid():
+            _conn.close()
+        _conn = None
+        _lru.clear()
+
+
+def _remember(sequence_id: str, sql_text: str, features_json: Optional[str]) -> None:
+    _lru[sequence_id] = (sql_text, features_json)
+    _lru.move_to_end(sequence_id)
+    cap = _capacity()
+    while len(_lru) > cap:
+        _lru.popitem(last=False)
+
+
+def save_many(rows: Iterable[Tuple[str, str, Optional[str]]]) -> None:
+    """Insert or replace (sequence_id, sql_text, features_json) rows in one transaction."""
+    rows = [(str(sid), str(sql), feats) for sid, sql, feats in rows]
+    now = time()
+    with _lock:
+        conn = connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sql_cache (sequence_id, sql_text, created_at, features_json) "
+                "VALUES (?,?,?,?)", [(sid, sql, now, f) for sid, sql, f in rows])
+        for sid, sql, f in rows:
+            _remember(sid, sql, f)
+
+
+def save(sequence_id: str, sql_text: str, features_json: Optional[str] = None) -> None:
+    save_many([(sequence_id, sql_text, features_json)])
+
+
+def prefetch(sequence_ids: Iterable[str]) -> int:
+    """Load the given sequence_ids into the LRU in batched SELECTs; returns rows found."""
+    want = [str(s) for s in sequence_ids]
+    found = 0
+    with _lock:
+        want = [s for s in want if s not in _lru]
+        conn = connection()
+        for i in range(0, len(want), _BATCH):
+            chunk = want[i:i + _BATCH]
+            marks = ",".join("?" * len(chunk))
+            for sid, sql, f in conn.execute(
+                    f"SELECT sequence_id, sql_text, features_json FROM sql_cache "
+                    f"WHERE sequence_id IN ({marks})", chunk):
+                _remember(sid, sql, f)
+                found += 1
+    return found
+
+
+def prefetch_new(limit: Optional[int] = None) -> int:
+    """
+    Load rows written since the last call (by any process) into the LRU, newest
+    capacity-many at most. The query driver saves every SQL before running it,
+    so after one of these the server's lookups are dictionary hits.
+    """
+    global _last_rowid
+    limit = _capacity() if limit is None else limit
+    with _lock:
+        conn = connection()
+        rows = conn.execute(
+            "SELECT rowid, sequence_id, sql_text, features_json FROM sql_cache "
+            "WHERE rowid > ? ORDER BY rowid DESC LIMIT ?", (_last_rowid, int(limit))).fetchall()
+        for _, sid, sql, f in reversed(rows):
+            _remember(sid, sql, f)
+        if rows:
+            _last_rowid = rows[0][0]
+    return len(rows)
+
+
+def get(sequence_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """(sql_text, features_json) for sequence_id, or (None, None)."""
+    sid = str(sequence_id)
+    with _lock:
+        hit = _lru.get(sid)
+        if hit is not None:
+            _lru.move_to_end(sid)
+            return hit
+        # a miss usually means the driver saved a new batch: pull it in at once
+        prefetch_new()
+        hit = _lru.get(sid)
+        if hit is not None:
+            return hit
+        row = connection().execute(
+            "SELECT sql_text, features_json FROM sql_cache WHERE sequence_id = ?", (sid,)).fetchone()
+        if row is None:
+            return None, None
+        _remember(sid, row[0], row[1])
+        return row[0], row[1]
+
+
+def get_sql(sequence_id: str) -> Optional[str]:
+    return get(sequence_id)[0]
+
+
+def list_recent(limit: int = 50) -> List[Tuple[str, str, float]]:
+    """Most recent rows: [(sequence_id, sql_text, created_at), ...]."""
+    with _lock:
+        cur = connection().execute(
+            "SELECT sequence_id, sql_text, created_at FROM sql_cache ORDER BY created_at DESC LIMIT ?",
+            (int(limit),))
+        return list(cur.fetchall())
+
+
+def stats() -> Dict:
+    with _lock:
+        return {"db_path": _conn_path or db_path(), "lru_size": len(_lru), "last_rowid": _last_rowid}
@@ -226,3 +226,161 @@ def enrich_sql_semantics(sql: str, read_dialect: str = "postgres"):
         "limit_val": limit_val,
         "join_edges": join_edges,
     }
+
+
+_AGG_NAMES = ("Count", "Sum", "Avg", "Min", "Max")
+
+def analyze_sql(sql: str, read_dialect: str = "postgres") -> Tuple[Dict, Dict]:
+    """
+    parse_sqlglot + enrich_sql_semantics with one parse_one and one BFS walk of
+    the tree. Returns (parsed, sem) with exactly the same content, ready for
+    merge_parsed_sqlglot_into_meta / merge_semantics_into_meta.
+    """
+    _, parse_one, exp = _import_sqlglot()
+    tree = parse_one(sql, read=read_dialect)
+    aggs = tuple(getattr(exp, n) for n in _AGG_NAMES)
+
+    all_tables, join_nodes = [], []
+    num_cte = num_subquery = num_window = num_aggs = num_agg_distinct = 0
+    has_like = has_between = has_in = has_isnull = has_case = False
+    for node in tree.walk(bfs=True):
+        if isinstance(node, exp.Table):
+            all_tables.append(node.alias_or_name)
+        elif isinstance(node, exp.Join):
+            join_nodes.append(node)
+        elif isinstance(node, aggs):
+            num_aggs += 1
+            if isinstance(node, exp.Count) and node.args.get("distinct"):
+                num_agg_distinct += 1
+        elif isinstance(node, exp.CTE):
+            num_cte += 1
+        elif isinstance(node, exp.Subquery):
+            num_subquery += 1
+        elif isinstance(node, exp.Window):
+            num_window += 1
+        elif isinstance(node, exp.Like):
+            has_like = True
+        elif isinstance(node, exp.Between):
+            has_between = True
+        elif isinstance(node, exp.In):
+            has_in = True
+        elif isinstance(node, exp.Is):
+            has_isnull = True
+        elif isinstance(node, exp.Case):
+            has_case = True
+
+    tables = list(dict.fromkeys(n for n in all_tables if n))
+    parsed = _parse_top_level(tree, exp, aggs, tables)
+
+    # joins: parse_sqlglot renders "t.c" and pairs USING columns over the
+    # distinct tables; enrich_sql_semantics renders col.sql() over all tables
+    joins, join_edges = [], []
+    for j in join_nodes:
+        jtype = (j.args.get("kind") or "JOIN").upper()
+        on_exp = j.args.get("on")
+        if on_exp is not None:
+            for comp in on_exp.find_all(exp.EQ):
+                left = list(comp.left.find_all(exp.Column))
+                right = list(comp.right.find_all(exp.Column))
+                if left and right:
+                    joins.append({"type": jtype, "left_col": _col_to_str(left[0]),
+                                  "right_col": _col_to_str(right[0]), "is_equi": True})
+                    join_edges.append((left[0].sql(), right[0].sql(), jtype))
+        using = j.args.get("using")
+        if using:
+            cols = [u.name for u in (using.expressions or []) if isinstance(u, exp.Identifier)]
+            # parse_sqlglot only looks at USING on joins that also have an ON
+            if on_exp is not None and len(tables) >= 2:
+                t1, t2 = tables[-2], tables[-1]
+                for c in cols:
+                    joins.append({"type": jtype, "left_col": f"{t1}.{c}",
+                                  "right_col": f"{t2}.{c}", "is_equi": True})
+            if len(all_tables) >= 2:
+                t1, t2 = all_tables[-2], all_tables[-1]
+                for c in cols:
+                    join_edges.append((f"{t1}.{c}", f"{t2}.{c}", jtype))
+    parsed["joins"] = joins
+
+    limit_val = None
+    if tree.args.get("limit"):
+        try:
+            lit = tree.args["limit"].expression
+            if isinstance(lit, exp.Literal) and lit.is_number:
+                limit_val = int(lit.name)
+        except Exception:
+            pass
+
+    sem = {
+        "num_cte": num_cte,
+        "num_subquery": num_subquery,
+        "num_window": num_window,
+        "num_join": len(join_nodes),
+        "num_aggs": num_aggs,
+        "num_agg_distinct": num_agg_distinct,
+        "has_like": has_like,
+        "has_between": has_between,
+        "has_in": has_in,
+        "has_isnull": has_isnull,
+        "has_case": has_case,
+        "limit_val": limit_val,
+        "join_edges": join_edges,
+    }
+    return parsed, sem
+
+def _agg_entry(a, exp) -> Dict:
+    if isinstance(a, exp.Count) and isinstance(a.this, exp.Star):
+        arg = "*"
+    elif a.this is not None:
+        cols = _gather_columns(a.this, exp)
+        arg = cols[0] if cols else a.this.sql(dialect="postgres")
+    else:
+        arg = None
+    return {"agg": a.key.lower(), "arg": arg, "is_distinct": bool(a.args.get("distinct"))}
+
+def _parse_top_level(tree, exp, aggs, tables) -> Dict:
+    # the clause-local part of parse_sqlglot (projections, WHERE, GROUP/ORDER BY)
+    darg = tree.args.get("distinct")
+    distinct_on = []
+    if isinstance(darg, exp.Distinct):
+        for e in darg.expressions or []:
+            distinct_on += _gather_columns(e, exp)
+
+    select_cols, aggregates = [], []
+    for e in tree.expressions or []:
+        raw = e.sql(dialect="postgres")
+        entry = {"agg": None, "arg": None, "is_distinct": False}
+        if isinstance(e, aggs):
+            entry = _agg_entry(e, exp)
+            aggregates.append(entry)
+        else:
+            # nested aggregates: the last one found describes the column
+            for a in e.find_all(aggs):
+                entry = _agg_entry(a, exp)
+                aggregates.append(entry)
+        select_cols.append({"raw": raw, **entry})
+
+    where_cols = _gather_columns(tree.args["where"], exp) if tree.args.get("where") else []
+
+    group_by = []
+    if tree.args.get("group"):
+        for e in tree.args["group"].expressions or []:
+            group_by += _gather_columns(e, exp)
+
+    order_by: List[Tuple[str, str]] = []
+    if tree.args.get("order"):
+        for s in tree.args["order"].expressions or []:
+            cols = _gather_columns(s, exp)
+            direction = "DESC" if s.args.get("desc") else "ASC"
+            order_by.append((cols[0], direction) if cols else (s.sql(dialect="postgres"), direction))
+
+    return {
+        "tables": tables,
+        "joins": [],
+        "select_cols": select_cols,
+        "where_cols": list(dict.fromkeys(where_cols)),
+        "group_by": list(dict.fromkeys(group_by)),
+        "order_by": order_by,
+        "has_distinct": bool(darg),
+        "distinct_on": list(dict.fromkeys(distinct_on)),
+        "aggregates": aggregates,
+    }
@@ -35,11 +35,9 @@ CREATE TABLE IF NOT EXISTS experience_for_experimental (
 
 
 def get_sql(sequence_id: str) -> Optional[str]:
-    """Return SQL text by sequence_id or None if absent."""
-    with _onto_db() as con:
-        cur = con.execute("SELECT sql_text FROM sql_cache WHERE sequence_id = ?", (str(sequence_id),))
-        row = cur.fetchone()
-        return row[0] if row else None
+    """Return SQL text by sequence_id or None if absent (see sql_cache.py)."""
+    import sql_cache
+    return sql_cache.get_sql(sequence_id)
 
 def record_reward(plan, reward, pid):
     with _onto_db() as conn:
@@ -67,6 +65,17 @@ def experience():
         c.execute("SELECT plan, reward FROM experience")
         return c.fetchall()
 
+def iter_experience(batch_size=1000):
+    """Yield the experience table in (plan, reward) batches through one cursor."""
+    with _onto_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT plan, reward FROM experience")
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
 def experiment_experience():
     all_experiment_experience = []
     for res in experiment_results():
@@ -122,6 +131,40 @@ WHERE efe.experience_id IS NULL
         return [{"id": x[0], "query": x[1], "arm": x[2]}
                 for x in c.fetchall()]
 
+def num_unexecuted_experiments():
+    """len(unexecuted_experiments()) as a single COUNT query."""
+    with _onto_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+WITH arms(arm_idx) AS (VALUES (0),(1),(2),(3),(4))
+SELECT count(*)
+FROM experimental_query eq, arms
+LEFT OUTER JOIN experience_for_experimental efe
+     ON eq.id = efe.experimental_id AND arms.arm_idx = efe.arm_idx
+WHERE efe.experience_id IS NULL
+""")
+        return c.fetchone()[0]
+
+def num_experiment_experience():
+    """len(experiment_experience()) as a single COUNT query."""
+    with _onto_db() as conn:
+        c = conn.cursor()
+        c.execute("""
+SELECT count(*)
+FROM experimental_query eq,
+     experience_for_experimental efe,
+     experience e
+WHERE eq.id = efe.experimental_id AND e.id = efe.experience_id
+""")
+        return c.fetchone()[0]
+
+def status_counts():
+    return {
+        "Unexecuted experiments": num_unexecuted_experiments(),
+        "Completed experiments": num_experiment_experience(),
+        "Exploration queries": num_experimental_queries(),
+    }
+
 def experiment_results():
     with _onto_db() as conn:
         c = conn.cursor()
@@ -6,14 +6,13 @@ from typing import Optional, Iterable, Tuple, List
 
 from common import OntoException
 
-def _onto2_db():
-    conn = sqlite3.connect("onto2.db")
-    return conn
+import sql_cache
 
 
 def get_sql(sequence_id: str) -> Optional[str]:
-    with _onto2_db() as con:
-        cur = con.execute("SELECT sql_text FROM sql_cache WHERE sequence_id = ?", (str(sequence_id),))
-        row = cur.fetchone()
-        return row[0] if row else None
+    return sql_cache.get_sql(sequence_id)
 
+def get_sql_features(sequence_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """(sql_text, features_json) by sequence_id; features_json is set when
+    sql_store analyzed the query at ingest time."""
+    return sql_cache.get(sequence_id)
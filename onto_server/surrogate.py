@@ -0,0 +1,234 @@
+# surrogate.py
+# A ridge regression over featurize.pooled_summary vectors, distilled from the
+# CNN at train time, and the cascade select_plan runs it in: the surrogate
+# scores every arm in microseconds, and the CNN forward pass only runs when
+# the surrogate's best two arms are too close to call.
+import logging
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+import featurize
+
+logger = logging.getLogger(__name__)
+
+
+class Surrogate:
+    """
+    raw = predict(mats, arm_ids) approximates the CNN's delta[arm] output on
+    the same matrices, so the model's rewards() maps it like the CNN's.
+    """
+
+    def __init__(self, num_arms, feature_mode="broadcast", alpha=1.0):
+        self.num_arms = num_arms
+        self.feature_mode = feature_mode
+        self.alpha = alpha
+        self.mean = self.scale = self.weights = None
+        self.report = {}
+
+    def features(self, mats, arm_ids):
+        pooled = np.stack([featurize.pooled_summary(X, self.feature_mode) for X in mats])
+        arms = np.zeros((len(mats), self.num_arms), dtype=np.float32)
+        arms[np.arange(len(mats)), arm_ids] = 1.0
+        return np.concatenate([pooled, arms], axis=1).astype(np.float64)
+
+    def fit(self, mats, arm_ids, raw):
+        """Fit to the teacher's raw outputs for (mats, arm_ids)."""
+        F = self.features(mats, arm_ids)
+        y = np.asarray(raw, dtype=np.float64)
+        self.mean = F.mean(axis=0)
+        self.scale = F.std(axis=0)
+        self.scale[self.scale < 1e-8] = 1.0
+        Z = np.hstack([(F - self.mean) / self.scale, np.ones((len(F), 1))])
+        reg = self.alpha * np.eye(Z.shape[1])
+        reg[-1, -1] = 0.0
+        self.weights = np.linalg.solve(Z.T @ Z + reg, Z.T @ y)
+        fitted = Z @ self.weights
+        ss = float(np.sum((y - y.mean()) ** 2))
+        self.report = {"samples": len(y),
+                       "r2": 1.0 - float(np.sum((y - fitted) ** 2)) / ss if ss > 0 else 1.0}
+        return self
+
+    def predict(self, mats, arm_ids):
+        Z = (self.features(mats, arm_ids) - self.mean) / self.scale
+        return Z @ self.weights[:-1] + self.weights[-1]
+
+
+def distill(mats, arm_ids, raw, num_arms, feature_mode="broadcast", holdout=0.2, seed=0):
+    """
+    A Surrogate fitted to the teacher's raw outputs, or None if there is too
+    little data. Its report carries the R^2 on a `holdout` share of the
+    samples, from a fit without them, before the final fit on everything.
+    """
+    if len(mats) < 2:
+        return None
+    raw = np.asarray(raw, dtype=np.float64)
+    order = np.random.default_rng(seed).permutation(len(mats))
+    n_test = int(len(mats) * holdout)
+    holdout_r2 = None
+    if n_test >= 2:
+        test, train = order[:n_test], order[n_test:]
+        probe = Surrogate(num_arms, feature_mode).fit([mats[i] for i in train],
+                                                      [arm_ids[i] for i in train], raw[train])
+        pred = probe.predict([mats[i] for i in test], [arm_ids[i] for i in test])
+        ss = float(np.sum((raw[test] - raw[test].mean()) ** 2))
+        holdout_r2 = 1.0 - float(np.sum((raw[test] - pred) ** 2)) / ss if ss > 0 else 1.0
+    s = Surrogate(num_arms, feature_mode).fit(mats, arm_ids, raw)
+    s.report["holdout_r2"] = holdout_r2
+    return s
+
+
+def margin(rewards):
+    """Relative gap between the best (lowest) and the second best predicted reward."""
+    if len(rewards) < 2:
+        return float("inf")
+    a, b = np.partition(np.asarray(rewards, dtype=float), 1)[:2]
+    return float((b - a) / max(abs(a), 1e-9))
+
+
+class Cascade:
+    """
+    predict(model, plans, forward) for a model with featurize(),
+    predict_featurized(), rewards() and a surrogate: the surrogate's rewards when its margin is at least
+    `min_margin`, otherwise the CNN's. A sample of `audit` of the accepted
+    requests also runs the CNN to measure how often the two disagree.
+    Surrogates whose holdout R^2 against the CNN is below `min_r2` (or was
+    never measured) are not used at all, nor are those of ensembles and of
+    models with a kNN memory.
+    """
+
+    def __init__(self, min_margin=0.25, audit=0.05, min_r2=0.9, seed=0):
+        self.min_margin = min_margin
+        self.audit = audit
+        self.min_r2 = min_r2
+        self._skipped = set()  # id() of the surrogates already logged as skipped
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = self.hits = self.audited = self.disagreements = 0
+        self.fast_seconds = self.full_seconds = 0.0
+        self.full_runs = 0
+
+    def applies(self, model):
+        """Whether model's requests go through the cascade; a skipped surrogate is logged once."""
+        if not (getattr(model, "surrogate", None) is not None
+                and hasattr(model, "featurize") and hasattr(model, "predict_featurized")):
+            return False
+        reason = self._skip_reason(model)
+        if reason is None:
+            return True
+        with self._lock:
+            first = id(model.surrogate) not in self._skipped
+            self._skipped.add(id(model.surrogate))
+        if first:
+            logger.info("[CASCADE] surrogate not used: %s", reason)
+        return False
+
+    def _skip_reason(self, model):
+        # an ensemble's spread is choose_arm's UCB bonus for every arm, and
+        # the surrogate has none: ensembles always run in full
+        if getattr(getattr(model, "model", None), "members", 1) > 1:
+            return "ensemble model, choose_arm needs every arm's spread"
+        # the kNN memory blends the CNN's output with the rewards of the nearest
+        # training plans by embedding; the surrogate was distilled from the
+        # unblended output and has no embedding, so it cannot stand in for it
+        if getattr(model, "knn", None) is not None:
+            return "kNN memory (ONTO_KNN=1) blends the CNN's output, the surrogate's is unblended"
+        r2 = model.surrogate.report.get("holdout_r2")
+        if r2 is None:
+            return "no holdout R^2 (too few samples at distillation)"
+        if r2 < self.min_r2:
+            return f"holdout R^2 {r2:.3f} < ONTO_CASCADE_MIN_R2 {self.min_r2}"
+        return None
+
+    def predict(self, model, plans, forward=None, with_std=False, cache=None, keys=None):
+        """
+        with_std also returns the CNN ensemble's spread, None when the
+        surrogate answered. With a prediction_cache.PredictionCache (and the
+        request's keys from it) both predictors' outputs are looked up there
+        first; the accept decision is still made on every arm of the request.
+        """
+        if not plans:
+            empty = np.array([], dtype=float)
+            return (empty, None) if with_std else empty
+        built = {}  # plan index -> (matrix, arm id), featurized on first use
+        took = {"fast": 0.0, "full": 0.0}
+
+        def _featurize(idx):
+            todo = [i for i in idx if i not in built]
+            if todo:
+                built.update(zip(todo, zip(*model.featurize([plans[i] for i in todo]))))
+            return [built[i][0] for i in idx], [built[i][1] for i in idx]
+
+        def _fast(idx):
+            mats, arm_ids = _featurize(idx)
+            start = time.perf_counter()
+            out = model.rewards(model.surrogate.predict(mats, arm_ids))
+            took["fast"] += time.perf_counter() - start
+            return out
+
+        def _full(idx):
+            mats, arm_ids = _featurize(idx)
+            start = time.perf_counter()
+            out = model.predict_featurized(mats, arm_ids, forward, with_std=True)
+            took["full"] += time.perf_counter() - start
+            return out
+
+        every = list(range(len(plans)))
+        if cache is None:
+            fast = _fast(every)
+        else:
+            fast = cache.predict(keys, _fast, predictor="surrogate")
+
+        accept = margin(fast) >= self.min_margin
+        audit = accept and self._rng.random() < self.audit
+        full, std = None, None
+        if not accept or audit:
+            if cache is None:
+                full, std = _full(every)
+            else:
+                full, std = cache.predict(keys, _full, with_std=True, predictor="cnn")
+
+        with self._lock:
+            self.requests += 1
+            self.fast_seconds += took["fast"]
+            if accept:
+                self.hits += 1
+            if full is not None:
+                self.full_runs += 1
+                self.full_seconds += took["full"]
+            if audit:
+                self.audited += 1
+                self.disagreements += int(np.argmin(fast) != np.argmin(full))
+        pred = fast if full is None else full
+        return (pred, std) if with_std else pred
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_margin": self.min_margin,
+                "min_r2": self.min_r2,
+                "requests": self.requests,
+                "hit_rate": self.hits / self.requests if self.requests else None,
+                "surrogate_ms_mean": round(self.fast_seconds / self.requests * 1000.0, 4)
+                if self.requests else None,
+                "cnn_ms_mean": round(self.full_seconds / self.full_runs * 1000.0, 4)
+                if self.full_runs else None,
+                "audited": self.audited,
+                "disagreement_rate": self.disagreements / self.audited if self.audited else None,
+            }
+
+
+def from_env():
+    """
+    A Cascade unless ONTO_CASCADE=0; ONTO_CASCADE_MARGIN, ONTO_CASCADE_AUDIT
+    and ONTO_CASCADE_MIN_R2 set its margin, audit rate and the holdout R^2 a
+    surrogate needs to be used.
+    """
+    if os.getenv("ONTO_CASCADE", "1") == "0":
+        return None
+    return Cascade(min_margin=float(os.getenv("ONTO_CASCADE_MARGIN", "0.25")),
+                   audit=float(os.getenv("ONTO_CASCADE_AUDIT", "0.05")),
+                   min_r2=float(os.getenv("ONTO_CASCADE_MIN_R2", "0.9")))
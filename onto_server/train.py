@@ -6,6 +6,12 @@ import reg_blocker
 import json
 import sampler
 import copy
+import itertools
+import multiprocessing
+import shared_matrices
+from concurrent.futures import ProcessPoolExecutor
+
+NUM_ARMS = 6
 
 class OntoTrainingException(Exception):
     pass
@@ -18,50 +24,161 @@ def train_and_swap(fn, old, tmp, verbose=False):
     else:
         old_model = None
 
-    new_model = train_and_save_model(tmp, verbose=verbose)
-    max_retries = 5
-    current_retry = 1
-    while not reg_blocker.should_replace_model(old_model, new_model):
-        if current_retry >= max_retries == 0:
+    candidates = int(os.getenv("ONTO_TRAIN_CANDIDATES", "1"))
+    if candidates > 1:
+        new_model = train_candidates_and_pick(old_model, tmp, candidates,
+                                              verbose=verbose)
+        if new_model is None:
             print("Could not train model with better regression profile.")
             return
-        
-        print("New model rejected when compared with old model. "
-              + "Trying to retrain with emphasis on regressions.")
-        print("Retry #", current_retry)
-        new_model = train_and_save_model(tmp, verbose=verbose,
-                                         emphasize_experiments=current_retry)
-        current_retry += 1
+    else:
+        new_model = train_and_save_model(tmp, verbose=verbose)
+        max_retries = 5
+        current_retry = 1
+        while not reg_blocker.should_replace_model(old_model, new_model):
+            if current_retry >= max_retries == 0:
+                print("Could not train model with better regression profile.")
+                return
+            
+            print("New model rejected when compared with old model. "
+                  + "Trying to retrain with emphasis on regressions.")
+            print("Retry #", current_retry)
+            new_model = train_and_save_model(tmp, verbose=verbose,
+                                             emphasize_experiments=current_retry)
+            current_retry += 1
 
     if os.path.exists(fn):
         shutil.rmtree(old, ignore_errors=True)
         os.rename(fn, old)
     os.rename(tmp, fn)
 
-def train_and_save_model(fn, verbose=True, emphasize_experiments=0):
+def _train_candidate(handle, idx, arm_ids, rewards, seed, out_dir, threads, verbose):
+    # runs in a worker process: train on shared-memory views and save to out_dir
+    import torch
+    torch.set_num_threads(threads)
+
+    shm, views = shared_matrices.attach_shared(handle)
+    try:
+        reg = model.OntoRegression(have_cache_data=True, verbose=verbose)
+        # checkpoints go to out_dir: an interrupted retrain resumes there
+        os.makedirs(out_dir, exist_ok=True)
+        reg.fit_featurized([views[i] for i in idx], arm_ids, rewards, seed=seed,
+                           checkpoint_dir=out_dir)
+        reg.save(out_dir)
+    finally:
+        del views
+        shm.close()
+    return out_dir
+
+def train_candidates_and_pick(old_model, tmp, num_candidates, verbose=False):
+    """
+    Train `num_candidates` models in parallel, candidate c emphasizing the
+    experiment experience c times and using seed ONTO_TRAIN_SEED + c. The
+    experience is featurized once and shared with the workers through shared
+    memory. Every candidate goes through the regression checker; the best
+    acceptable one is moved to `tmp` and returned (None if none is acceptable).
+    """
+    base = _select_experience()
+    if not base:
+        raise OntoTrainingException("Cannot train a Onto model with no experience")
+    extra = storage.experiment_experience()
+    rows = base + extra
+
+    X_list, arm_ids, kept = model.featurize_training_set(
+        _experience_to_plans(rows), NUM_ARMS)
+    base_idx = [i for i, pos in enumerate(kept) if pos < len(base)]
+    extra_idx = [i for i, pos in enumerate(kept) if pos >= len(base)]
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(num_candidates, int(os.getenv("ONTO_TRAIN_WORKERS", str(cpus)))))
+    threads = max(1, cpus // workers)
+    seed0 = int(os.getenv("ONTO_TRAIN_SEED", "0"))
+    out_dirs = [f"{tmp}_candidate{c}" for c in range(num_candidates)]
+
+    # the candidate directories go whether training or selection fails or not;
+    # the picked one has been renamed to tmp by then
+    try:
+        shm, handle = shared_matrices.pack_shared(X_list)
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                jobs = []
+                for c in range(num_candidates):
+                    idx = base_idx + extra_idx * c
+                    jobs.append(pool.submit(_train_candidate, handle, idx,
+                                            [arm_ids[i] for i in idx],
+                                            [rows[kept[i]][1] for i in idx],
+                                            seed0 + c, out_dirs[c], threads, verbose))
+                for job in jobs:
+                    job.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        cur_profile = reg_blocker.compute_regressions(old_model)
+        print("Old model # regressions:", cur_profile[0],
+              "regression amount:", cur_profile[1])
+
+        best = None
+        for c, d in enumerate(out_dirs):
+            cand = model.OntoRegression(have_cache_data=True)
+            cand.load(d)
+            profile = reg_blocker.compute_regressions(cand)
+            print("Candidate", c, "# regressions:", profile[0],
+                  "regression amount:", profile[1])
+            if reg_blocker.is_better_profile(cur_profile, profile):
+                if best is None or tuple(profile) < best[0]:
+                    best = (tuple(profile), c, cand)
+
+        if best is not None:
+            print("Picked candidate", best[1])
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.rename(out_dirs[best[1]], tmp)
+    finally:
+        for d in out_dirs:
+            shutil.rmtree(d, ignore_errors=True)
+    return best[2] if best is not None else None
+
+def _select_experience(emphasize_experiments=0):
     BUDGET = int(os.getenv("ONTO_BUDGET", "1000"))
     TEMPLATE_CAP = int(os.getenv("ONTO_TEMPLATE_CAP", "100"))
     ARM_MIN = int(os.getenv("ONTO_ARM_MIN", "5"))
     HARD_RATIO = float(os.getenv("ONTO_HARD_RATIO", "0.20"))
 
+    def _tpl_get(it):
+        return it.meta.get("template_id", None)
+
+    if os.getenv("ONTO_SAMPLER_STREAMING", "0") == "1":
+        # one pass over a cursor, memory bounded by the budget
+        batches = itertools.chain(
+            storage.iter_experience(),
+            (storage.experiment_experience() for _ in range(emphasize_experiments)))
+        return sampler.select_samples_streaming(
+            batches,
+            num_arms=NUM_ARMS,
+            budget=BUDGET,
+            per_template_cap=TEMPLATE_CAP,
+            arm_min_coverage=ARM_MIN,
+            hard_tail_ratio=HARD_RATIO,
+            template_getter=_tpl_get
+        )
+
     all_experience = storage.experience()
 
     for _ in range(emphasize_experiments):
         all_experience.extend(storage.experiment_experience())
-    
-    def _tpl_get(it):
-        return it.meta.get("template_id", None)
 
-    all_experience = sampler.select_samples_budgeted(
+    return sampler.select_samples_budgeted(
         all_experience,
-        num_arms=6,
+        num_arms=NUM_ARMS,
         budget=BUDGET,
         per_template_cap=TEMPLATE_CAP,
         arm_min_coverage=ARM_MIN,
         hard_tail_ratio=HARD_RATIO,
         template_getter=_tpl_get
     )
-    
+
+def _experience_to_plans(all_experience):
     x = []
     for j, r in all_experience:
         obj = json.loads(j)
@@ -79,6 +196,11 @@ def train_and_save_model(fn, verbose=True, emphasize_experiments=0):
                 "metadata": obj.get("metadata", {}),
                 "arm_config": obj.get("arm_config", {}),
             })
+    return x
+
+def train_and_save_model(fn, verbose=True, emphasize_experiments=0):
+    all_experience = _select_experience(emphasize_experiments)
+    x = _experience_to_plans(all_experience)
 
     y = [i[1] for i in all_experience]        
     
@@ -89,7 +211,9 @@ def train_and_save_model(fn, verbose=True, emphasize_experiments=0):
         print("Warning: trying to train a Onto model with fewer than 20 datapoints.")
 
     reg = model.OntoRegression(have_cache_data=True, verbose=verbose)
-    reg.fit(x, y)
+    # checkpoints go to fn: an interrupted retrain resumes there
+    os.makedirs(fn, exist_ok=True)
+    reg.fit(x, y, checkpoint_dir=fn)
     reg.save(fn)
     return reg
 
@@ -0,0 +1,159 @@
+# warmup.py
+# Warm-up run by start_server before the socket accepts connections: import the
+# lazily loaded modules, open the databases, and push canned requests built from
+# sample_queries through featurize / predict / choose_arm, so the first real
+# query does not pay for imports, kernel/allocator init and cold caches.
+import contextlib
+import glob
+import io
+import logging
+import os
+import time
+
+SAMPLE_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_queries")
+NUM_ARMS = 6
+
+logger = logging.getLogger(__name__)
+
+
+def preload_modules(with_torch=True):
+    """Import (and exercise once) the modules the request path loads lazily."""
+    import sklearn.preprocessing  # noqa: F401
+    import featurize  # noqa: F401
+    import featurize_pool  # noqa: F401
+    from sqlglot_parse import analyze_sql
+    # sqlglot loads dialects and builds tokenizer tables on first use
+    analyze_sql("SELECT a.x FROM a JOIN b ON a.id = b.id WHERE a.y = 1")
+    if with_torch:
+        # only a torch-backed model needs it; the NumPy engine never imports it
+        import torch
+        torch.zeros(1).sum()
+
+
+def prime_storage():
+    """Create the onto.db schema and open the SQL caches."""
+    import storage
+    import sql_cache
+    from sql_analysis_cache import default_cache
+    storage.experience_size()
+    sql_cache.prefetch_new()
+    default_cache().metrics()
+
+
+def _canned_request(sql, num_arms, seq):
+    """(arms, buffers, metadata) shaped like a `query` message, built from SQL text alone."""
+    from sql_analysis_cache import analyze_sql_cached
+
+    parsed, sem = analyze_sql_cached(sql)
+    tables = parsed["tables"] or ["t"]
+    cols = {t: [] for t in tables}
+    for side in [c for j in parsed["joins"] for c in (j["left_col"], j["right_col"])] + parsed["where_cols"]:
+        if "." in side:
+            t, c = side.split(".", 1)
+            if t in cols and c not in cols[t]:
+                cols[t].append(c)
+
+    meta = {"sequence_id": f"warmup-{seq}", "tables": tables}
+    meta.update(cols)
+    meta["table-features"] = [{"name": t, "inSQL": True, "hasInWhere": False, "hasInJoin": True,
+                               "hasInGroup": False, "hasInSort": False, "hasNumeric": False,
+                               "hasIndex": False, "hasCorr": False} for t in tables]
+    meta["attributes"] = [{"name": f"{t}.{c}", "inSQL": True, "inWhere": f"{t}.{c}" in parsed["where_cols"],
+                           "inJoin": True, "inGroup": False, "inSort": False, "isNumeric": False,
+                           "hasIndex": False, "correlationAbove0.9": False}
+                          for t in tables for c in cols[t]]
+
+    join_types = ["Hash Join", "Nested Loop", "Merge Join"]
+    arms = []
+    for a in range(num_arms):
+        plan = {"Node Type": "Seq Scan", "Relation Name": tables[0],
+                "Total Cost": 100.0, "Plan Rows": 1000, "Plan Depth": 0}
+        for d, t in enumerate(tables[1:], 1):
+            scan = {"Node Type": "Index Scan" if (a + d) % 2 else "Seq Scan", "Relation Name": t,
+                    "Total Cost": 100.0 * d, "Plan Rows": 1000 * d, "Plan Depth": d}
+            plan = {"Node Type": join_types[(a + d) % 3], "Total Cost": 1000.0 * d * (a + 1),
+                    "Plan Rows": 1000 * d, "Plan Depth": d, "Hash Cond": "", "Plans": [plan, scan]}
+        arms.append({"Plan": plan, "arm_config": {"index": a}})
+    return arms, {}, meta
+
+
+def canned_requests(limit=8, num_arms=NUM_ARMS, queries_dir=None):
+    queries_dir = queries_dir or os.getenv("ONTO_WARMUP_QUERIES", SAMPLE_QUERIES)
+    out = []
+    for i, fp in enumerate(sorted(glob.glob(os.path.join(queries_dir, "*.sql")))[:limit]):
+        try:
+            with open(fp) as f:
+                out.append(_canned_request(f.read(), num_arms, i))
+        except Exception:
+            logger.exception("[WARMUP] could not build a request from %s", fp)
+    return out
+
+
+def _select(onto_model, req):
+    arms, buffers, meta = req
+    arms = [dict(a, Plan=dict(a["Plan"])) for a in arms]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return onto_model.select_plan(arms + [buffers, dict(meta)], record=False)
+
+
+def _exercise_without_model(req):
+    # no model yet: still warm featurization, templates and arm selection
+    import featurize
+    import numpy as np
+    import storage
+    from choose_arm import choose_arm
+    from onto_utils_template import template_from_plan_meta
+
+    arms, _, meta = req
+    meta = featurize.augment_meta_from_plan(arms[0]["Plan"], dict(meta))
+    for a in arms:
+        m = dict(meta, arm_config_json=a["arm_config"])
+        featurize.build_feature_matrix(m, NUM_ARMS, a)
+    tpl = template_from_plan_meta(arms[0], meta)
+    choose_arm(tpl, model_scores=np.zeros(len(arms)), tpl_seen_n=storage.get_template_seen_n(tpl),
+               min_seen_tpl=2, tpl_arm_stats=storage.read_tpl_arm_stats(tpl))
+
+
+def warm_up(onto_model, limit=None):
+    """
+    Run the warm-up; returns {"seconds", "requests", "first_request_ms"}, where
+    first_request_ms is the latency of one more canned request after warm-up,
+    i.e. what the first real query should see.
+    """
+    limit = int(os.getenv("ONTO_WARMUP_QUERIES_LIMIT", "8")) if limit is None else limit
+    start = time.perf_counter()
+    preload_modules(with_torch=onto_model.inference() == "torch")
+    prime_storage()
+    reqs = canned_requests(limit)
+    has_model = onto_model.has_model()
+    for req in reqs:
+        try:
+            if has_model:
+                _select(onto_model, req)
+            else:
+                _exercise_without_model(req)
+        except Exception:
+            logger.exception("[WARMUP] canned request failed")
+    took = time.perf_counter() - start
+
+    # canned predictions must neither answer the first-request probe nor real queries
+    cache = getattr(onto_model, "cache", None)
+    if cache is not None:
+        cache.clear()
+    first_ms = None
+    if reqs:
+        t0 = time.perf_counter()
+        try:
+            if has_model:
+                _select(onto_model, reqs[0])
+            else:
+                _exercise_without_model(reqs[0])
+            first_ms = (time.perf_counter() - t0) * 1000.0
+        except Exception:
+            pass
+    if cache is not None:
+        cache.clear()
+    report = {"seconds": round(took, 3), "requests": len(reqs),
+              "first_request_ms": None if first_ms is None else round(first_ms, 2)}
+    logger.info("[WARMUP] %s", report)
+    return report
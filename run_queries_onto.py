@@ -89,8 +89,8 @@ for c_idx, chunk in enumerate(onto_chunks):
     onto_entries.append(cur)
 
 # ✅ 一次性批量落库（不再在 run_query 内逐条保存）
-sql_store.bulk_save_sql(seq_pairs)
-print(f"[INFO] Bulk-saved {len(seq_pairs)} SQLs into sql_cache.")
+sql_store.bulk_save_sql(seq_pairs, analyze=True)
+print(f"[INFO] Bulk-saved and analyzed {len(seq_pairs)} SQLs into sql_cache.")
 
 print("Executing queries using PG optimizer for initial training")
 
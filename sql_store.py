@@ -1,10 +1,11 @@
 
 from __future__ import annotations
+import multiprocessing
 import os
-import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, Iterable, Tuple
 
-from time import time
 
 # --- Force sql_store to use onto_server/onto.db -----------------------------
 from pathlib import Path
@@ -19,92 +20,91 @@ ONTO_DB_DEFAULT.parent.mkdir(parents=True, exist_ok=True)
 # 提前设置统一的环境变量，让 storage.py 也用同一个 DB（非常关键）
 os.environ.setdefault("ONTO_DB_PATH", str(ONTO_DB_DEFAULT))
 
-# 供本模块 fallback 使用
+# 供本模块 fallback 使用 (onto_server/sql_cache.py reads the same variable)
 DEFAULT_DB_PATH = os.environ["ONTO_DB_PATH"]
 # ---------------------------------------------------------------------------
 
-_SQLCACHE_DDL = """
-CREATE TABLE IF NOT EXISTS sql_cache (
-    sequence_id TEXT PRIMARY KEY,
-    sql_text    TEXT NOT NULL,
-    created_at  REAL NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_sql_cache_created ON sql_cache(created_at);
-"""
-
-def _conn():
-    db_path = DEFAULT_DB_PATH
-    conn = sqlite3.connect(db_path)
-    with conn:
-        c = conn.cursor()
-        # Safe PRAGMA for better durability/perf
-        c.execute("PRAGMA journal_mode=WAL;")
-        c.execute("PRAGMA synchronous=NORMAL;")
-        c.executescript(_SQLCACHE_DDL)
-    return conn
+def _onto_server_path():
+    # sql_cache and the analyzer live in onto_server/, which uses flat imports
+    p = str(PROJECT_ROOT / "onto_server")
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+def _cache():
+    _onto_server_path()
+    import sql_cache
+    return sql_cache
 
 def init():
     """Explicit initializer (optional). Safe to call multiple times."""
-    _ = _conn()
-    try:
-        _.close()
-    except Exception:
-        pass
+    _cache().connection()
 
 def save_sql(sequence_id: str, sql_text: str) -> None:
     """Save/overwrite a SQL text for a given sequence_id."""
-    from time import time as _now
-    con = _conn()
-    try:
-        with con:
-            con.execute(
-                "INSERT OR REPLACE INTO sql_cache(sequence_id, sql_text, created_at) VALUES (?,?,?)",
-                (str(sequence_id), str(sql_text), float(_now()))
-            )
-    finally:
-        try:
-            con.close()
-        except Exception:
-            pass
+    _cache().save(sequence_id, sql_text)
 
 def get_sql(sequence_id: str) -> Optional[str]:
     """Return SQL text by sequence_id or None if absent."""
-    con = _conn()
-    try:
-        cur = con.execute("SELECT sql_text FROM sql_cache WHERE sequence_id = ?", (str(sequence_id),))
-        row = cur.fetchone()
-        return row[0] if row else None
-    finally:
-        try:
-            con.close()
-        except Exception:
-            pass
+    return _cache().get_sql(sequence_id)
 
 def list_recent_sql(limit: int = 50) -> Iterable[Tuple[str, str, float]]:
     """Return recent N rows: [(sequence_id, sql_text, created_at), ...]."""
-    con = _conn()
+    return _cache().list_recent(limit)
+
+
+def _analyze_one(sql: str) -> Optional[str]:
+    """Worker: analyze_sql() result as features_json, or None if sqlglot fails."""
+    _onto_server_path()
+    from sqlglot_parse import analyze_sql
+    from sql_analysis_cache import encode_analysis
     try:
-        cur = con.execute(
-            "SELECT sequence_id, sql_text, created_at FROM sql_cache ORDER BY created_at DESC LIMIT ?",
-            (int(limit),)
-        )
-        return list(cur.fetchall())
-    finally:
-        try:
-            con.close()
-        except Exception:
-            pass
-
-
-def bulk_save_sql(sequence_sql_pairs):
+        parsed, sem = analyze_sql(sql, read_dialect="postgres")
+    except Exception:
+        return None
+    return encode_analysis(parsed, sem)
+
+def analyze_sqls(sqls, workers: Optional[int] = None):
+    """
+    features_json for each SQL text. Texts that only differ in literals share
+    one analysis (same fingerprint as the server's SQL analysis cache); the
+    distinct ones are analyzed across `workers` processes
+    (default ONTO_INGEST_WORKERS, else cpu_count).
+    """
+    _onto_server_path()
+    from sql_analysis_cache import fingerprint
+
+    keys = [fingerprint(q) for q in sqls]
+    todo = {}
+    for k, q in zip(keys, sqls):
+        todo.setdefault(k, q)
+
+    if workers is None:
+        workers = int(os.getenv("ONTO_INGEST_WORKERS", str(os.cpu_count() or 1)))
+    workers = max(1, min(workers, len(todo)))
+    if workers == 1:
+        done = {k: _analyze_one(q) for k, q in todo.items()}
+    else:
+        # fork where available: spawn would re-run the caller's __main__
+        # (run_queries_onto.py has no main guard); sqlglot is fork-safe
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            done = dict(zip(todo, pool.map(_analyze_one, todo.values(), chunksize=8)))
+    return [done[k] for k in keys]
+
+def bulk_save_sql(sequence_sql_pairs, analyze: Optional[bool] = None, workers: Optional[int] = None):
     """
     sequence_sql_pairs: List[Tuple[str, str]]
     一次性批量写入 sql_cache (sequence_id, sql_text, created_at)
+    With analyze (default: on when ONTO_ANALYZE_ON_INGEST=1) the sqlglot features
+    are computed up front and stored in features_json, so the server's reward
+    path does not parse the SQL again.
     """
-    con = _conn()
-    con.executemany(
-        "INSERT OR REPLACE INTO sql_cache (sequence_id, sql_text, created_at) VALUES (?,?,?)",
-        [(sid, sql, time()) for (sid, sql) in sequence_sql_pairs]
-    )
-    con.commit()
-    con.close()
\ No newline at end of file
+    if analyze is None:
+        analyze = os.getenv("ONTO_ANALYZE_ON_INGEST", "0") == "1"
+    pairs = list(sequence_sql_pairs)
+    if analyze and pairs:
+        features = analyze_sqls([sql for _, sql in pairs], workers=workers)
+    else:
+        features = [None] * len(pairs)
+    _cache().save_many([(sid, sql, f) for (sid, sql), f in zip(pairs, features)])